@@ -136,6 +136,34 @@ MEDIA_ROOT = BASE_DIR / "media"
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
+# Кэш: по умолчанию локальный (на процесс). В проде с несколькими воркерами —
+# общий бэкенд, например CACHE_BACKEND=django.core.cache.backends.db.DatabaseCache
+# и CACHE_LOCATION=ai_chat_cache (после `manage.py createcachetable`).
+CACHES = {
+    "default": {
+        "BACKEND": config("CACHE_BACKEND", default="django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": config("CACHE_LOCATION", default="ai-chat-default"),
+    },
+    # ответы моделей: ограниченный по размеру кэш с вытеснением старых записей
+    "completions": {
+        "BACKEND": config("COMPLETION_CACHE_BACKEND", default="django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": config("COMPLETION_CACHE_LOCATION", default="ai-chat-completions"),
+        "OPTIONS": {
+            "MAX_ENTRIES": config("COMPLETION_CACHE_MAX_ENTRIES", default=5000, cast=int),
+            "CULL_FREQUENCY": 10,  # при переполнении выкидываем 1/10 самых старых
+        },
+    },
+    # сгенерированные диаграммы (mermind/services/generation_cache.py)
+    "diagrams": {
+        "BACKEND": config("DIAGRAM_CACHE_BACKEND", default="django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": config("DIAGRAM_CACHE_LOCATION", default="ai-chat-diagrams"),
+        "OPTIONS": {
+            "MAX_ENTRIES": config("DIAGRAM_CACHE_MAX_ENTRIES", default=2000, cast=int),
+            "CULL_FREQUENCY": 10,
+        },
+    },
+}
+
 EMAIL_HOST = "smtp.gmail.com"
 EMAIL_PORT = 587
 EMAIL_USE_TLS = True
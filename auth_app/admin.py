@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import User
+from .models import QuotaUsage, User
 
 class UserAdmin(admin.ModelAdmin):
     list_display = ('username', 'first_name', 'last_name', 'email', 'id', 'is_staff', 'is_superuser')
@@ -7,3 +7,10 @@ class UserAdmin(admin.ModelAdmin):
     search_fields = ('username', 'first_name', 'last_name', 'email')
 
 admin.site.register(User, UserAdmin)
+
+
+@admin.register(QuotaUsage)
+class QuotaUsageAdmin(admin.ModelAdmin):
+    list_display = ('user', 'kind', 'window_start', 'used', 'updated_at')
+    list_filter = ('kind',)
+    search_fields = ('user__email',)
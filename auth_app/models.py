@@ -39,3 +39,20 @@ class User(AbstractUser):
 
     def __str__(self):
         return self.email
+
+
+class QuotaUsage(models.Model):
+    """Сколько запросов вида kind пользователь сделал в окне (копия счётчика из кэша)."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='quota_usage')
+    kind = models.CharField(max_length=16)  # text / code / image / diagram
+    window_start = models.DateTimeField()
+    used = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'kind', 'window_start'], name='auth_quota_user_kind_window'),
+        ]
+
+    def __str__(self):
+        return f"{self.user} {self.kind} {self.window_start:%Y-%m-%d %H:%M}: {self.used}"
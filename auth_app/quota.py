@@ -0,0 +1,212 @@
+# auth_app/quota.py
+import logging
+import threading
+import time
+from asgiref.sync import sync_to_async
+from datetime import datetime, timezone as dt_timezone
+from decouple import config
+from django.core.cache import cache
+from rest_framework.exceptions import APIException
+from payment import entitlements
+from .models import QuotaUsage
+
+logger = logging.getLogger("auth_app")
+
+# Квоты на запросы к моделям: счётчик на (пользователь, вид, окно) в общем
+# кэше, атомарный incr — проверка стоит микросекунды и не ходит в БД.
+# Из БД (QuotaUsage) счётчик только поднимается, если его нет в кэше
+# (рестарт/вытеснение), и раз в QUOTA_FLUSH_SEC туда же сбрасывается.
+# Лимиты по тарифам — в payment.entitlements (тариф берём оттуда же, из кэша).
+KINDS = entitlements.KINDS
+FREE = entitlements.LIMITS["free"]
+PREMIUM = entitlements.LIMITS["premium"]
+GUEST = entitlements.LIMITS["guest"]
+
+# По умолчанию выключено: включать после того, как фронт научится показывать
+# 429 (гостям открытый ask_model с включёнными квотами сразу отвечает 429).
+QUOTA_ENABLED = config("QUOTA_ENABLED", default=False, cast=bool)
+QUOTA_WINDOW_SEC = config("QUOTA_WINDOW_SEC", default=86400, cast=int)
+QUOTA_FLUSH_SEC = config("QUOTA_FLUSH_SEC", default=30, cast=int)
+QUOTA_PREFIX = "quota:v1:"
+
+# окна, счётчики которых этот процесс менял со времени последнего сброса в БД
+_dirty: set[tuple[int, str, int]] = set()
+_dirty_lock = threading.Lock()
+_last_flush = time.monotonic()
+
+
+class QuotaExceeded(APIException):
+    """429 c Retry-After до начала следующего окна (DRF ставит заголовок по wait)."""
+    status_code = 429
+    default_code = "quota_exceeded"
+
+    def __init__(self, kind: str, limit: int, used: int, reset_at: int):
+        self.wait = max(1, reset_at - int(time.time()))
+        super().__init__()
+        # числа отдаём числами: detail из APIException привёл бы их к строкам
+        self.detail = {
+            "error": "quota exceeded",
+            "kind": kind,
+            "limit": limit,
+            "used": used,
+            "reset_at": reset_at,
+        }
+
+
+def window_start(at: float | None = None) -> int:
+    at = time.time() if at is None else at
+    return int(at // QUOTA_WINDOW_SEC) * QUOTA_WINDOW_SEC
+
+
+def _key(user_id: int, kind: str, start: int) -> str:
+    return f"{QUOTA_PREFIX}{user_id}:{kind}:{start}"
+
+
+def _window_dt(start: int) -> datetime:
+    return datetime.fromtimestamp(start, tz=dt_timezone.utc)
+
+
+def _ttl(start: int) -> int:
+    # счётчик живёт до конца окна с запасом на последний сброс в БД
+    return max(1, int(start + QUOTA_WINDOW_SEC - time.time()) + QUOTA_FLUSH_SEC)
+
+
+def limits_for(user) -> dict:
+    return entitlements.limits(user)
+
+
+def _seed(user_id: int, kind: str, start: int) -> int:
+    """Значение счётчика из БД — только если в кэше его нет."""
+    used = (
+        QuotaUsage.objects.filter(user_id=user_id, kind=kind, window_start=_window_dt(start))
+        .values_list("used", flat=True)
+        .first()
+    ) or 0
+    cache.add(_key(user_id, kind, start), used, timeout=_ttl(start))
+    return used
+
+
+def consume(user, kind: str, amount: int = 1) -> int:
+    """
+    Списывает amount запросов вида kind; возвращает, сколько использовано
+    в окне. Не хватает лимита — QuotaExceeded, счётчик не растёт.
+    Списываем до запроса к провайдеру; если он не ответил — refund().
+    """
+    if not QUOTA_ENABLED:
+        return 0
+    start = window_start()
+    reset_at = start + QUOTA_WINDOW_SEC
+    limit = limits_for(user).get(kind, 0)
+    if limit <= 0:
+        raise QuotaExceeded(kind, limit, 0, reset_at)
+
+    key = _key(user.pk, kind, start)
+    if cache.get(key) is None:
+        _seed(user.pk, kind, start)
+    try:
+        used = cache.incr(key, amount)
+    except ValueError:  # ключ вытеснили между seed и incr
+        used = _seed(user.pk, kind, start) + amount
+        cache.set(key, used, timeout=_ttl(start))
+
+    if used > limit:
+        # откатываем свой инкремент: конкурент мог на мгновение увидеть
+        # лишнюю единицу и тоже получить отказ — на границе лимита это допустимо
+        _decr(key, amount)
+        logger.info("quota exceeded user=%s kind=%s limit=%s", user.pk, kind, limit)
+        raise QuotaExceeded(kind, limit, used - amount, reset_at)
+
+    with _dirty_lock:
+        _dirty.add((user.pk, kind, start))
+    maybe_flush()
+    return used
+
+
+async def aconsume(user, kind: str) -> int:
+    if not QUOTA_ENABLED:
+        return 0
+    return await sync_to_async(consume)(user, kind)
+
+
+def _decr(key: str, amount: int) -> None:
+    try:
+        if cache.decr(key, amount) < 0:
+            cache.set(key, 0, timeout=_ttl(window_start()))
+    except ValueError:
+        # ключ вытеснили: поднимется из БД, откатывать нечего
+        pass
+
+
+def refund(user, kind: str, amount: int = 1, at: float | None = None) -> None:
+    """
+    Возвращает списанное consume(), когда провайдер не ответил (ошибка или
+    «модель недоступна»). at — время списания: задача из очереди может
+    упасть уже в следующем окне, возвращать надо в то, из которого списали.
+    """
+    if not QUOTA_ENABLED or not getattr(user, "is_authenticated", False):
+        return
+    start = window_start(at)
+    _decr(_key(user.pk, kind, start), amount)
+    with _dirty_lock:
+        _dirty.add((user.pk, kind, start))
+    logger.info("quota refund user=%s kind=%s amount=%s", user.pk, kind, amount)
+
+
+async def arefund(user, kind: str, amount: int = 1) -> None:
+    if not QUOTA_ENABLED:
+        return
+    await sync_to_async(refund)(user, kind, amount)
+
+
+def usage(user) -> dict:
+    """Использовано в текущем окне по видам (для me_flags)."""
+    if not getattr(user, "is_authenticated", False):
+        return {kind: 0 for kind in KINDS}
+    start = window_start()
+    keys = {kind: _key(user.pk, kind, start) for kind in KINDS}
+    cached = cache.get_many(list(keys.values()))
+    result = {kind: cached.get(key) for kind, key in keys.items()}
+    missing = [kind for kind, used in result.items() if used is None]
+    if missing:
+        stored = dict(
+            QuotaUsage.objects.filter(user=user, kind__in=missing, window_start=_window_dt(start))
+            .values_list("kind", "used")
+        )
+        for kind in missing:
+            result[kind] = stored.get(kind, 0)
+    return result
+
+
+def flush() -> int:
+    """
+    Пишет в БД текущие значения изменённых счётчиков. Пишем абсолютное
+    значение из кэша, а не дельту, — сброс из нескольких воркеров идемпотентен.
+    """
+    global _last_flush
+    with _dirty_lock:
+        pending = list(_dirty)
+        _dirty.clear()
+        _last_flush = time.monotonic()
+    if not pending:
+        return 0
+    values = cache.get_many([_key(*item) for item in pending])
+    written = 0
+    for user_id, kind, start in pending:
+        used = values.get(_key(user_id, kind, start))
+        if used is None:
+            continue
+        QuotaUsage.objects.update_or_create(
+            user_id=user_id, kind=kind, window_start=_window_dt(start), defaults={"used": used}
+        )
+        written += 1
+    return written
+
+
+def maybe_flush() -> None:
+    if time.monotonic() - _last_flush < QUOTA_FLUSH_SEC:
+        return
+    try:
+        flush()
+    except Exception:
+        # квоты не должны ронять запрос: счётчик остаётся в кэше
+        logger.exception("quota flush failed")
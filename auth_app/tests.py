@@ -1,3 +1,167 @@
-from django.test import TestCase
+# auth_app/tests.py
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 
-# Create your tests here.
+import pytest
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from auth_app import quota
+from auth_app.models import QuotaUsage
+from chat_app.models import Answer, Category, Question
+from chat_app.tokens import Usage
+from payment.models import Subscription
+
+User = get_user_model()
+
+
+@pytest.fixture(autouse=True)
+def _clear_cache():
+    for c in caches.all():
+        c.clear()
+    yield
+    for c in caches.all():
+        c.clear()
+
+
+@pytest.fixture(autouse=True)
+def _quota_enabled(monkeypatch):
+    # по умолчанию квоты выключены (QUOTA_ENABLED) — здесь проверяем включённые
+    monkeypatch.setattr(quota, "QUOTA_ENABLED", True)
+
+
+@pytest.fixture
+def user():
+    return User.objects.create_user(email="q@test.io", password="x")
+
+
+@pytest.fixture
+def api(user):
+    client = APIClient()
+    client.force_authenticate(user)
+    return client
+
+
+@pytest.mark.django_db
+def test_exceeded_quota_is_rejected_before_any_model_call(api, user, monkeypatch):
+    calls = []
+    monkeypatch.setattr(
+        "chat_app.serializers.answer_question", lambda *a, **kw: calls.append(a) or Answer(content="ok", model="m")
+    )
+    monkeypatch.setattr(
+        "mermind.views.generate", lambda *a, **kw: calls.append(a) or ("flowchart", "flowchart TD\nA-->B", [], "m")
+    )
+    category = Category.objects.create(name="Квоты", owner=user)
+    url = f"/api/chat/categories/{category.id}/questions/"
+    body = {"prompt": "привет", "model": "m", "model_type": "text", "category_id": str(category.id), "language": "ru"}
+
+    assert api.post(url, body, format="json").status_code == 201
+    resp = api.post(url, body, format="json")
+    assert resp.status_code == 429
+    assert int(resp["Retry-After"]) > 0
+    assert resp.json()["kind"] == "text"
+    assert resp.json()["limit"] == quota.FREE["text"]
+    assert len(calls) == 1
+    assert Question.objects.count() == 1  # отказ — до сохранения вопроса
+
+    # другой вид считается отдельно
+    # разные описания: повтор того же отдаётся из кэша генерации и квоту не тратит
+    diagram = {"text": "схема", "type": "", "language": "ru"}
+    assert api.post("/api/mermaid/generate/", diagram, format="json").status_code == 200
+    diagram["text"] = "другая схема"
+    assert api.post("/api/mermaid/generate/", diagram, format="json").status_code == 429
+    assert len(calls) == 2
+
+
+@pytest.mark.django_db
+def test_premium_gets_premium_limits_and_guest_gets_none(user):
+    Subscription.objects.create(
+        user=user, plan="monthly", status="active", next_charge_at=timezone.now() + timedelta(days=3)
+    )
+    assert [quota.consume(user, "code") for _ in range(quota.PREMIUM["code"])] == [1, 2, 3]
+    with pytest.raises(quota.QuotaExceeded):
+        quota.consume(user, "code")
+
+    resp = APIClient().post("/api/chat/test-query/", {"prompt": "x", "model_id": "m"}, format="json")
+    assert resp.status_code == 429
+
+
+@pytest.mark.django_db(transaction=True)
+def test_counter_is_atomic_under_concurrency_and_flushes_to_db(user, monkeypatch):
+    monkeypatch.setitem(quota.FREE, "text", 5)
+    monkeypatch.setattr(quota, "QUOTA_FLUSH_SEC", 3600)  # сбрасываем вручную
+
+    def attempt(_):
+        try:
+            quota.consume(user, "text")
+            return True
+        except quota.QuotaExceeded:
+            return False
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(attempt, range(20)))
+    assert results.count(True) == 5
+    assert quota.usage(user)["text"] == 5
+
+    assert quota.flush() == 1
+    row = QuotaUsage.objects.get(user=user, kind="text")
+    assert row.used == 5
+
+    # кэш потерян — счётчик поднимается из БД, лимит не обнуляется
+    for c in caches.all():
+        c.clear()
+    assert quota.usage(user)["text"] == 5
+    with pytest.raises(quota.QuotaExceeded):
+        quota.consume(user, "text")
+
+
+@pytest.mark.django_db
+def test_quota_is_refunded_when_provider_fails(api, user, monkeypatch):
+    category = Category.objects.create(name="Отказы", owner=user)
+    url = f"/api/chat/categories/{category.id}/questions/"
+    body = {"prompt": "привет", "model": "m", "model_type": "text", "category_id": str(category.id), "language": "ru"}
+
+    # «модель недоступна» — Answer без модели, запрос не засчитываем
+    monkeypatch.setattr(
+        "chat_app.utils.query_provider", lambda **kw: ("Модель недоступна", 0, None, Usage())
+    )
+    assert api.post(url, body, format="json").status_code == 201
+    assert quota.usage(user)["text"] == 0
+
+    def _down(*a, **kw):
+        raise RuntimeError("all models failed")
+
+    monkeypatch.setattr("mermind.views.generate", _down)
+    assert api.post("/api/mermaid/generate/", {"text": "схема"}, format="json").status_code == 503
+    assert quota.usage(user)["diagram"] == 0
+
+    # провайдер упал исключением — квота возвращается, ошибка уходит дальше
+    def _crash(**kw):
+        raise ConnectionError("provider crashed")
+
+    monkeypatch.setattr("chat_app.utils.query_provider", _crash)
+    crashing = APIClient(raise_request_exception=False)
+    crashing.force_authenticate(user)
+    assert crashing.post(url, {**body, "prompt": "другой"}, format="json").status_code == 500
+    assert quota.usage(user)["text"] == 0
+
+    # счётчик вытеснили — откат и возврат не падают и не уходят в минус
+    for c in caches.all():
+        c.clear()
+    quota.refund(user, "text")
+    assert quota.usage(user)["text"] == 0
+
+
+@pytest.mark.django_db
+def test_client_cannot_raise_own_quantity(api, user):
+    resp = api.post("/api/auth/update-quantity/", {"quantity": -100}, format="json")
+    assert resp.status_code == 200
+    user.refresh_from_db()
+    assert user.quantity == 0
+    assert resp.json()["total_quantity"] == 0
+
+    flags = api.get("/api/auth/me/flags/").json()
+    assert flags["tier"] == "free"
+    assert flags["used"] == {"text": 0, "code": 0, "image": 0, "diagram": 0}
@@ -20,8 +20,9 @@ from .serializers import CustomPasswordResetSerializer
 from rest_framework_simplejwt.tokens import BlacklistedToken, TokenError
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated, IsAuthenticatedOrReadOnly, AllowAny
-from django.utils.timezone import now
-from payment.models import Subscription
+from django.db.models import F
+from payment import entitlements
+from . import quota
 from ai_chat_django import settings
 import logging
 logger = logging.getLogger("auth_app")
@@ -279,41 +280,41 @@ def update_name(request):
 @api_view(["POST"])
 @permission_classes([IsAuthenticated])
 def update_quantity(request):
+    """
+    Счётчик вопросов ведёт сервер (quota.consume при каждом запросе к модели).
+    Клиент его больше не меняет: возвращаем текущее значение. Править вручную
+    может только персонал.
+    """
     user = request.user
     quantity_to_add = request.data.get("quantity", 0)
 
     if not isinstance(quantity_to_add, int):
         return Response({"error": "Invalid quantity value"}, status=400)
 
-    user.quantity += quantity_to_add  # Обновляем количество вопросов
-    user.save(update_fields=["quantity"])
+    if user.is_staff and quantity_to_add:
+        User.objects.filter(pk=user.pk).update(quantity=F("quantity") + quantity_to_add)
+        user.refresh_from_db(fields=["quantity"])
+        return Response(
+            {"message": "Количество вопросов обновлено", "total_quantity": user.quantity}
+        )
     return Response(
-        {"message": "Количество вопросов обновлено", "total_quantity": user.quantity}
+        {"message": "Количество вопросов считает сервер", "total_quantity": user.quantity}
     )
 
 
-
-# FREE = {"text": 100, "code": 100, "image": 1, "diagram": 100}
-FREE = {"text": 1, "code": 1, "image": 1, "diagram": 1}
-PREMIUM = {"text": 3, "code": 3, "image": 1, "diagram": 3}
-
 @api_view(["GET"])
 @permission_classes([IsAuthenticatedOrReadOnly])
 def me_flags(request):
     user = request.user if request.user.is_authenticated else None
 
-    is_premium = False
-    if user:
-        is_premium = Subscription.objects.filter(
-            user=user, status="active", next_charge_at__gt=now()
-        ).exists()
-
-    limits = PREMIUM if is_premium else (FREE if user else {"text":0,"code":0,"image":0,"diagram":0})
+    rights = entitlements.resolve(request.user)  # из кэша, в БД — только на промахе
     logger.info("me_flags user=%s premium=%s limits=%s",
-                getattr(user, "id", None), is_premium, limits)
+                getattr(user, "id", None), rights["is_premium"], rights["limits"])
     return Response({
         "is_authenticated": bool(user),
-        "is_premium": is_premium,
-        "tier": ("premium" if is_premium else ("free" if user else "guest")),
-        "limits": limits,
+        "is_premium": rights["is_premium"],
+        "tier": rights["tier"],
+        "limits": rights["limits"],
+        "used": quota.usage(request.user),
+        "reset_at": quota.window_start() + quota.QUOTA_WINDOW_SEC,
         })
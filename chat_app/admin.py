@@ -1,7 +1,7 @@
 # ai-chat-django/chat_app/admin.py
 from django.contrib import admin
 from django.utils.safestring import mark_safe
-from .models import Category, Question, Answer, GeneratedImage
+from .models import Category, Question, Answer, GeneratedImage, GenerationJob
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
@@ -24,7 +24,7 @@ class QuestionAdmin(admin.ModelAdmin):
 @admin.register(Answer)
 class AnswerAdmin(admin.ModelAdmin):
     """Админка ответов"""
-    list_display = ("truncated_content", "question", "model", "id", "tokens_used")
+    list_display = ("truncated_content", "question", "model", "id", "tokens_used", "latency_ms", "finish_reason")
     list_filter = ("model", "created_at")
     search_fields = ("content", "question__prompt")
     
@@ -45,3 +45,12 @@ class GeneratedImageAdmin(admin.ModelAdmin):
             return mark_safe(f'<img src="{obj.url}" style="max-height: 100px;" />')
         return "No image available"
     preview.short_description = "Preview"
+
+
+@admin.register(GenerationJob)
+class GenerationJobAdmin(admin.ModelAdmin):
+    """Админка очереди генерации"""
+    list_display = ("id", "status", "attempts", "question", "locked_by", "run_after", "created_at")
+    list_filter = ("status", "created_at")
+    search_fields = ("question__prompt", "error")
+    list_select_related = ("question",)
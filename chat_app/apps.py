@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class ChatAppConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "chat_app"
+
+    def ready(self):
+        import chat_app.signals  # индекс поиска (search.py) следует за вопросами и ответами
@@ -0,0 +1,62 @@
+# chat_app/async_api.py
+import json
+from functools import wraps
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.exceptions import APIException, AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+
+def _authenticate_jwt(request):
+    try:
+        result = JWTAuthentication().authenticate(request)
+    except AuthenticationFailed:
+        return None
+    return result[0] if result else None
+
+
+def async_api_view(methods=("POST",), auth_required=True):
+    """
+    Лёгкий аналог @api_view для async-вьюх (DRF async не умеет):
+    JWT-авторизация, JSON-тело в request.data, ответы JsonResponse;
+    APIException (например, QuotaExceeded) превращается в ответ, как в DRF.
+    Сессии/CSRF не используем — только Bearer-токен.
+    """
+    def decorator(view):
+        @csrf_exempt
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in methods:
+                return JsonResponse({"detail": f'Method "{request.method}" not allowed.'}, status=405)
+
+            user = await sync_to_async(_authenticate_jwt)(request)
+            if auth_required and user is None:
+                return JsonResponse(
+                    {"detail": "Authentication credentials were not provided."}, status=401
+                )
+            request.api_user = user
+
+            try:
+                request.data = json.loads(request.body or b"{}")
+            except ValueError:
+                return JsonResponse({"detail": "JSON parse error."}, status=400)
+            if not isinstance(request.data, dict):
+                return JsonResponse({"detail": "JSON object expected."}, status=400)
+
+            try:
+                return await view(request, *args, **kwargs)
+            except APIException as exc:
+                # как обработчик исключений DRF: статус, detail и Retry-After
+                response = JsonResponse(
+                    exc.detail if isinstance(exc.detail, (dict, list)) else {"detail": exc.detail},
+                    status=exc.status_code,
+                    safe=False,
+                )
+                if getattr(exc, "wait", None):
+                    response["Retry-After"] = "%d" % exc.wait
+                return response
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,79 @@
+# chat_app/async_views.py
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.db.models import F
+from django.http import JsonResponse
+from .async_api import async_api_view
+from .models import Category, Question
+from .serializers import QuestionSerializer
+from .utils import aanswer_question, answer_failed
+from .jobs import IMAGE_QUEUE, enqueue
+from .model_providers.openrouter.query import aquery_openrouter
+from auth_app import quota
+
+User = get_user_model()
+
+
+@async_api_view(auth_required=False)
+async def ask_model(request):
+    """Async-двойник /test-query/."""
+    data = request.data
+    if not data.get("prompt") or not data.get("model_id"):
+        return JsonResponse({"error": "prompt and model_id are required"}, status=400)
+    await quota.aconsume(request.api_user, "text")
+
+    result = await aquery_openrouter(
+        prompt=data["prompt"],
+        model_id=data["model_id"],
+        language=data.get("language", "en"),
+    )
+    if result[1] is None:
+        await quota.arefund(request.api_user, "text")
+    return JsonResponse(list(result), safe=False)
+
+
+@async_api_view()
+async def create_question(request, category_pk):
+    """Async-двойник QuestionViewSet.create: тот же вход и тот же ответ (201)."""
+    user = request.api_user
+    serializer = QuestionSerializer(data=request.data)
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=400)
+    data = serializer.validated_data
+
+    try:
+        category = await Category.objects.aget(id=data["category_id"])
+    except Category.DoesNotExist:
+        return JsonResponse({"error": "category not found"}, status=404)
+
+    await quota.aconsume(user, data["model_type"])
+
+    question = await Question.objects.acreate(
+        prompt=data["prompt"],
+        category=category,
+        user=user,
+        model=data["model"],
+        model_type=data["model_type"],
+        language=data.get("language", "en"),
+    )
+    if IMAGE_QUEUE and question.model_type == Question.IMAGE:
+        # как и в sync-вьюхе: картинку рисует воркер очереди, клиент поллит jobs/<id>/
+        job = await sync_to_async(enqueue)(question, data.get("language", "en"), data.get("conversation", False))
+        await User.objects.filter(pk=user.pk).aupdate(quantity=F("quantity") + 1)
+        return JsonResponse(
+            {"job_id": str(job.id), "question_id": str(question.id), "status": job.status},
+            status=202,
+        )
+
+    try:
+        answer = await aanswer_question(question, data.get("language", "en"), conversation_mode=data.get("conversation", False))
+    except Exception:
+        await quota.arefund(user, data["model_type"])
+        raise
+    if answer_failed(answer):
+        await quota.arefund(user, data["model_type"])
+    await User.objects.filter(pk=user.pk).aupdate(quantity=F("quantity") + 1)
+
+    question = await Question.objects.with_answers().aget(id=question.id)
+    payload = await sync_to_async(lambda: QuestionSerializer(question).data)()
+    return JsonResponse(payload, status=201)
@@ -0,0 +1,74 @@
+# chat_app/compare.py
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from decouple import config
+from .models import Answer, Question
+from . import completion_cache
+from .streaming import _answer_payload, sse_event
+from .utils import completion_cache_key, provider_params
+from .model_providers.openrouter.query import _headers, _payload, complete_once
+from .model_providers.openrouter.selector import get_top_models
+from auth_app import quota
+
+# Сравнение моделей: один промпт → N моделей параллельно (ограниченный пул),
+# каждый ответ уходит клиенту SSE-событием, как только готов, и сохраняется
+# отдельным Answer того же Question. Итог — max(задержка), а не сумма.
+COMPARE_MAX_MODELS = config("CHAT_COMPARE_MAX_MODELS", default=6, cast=int)
+COMPARE_WORKERS = config("CHAT_COMPARE_WORKERS", default=4, cast=int)
+
+
+def comparable_models(model_type: str) -> list[str]:
+    """Модели витрины get_top_models() для типа вопроса (в порядке здоровья)."""
+    group = "code_models" if model_type == Question.CODE else "text_models"
+    return [m["model_id"] for m in get_top_models().get(group, [])]
+
+
+def ask_exact(prompt: str, model_type: str, model_id: str, language: str = "en"):
+    """
+    Ответ именно этой модели — без fallback (иначе в сравнении окажутся две
+    одинаковые модели). Ошибка — исключение. Возвращает (content, model, usage).
+    """
+    cache_key = completion_cache_key(prompt, model_type, model_id, language)
+    if cached := completion_cache.lookup(cache_key):
+        content, _tokens, used_model, usage = cached
+        return content, used_model, usage
+
+    system_prompt, temperature = provider_params(model_type, language)
+    completion = complete_once(_headers(), _payload(prompt, model_id, system_prompt, temperature))
+    completion_cache.store(cache_key, completion.content, completion.usage.total_tokens, completion.model, completion.usage)
+    return completion.content, completion.model, completion.usage
+
+
+def stream_comparison(question: Question, model_ids: list[str], language: str = "en"):
+    """
+    Генератор SSE: question → (answer | model_error)* → done.
+    Запросы к моделям идут в пуле потоков, Answer пишем в потоке запроса.
+    """
+    yield sse_event("question", {"id": question.id, "models": model_ids})
+
+    pool = ThreadPoolExecutor(max_workers=max(1, min(COMPARE_WORKERS, len(model_ids))), thread_name_prefix="compare")
+    futures = {
+        pool.submit(ask_exact, question.prompt, question.model_type, model_id, language): model_id
+        for model_id in model_ids
+    }
+    answered, failed = [], []
+    try:
+        for future in as_completed(futures):
+            model_id = futures[future]
+            try:
+                content, used_model, usage = future.result()
+            except Exception as e:
+                print(f"[compare] {model_id}: {e}")
+                failed.append(model_id)
+                yield sse_event("model_error", {"model": model_id, "error": str(e)[:300]})
+                continue
+            answer = Answer.objects.create(
+                question=question, content=content, model=used_model or model_id, **usage.answer_fields()
+            )
+            answered.append(model_id)
+            yield sse_event("answer", {"requested_model": model_id, **_answer_payload(answer)})
+        if not answered:  # сравнение не состоялось — единицу квоты возвращаем
+            quota.refund(question.user, question.model_type)
+        yield sse_event("done", {"question": question.id, "answered": answered, "failed": failed})
+    finally:
+        # клиент ушёл — не начатые запросы отменяем, начатые дорабатывают в фоне
+        pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,86 @@
+# chat_app/completion_cache.py
+import hashlib
+import json
+from dataclasses import replace
+from decouple import config
+from django.core.cache import caches
+from . import metrics
+from .tokens import Usage
+
+# Отдельный алиас кэша (settings.CACHES["completions"]) — со своим лимитом
+# записей и вытеснением, чтобы ответы моделей не выдавливали остальной кэш.
+CACHE_ALIAS = "completions"
+COMPLETION_TTL = config("COMPLETION_CACHE_TTL", default=3600, cast=int)
+MAX_CONTENT_CHARS = config("COMPLETION_CACHE_MAX_CHARS", default=100_000, cast=int)
+KEY_VERSION = "v1"
+
+
+def completion_key(
+    prompt: str,
+    model_id: str,
+    model_type: str,
+    language: str,
+    system_prompt: str,
+    temperature: float,
+    history: list[dict] | None = None,
+) -> str:
+    """
+    Детерминированный ключ (sha256 от всех входов запроса), одинаковый во всех
+    воркерах и после перезапуска — в отличие от рандомизированного hash().
+    История диалога входит в ключ; без неё ключ прежний.
+    """
+    parts = [model_id, model_type, language, system_prompt, float(temperature), prompt]
+    if history:
+        parts.append(history)
+    raw = json.dumps(parts, ensure_ascii=False, separators=(",", ":"))
+    digest = hashlib.sha256(raw.encode("utf-8")).hexdigest()
+    return f"completion:{KEY_VERSION}:{digest}"
+
+
+def _cacheable(content: str, used_model: str | None) -> bool:
+    # used_model=None — это сообщение «OpenRouter недоступен», его не кэшируем
+    return bool(content) and used_model is not None and len(content) <= MAX_CONTENT_CHARS
+
+
+def lookup(key: str):
+    """(content, tokens_used, used_model, usage) или None."""
+    value = _unpack(caches[CACHE_ALIAS].get(key))
+    metrics.incr("completion_cache.hits" if value else "completion_cache.misses")
+    return value
+
+
+def _unpack(value):
+    if not value:
+        return None
+    content, tokens_used, used_model, *rest = value  # записи до usage — из трёх полей
+    usage = Usage.from_dict(rest[0] if rest else None)
+    # ответ из кэша провайдер не генерировал — задержки у него нет
+    return content, tokens_used, used_model, replace(usage, latency_ms=None)
+
+
+def _pack(content: str, tokens_used: int, used_model: str | None, usage: Usage | None) -> tuple:
+    return (content, tokens_used, used_model, (usage or Usage()).as_dict())
+
+
+def store(key: str, content: str, tokens_used: int, used_model: str | None, usage: Usage | None = None) -> None:
+    if _cacheable(content, used_model):
+        caches[CACHE_ALIAS].set(key, _pack(content, tokens_used, used_model, usage), timeout=COMPLETION_TTL)
+
+
+async def alookup(key: str):
+    value = _unpack(await caches[CACHE_ALIAS].aget(key))
+    await metrics.aincr("completion_cache.hits" if value else "completion_cache.misses")
+    return value
+
+
+async def astore(
+    key: str, content: str, tokens_used: int, used_model: str | None, usage: Usage | None = None
+) -> None:
+    if _cacheable(content, used_model):
+        await caches[CACHE_ALIAS].aset(key, _pack(content, tokens_used, used_model, usage), timeout=COMPLETION_TTL)
+
+
+def stats() -> dict:
+    counters = metrics.read("completion_cache.hits", "completion_cache.misses")
+    hits, misses = counters["completion_cache.hits"], counters["completion_cache.misses"]
+    return {"hits": hits, "misses": misses, "hit_ratio": metrics.hit_ratio(hits, misses)}
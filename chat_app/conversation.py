@@ -0,0 +1,104 @@
+# chat_app/conversation.py
+from decouple import config
+from django.core.cache import cache
+from django.db.models import OuterRef, Subquery
+from .models import Answer, Question
+from .tokens import estimate_tokens, message_tokens, truncate_to_tokens
+
+# Режим диалога: категория — это тред. В промпт идут последние вопросы/ответы
+# категории в пределах бюджета токенов, а всё, что старше, — одной строкой
+# на ход из свёртки в кэше. Свёртка дописывается после каждого ответа,
+# поэтому сборка промпта — один запрос к БД (плюс один на холодном кэше).
+CONVERSATION_DEFAULT = config("CHAT_CONVERSATION_DEFAULT", default=False, cast=bool)
+CONTEXT_TOKEN_BUDGET = config("CHAT_CONTEXT_TOKENS", default=2000, cast=int)
+RECENT_TURNS = config("CHAT_CONTEXT_TURNS", default=6, cast=int)  # ходов целиком, не больше
+SUMMARY_TOKENS = config("CHAT_SUMMARY_TOKENS", default=400, cast=int)
+SUMMARY_TTL = config("CHAT_SUMMARY_TTL", default=7 * 86400, cast=int)
+SUMMARY_REBUILD_TURNS = 50  # сколько старых ходов читаем, если свёртки в кэше нет
+LINE_TOKENS = 60  # на один ход в свёртке
+
+SUMMARY_HEADER = {
+    "ru": "Краткое содержание предыдущей части разговора:",
+    "en": "Summary of the earlier conversation:",
+}
+
+
+def _summary_key(category_id) -> str:
+    return f"conversation:summary:v1:{category_id}"
+
+
+def _condense(prompt: str, answer: str | None) -> str:
+    # свёртка без вызова модели: начало вопроса и начало ответа
+    q = truncate_to_tokens(" ".join((prompt or "").split()), LINE_TOKENS // 2)
+    a = truncate_to_tokens(" ".join((answer or "").split()), LINE_TOKENS // 2)
+    return f"Q: {q} → A: {a}"
+
+
+def _turns(category_id, before, limit: int):
+    """Ходы треда (вопрос + последний ответ) новее → старше, одним запросом."""
+    latest = Answer.objects.filter(question=OuterRef("pk")).order_by("-created_at")
+    return list(
+        Question.objects.filter(category_id=category_id, created_at__lt=before)
+        .exclude(model_type=Question.IMAGE)
+        .annotate(answer_content=Subquery(latest.values("content")[:1]))
+        .order_by("-created_at", "-id")
+        .values_list("prompt", "answer_content", "created_at")[:limit]
+    )
+
+
+def _summary_lines(category_id, before) -> list[list]:
+    """[[timestamp, строка], …] в хронологическом порядке."""
+    lines = cache.get(_summary_key(category_id))
+    if lines is None:
+        turns = _turns(category_id, before, SUMMARY_REBUILD_TURNS)
+        lines = [[ts.timestamp(), _condense(p, a)] for p, a, ts in reversed(turns)]
+        cache.set(_summary_key(category_id), lines, timeout=SUMMARY_TTL)
+    return lines
+
+
+def remember_turn(question: Question, answer: Answer) -> None:
+    """
+    Дописывает ход в свёртку треда. Если свёртки в кэше нет, она соберётся
+    из БД при следующем запросе — здесь ничего не читаем.
+    """
+    key = _summary_key(question.category_id)
+    lines = cache.get(key)
+    if lines is None or question.model_type == Question.IMAGE:
+        return
+    lines.append([question.created_at.timestamp(), _condense(question.prompt, answer.content)])
+    cache.set(key, lines[-SUMMARY_REBUILD_TURNS:], timeout=SUMMARY_TTL)
+
+
+def build_history(question: Question, language: str = "en", budget: int = CONTEXT_TOKEN_BUDGET) -> list[dict]:
+    """
+    Сообщения перед текущим вопросом: свёртка старых ходов (system) +
+    последние ходы целиком (user/assistant). Укладывается в budget токенов.
+    """
+    recent: list[dict] = []
+    used = 0
+    cutoff = question.created_at.timestamp()
+    for prompt, content, created_at in _turns(question.category_id, question.created_at, RECENT_TURNS):
+        pair = [{"role": "user", "content": prompt}, {"role": "assistant", "content": content or ""}]
+        cost = message_tokens(pair)
+        if used + cost > budget:
+            break
+        recent = pair + recent
+        used += cost
+        cutoff = created_at.timestamp()
+
+    # всё, что старше вошедших целиком ходов, — из свёртки, свежие строки важнее
+    header = SUMMARY_HEADER.get(language, SUMMARY_HEADER["en"])
+    summary_budget = min(SUMMARY_TOKENS, budget - used) - message_tokens([{"content": header}])
+    picked: list[str] = []
+    for ts, line in reversed(_summary_lines(question.category_id, question.created_at)):
+        if ts >= cutoff:
+            continue
+        cost = estimate_tokens(line + "\n") + 1
+        if cost > summary_budget:
+            break
+        picked.insert(0, line)
+        summary_budget -= cost
+
+    if picked:
+        recent = [{"role": "system", "content": header + "\n" + "\n".join(picked)}] + recent
+    return recent
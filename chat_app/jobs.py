@@ -0,0 +1,151 @@
+# chat_app/jobs.py
+import os
+import socket
+import traceback
+from datetime import timedelta
+from decouple import config
+from django.db.models import F
+from django.utils import timezone
+from .models import GenerationJob, Question
+from .model_providers.image_models import ImageRateLimited
+from .utils import answer_image, answer_question
+from auth_app import quota
+
+# Очередь генерации в БД: HTTP-запрос только ставит задачу,
+# ответ модели получает `manage.py run_generation_worker`.
+GENERATION_QUEUE_DEFAULT = config("CHAT_GENERATION_QUEUE", default=False, cast=bool)
+JOB_MAX_ATTEMPTS = config("CHAT_JOB_MAX_ATTEMPTS", default=3, cast=int)
+JOB_RETRY_BASE_SEC = config("CHAT_JOB_RETRY_BASE_SEC", default=10, cast=int)  # 10, 20, 40…
+JOB_STALE_SEC = config("CHAT_JOB_STALE_SEC", default=300, cast=int)  # воркер умер посреди задачи
+# картинки (минуты ожидания из-за лимита Together) — через очередь: POST
+# отвечает 202 {job_id}, клиент поллит jobs/<id>/. Нужен запущенный воркер,
+# поэтому по умолчанию выключено (см. README).
+IMAGE_QUEUE = config("CHAT_IMAGE_QUEUE", default=False, cast=bool)
+
+
+def worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def enqueue(question: Question, language: str = "en", conversation: bool = False) -> GenerationJob:
+    return GenerationJob.objects.create(question=question, language=language, conversation=conversation)
+
+
+def ready_jobs(now):
+    # порядок по run_after — ровно по индексу (status, run_after), без сортировки;
+    # у новых задач run_after = created_at, так что это по-прежнему FIFO
+    return GenerationJob.objects.filter(status=GenerationJob.QUEUED, run_after__lte=now).order_by("run_after")
+
+
+def claim_next(worker: str) -> GenerationJob | None:
+    """
+    Берём задачу, готовую раньше всех. Захват — условный UPDATE по статусу,
+    поэтому два воркера одну задачу не получат (работает и на SQLite, и на PG).
+    """
+    now = timezone.now()
+    candidates = ready_jobs(now).values_list("pk", flat=True)[:5]
+    for pk in candidates:
+        claimed = GenerationJob.objects.filter(pk=pk, status=GenerationJob.QUEUED).update(
+            status=GenerationJob.RUNNING,
+            locked_by=worker,
+            locked_at=now,
+            attempts=F("attempts") + 1,
+            updated_at=now,
+        )
+        if claimed:
+            return GenerationJob.objects.select_related("question").get(pk=pk)
+    return None
+
+
+def requeue_stale() -> int:
+    """
+    Задачи, зависшие в running дольше JOB_STALE_SEC (воркер умер посреди
+    задачи). Прерванный прогон — попытка (attempts вырос при захвате), так что
+    дальше как при ошибке: повтор с паузой, после JOB_MAX_ATTEMPTS — failed.
+    Иначе задача, которая роняет воркер, крутилась бы в очереди вечно.
+    """
+    cutoff = timezone.now() - timedelta(seconds=JOB_STALE_SEC)
+    stale = GenerationJob.objects.filter(status=GenerationJob.RUNNING, locked_at__lt=cutoff)
+    count = 0
+    for job in stale.select_related("question__user"):
+        retry_later(job, f"worker {job.locked_by} lost the job")
+        count += 1
+    return count
+
+
+def retry_later(job: GenerationJob, error: str, delay: float | None = None) -> None:
+    """Повтор с экспоненциальной паузой; после JOB_MAX_ATTEMPTS — failed."""
+    job.error = error[:2000]
+    job.locked_by, job.locked_at = "", None
+    if job.attempts >= JOB_MAX_ATTEMPTS:
+        job.status = GenerationJob.FAILED
+        # списали при постановке в очередь (возможно, в прошлом окне)
+        quota.refund(job.question.user, job.question.model_type, at=job.created_at.timestamp())
+    else:
+        job.status = GenerationJob.QUEUED
+        if delay is None:
+            delay = JOB_RETRY_BASE_SEC * 2 ** (job.attempts - 1)
+        job.run_after = timezone.now() + timedelta(seconds=delay)
+    job.save(update_fields=["status", "error", "run_after", "locked_by", "locked_at", "updated_at"])
+
+
+def defer(job: GenerationJob, delay: float) -> None:
+    """Лимит провайдера: откладываем задачу, попытку не засчитываем."""
+    job.status = GenerationJob.QUEUED
+    job.attempts = max(job.attempts - 1, 0)
+    job.locked_by, job.locked_at = "", None
+    job.run_after = timezone.now() + timedelta(seconds=delay)
+    job.save(update_fields=["status", "attempts", "run_after", "locked_by", "locked_at", "updated_at"])
+
+
+def run_job(job: GenerationJob) -> GenerationJob:
+    try:
+        if job.question.model_type == Question.IMAGE:
+            answer_image(job.question)
+        else:
+            answer = answer_question(job.question, job.language, conversation_mode=job.conversation)
+            if answer.model is None:
+                # «модель недоступна» query_openrouter отдаёт обычным текстом —
+                # ответа нет: заглушку не храним, задачу повторяем
+                answer.delete()
+                raise RuntimeError(f"no model available: {answer.content}")
+    except ImageRateLimited as e:
+        defer(job, e.retry_after)
+        return job
+    except Exception as e:
+        traceback.print_exc()
+        retry_later(job, str(e))
+        return job
+
+    job.status = GenerationJob.DONE
+    job.error = ""
+    job.save(update_fields=["status", "error", "updated_at"])
+    return job
+
+
+def job_payload(job: GenerationJob) -> dict:
+    """Статус задачи для поллинга; ответ — как только он готов."""
+    data = {
+        "id": job.id,
+        "status": job.status,
+        "question_id": job.question_id,
+        "attempts": job.attempts,
+        "max_attempts": JOB_MAX_ATTEMPTS,
+        "error": job.error or None,
+        "created_at": job.created_at,
+        "updated_at": job.updated_at,
+        "answer": None,
+    }
+    if job.status == GenerationJob.DONE:
+        answer = job.question.answers.order_by("-created_at").first()
+        if answer:
+            data["answer"] = {
+                "id": answer.id,
+                "content": answer.content,
+                "model": answer.model,
+                "tokens_used": answer.tokens_used,
+                "latency_ms": answer.latency_ms,
+                "finish_reason": answer.finish_reason,
+                "created_at": answer.created_at,
+            }
+    return data
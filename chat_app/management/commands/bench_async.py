@@ -0,0 +1,121 @@
+# chat_app/management/commands/bench_async.py
+import asyncio
+import io
+import json
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, Client, override_settings
+
+from chat_app.model_providers.openrouter import query as or_query
+from auth_app import quota
+
+
+def _make_stub_handler(latency: float):
+    class StubOpenRouter(BaseHTTPRequestHandler):
+        """Локальная заглушка /chat/completions: ждёт latency и отвечает как OpenRouter."""
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            payload = json.loads(self.rfile.read(length) or b"{}")
+            time.sleep(latency)
+            body = json.dumps({
+                "model": payload.get("model"),
+                "choices": [{"message": {"role": "assistant", "content": "stub answer"}}],
+            }).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return StubOpenRouter
+
+
+def _summary(label: str, latencies: list[float], elapsed: float) -> str:
+    lat = sorted(latencies)
+    p95 = lat[max(0, int(len(lat) * 0.95) - 1)]
+    return (
+        f"{label:<28} requests={len(lat):<5} elapsed={elapsed:7.2f}s "
+        f"rps={len(lat) / elapsed:8.1f} p50={statistics.median(lat) * 1000:7.0f}ms "
+        f"p95={p95 * 1000:7.0f}ms"
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнивает пропускную способность sync (WSGI, N воркеров) и async (ASGI, один "
+        "event loop) версий /test-query/ против локальной заглушки OpenRouter."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=200, help="Всего запросов в каждом режиме.")
+        parser.add_argument("--latency", type=float, default=1.0, help="Задержка заглушки, сек.")
+        parser.add_argument("--workers", type=int, default=4, help="Sync-воркеров (как gunicorn -w).")
+        parser.add_argument("--concurrency", type=int, default=200, help="Одновременных запросов в async-режиме.")
+
+    def handle(self, *args, **opts):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), _make_stub_handler(opts["latency"]))
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        stub_url = f"http://127.0.0.1:{server.server_address[1]}/chat/completions"
+        body = {"prompt": "ping", "model_id": "stub/model", "language": "en"}
+
+        original_url, original_quota = or_query.OPENROUTER_URL, quota.QUOTA_ENABLED
+        or_query.OPENROUTER_URL = stub_url
+        quota.QUOTA_ENABLED = False  # бенчим пропускную способность, а не квоты
+        try:
+            with override_settings(ALLOWED_HOSTS=["*"]), redirect_stdout(io.StringIO()):
+                sync_line = self._bench_sync(body, opts)
+                async_line = self._bench_async(body, opts)
+        finally:
+            or_query.OPENROUTER_URL = original_url
+            quota.QUOTA_ENABLED = original_quota
+            server.shutdown()
+            server.server_close()
+
+        self.stdout.write(f"stub latency={opts['latency']}s")
+        self.stdout.write(sync_line)
+        self.stdout.write(async_line)
+
+    def _bench_sync(self, body: dict, opts) -> str:
+        def one(_):
+            started = time.perf_counter()
+            resp = Client().post("/api/chat/test-query/", body, content_type="application/json")
+            assert resp.status_code == 200, resp.status_code
+            return time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=opts["workers"]) as pool:
+            latencies = list(pool.map(one, range(opts["requests"])))
+        return _summary(f"sync WSGI x{opts['workers']} workers", latencies, time.perf_counter() - started)
+
+    def _bench_async(self, body: dict, opts) -> str:
+        async def run():
+            client = AsyncClient()
+            limit = asyncio.Semaphore(opts["concurrency"])
+
+            async def one():
+                async with limit:
+                    started = time.perf_counter()
+                    resp = await client.post(
+                        "/api/chat/async/test-query/", body, content_type="application/json"
+                    )
+                    assert resp.status_code == 200, resp.status_code
+                    return time.perf_counter() - started
+
+            started = time.perf_counter()
+            latencies = await asyncio.gather(*(one() for _ in range(opts["requests"])))
+            return latencies, time.perf_counter() - started
+
+        latencies, elapsed = asyncio.run(run())
+        return _summary("async ASGI x1 event loop", latencies, elapsed)
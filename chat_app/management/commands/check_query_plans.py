@@ -0,0 +1,33 @@
+# chat_app/management/commands/check_query_plans.py
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from chat_app.query_plans import HOT_QUERIES, explain
+
+
+class Command(BaseCommand):
+    help = "EXPLAIN горячих запросов chat_app: падает, если план читает таблицу целиком или сортирует без индекса."
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', help='Только эти запросы (по умолчанию — все).')
+        parser.add_argument('--show-plans', action='store_true', help='Печатать планы целиком.')
+
+    def handle(self, *args, **opts):
+        names = opts['names'] or list(HOT_QUERIES)
+        unknown = [n for n in names if n not in HOT_QUERIES]
+        if unknown:
+            raise CommandError(f"Unknown queries: {', '.join(unknown)}")
+
+        failed = []
+        for name in names:
+            plan, problems = explain(name)
+            status = self.style.ERROR("FAIL") if problems else self.style.SUCCESS("ok")
+            self.stdout.write(f"[{connection.vendor}] {name}: {status}")
+            if opts['show_plans'] or problems:
+                for line in plan.splitlines():
+                    self.stdout.write(f"    {line}")
+            if problems:
+                failed.append(name)
+
+        if failed:
+            raise CommandError(f"Full scan or sort in: {', '.join(failed)}")
+        self.stdout.write(self.style.SUCCESS(f"All {len(names)} query plan(s) use indexes."))
@@ -0,0 +1,13 @@
+# chat_app/management/commands/refresh_model_catalog.py
+from django.core.management.base import BaseCommand, CommandError
+from chat_app.model_providers.openrouter.catalog import refresh_catalog
+
+
+class Command(BaseCommand):
+    help = "Загружает каталог free-моделей OpenRouter в кэш (прогрев после деплоя / по cron)."
+
+    def handle(self, *args, **opts):
+        models = refresh_catalog()
+        if models is None:
+            raise CommandError("OpenRouter models endpoint is unavailable")
+        self.stdout.write(self.style.SUCCESS(f"Catalog refreshed: {len(models)} free model(s)."))
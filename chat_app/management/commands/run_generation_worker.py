@@ -0,0 +1,37 @@
+# chat_app/management/commands/run_generation_worker.py
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from chat_app.jobs import claim_next, requeue_stale, run_job, worker_id
+
+
+class Command(BaseCommand):
+    help = "Воркер очереди генерации: забирает GenerationJob и заполняет Answer."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sleep', type=float, default=1.0, help='Пауза при пустой очереди, сек.')
+        parser.add_argument('--max-jobs', type=int, default=0, help='Остановиться после N задач (0 — без лимита).')
+        parser.add_argument('--once', action='store_true', help='Разобрать очередь и выйти.')
+
+    def handle(self, *args, **opts):
+        me = worker_id()
+        done = 0
+        self.stdout.write(f"[worker] {me} started")
+
+        while True:
+            close_old_connections()  # долгоживущий процесс: не держим протухшие соединения
+            requeue_stale()
+            job = claim_next(me)
+            if job is None:
+                if opts['once']:
+                    break
+                time.sleep(opts['sleep'])
+                continue
+
+            job = run_job(job)
+            done += 1
+            self.stdout.write(f"[worker] job={job.id} question={job.question_id} status={job.status} attempts={job.attempts}")
+            if opts['max_jobs'] and done >= opts['max_jobs']:
+                break
+
+        self.stdout.write(self.style.SUCCESS(f"Processed: {done} job(s)."))
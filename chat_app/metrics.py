@@ -0,0 +1,34 @@
+# chat_app/metrics.py
+from django.core.cache import cache
+
+# Простые счётчики в общем кэше: видны всем воркерам, переживают перезапуск
+# процесса (если бэкенд кэша общий). Для точного мониторинга — не замена Prometheus.
+METRICS_PREFIX = "metrics:"
+
+
+def incr(name: str, delta: int = 1) -> None:
+    key = METRICS_PREFIX + name
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key, delta)
+    except ValueError:  # ключ успели вытеснить между add и incr
+        cache.set(key, delta, timeout=None)
+
+
+async def aincr(name: str, delta: int = 1) -> None:
+    key = METRICS_PREFIX + name
+    await cache.aadd(key, 0, timeout=None)
+    try:
+        await cache.aincr(key, delta)
+    except ValueError:
+        await cache.aset(key, delta, timeout=None)
+
+
+def read(*names: str) -> dict:
+    values = cache.get_many([METRICS_PREFIX + n for n in names])
+    return {n: values.get(METRICS_PREFIX + n, 0) for n in names}
+
+
+def hit_ratio(hits: int, misses: int) -> float:
+    total = hits + misses
+    return round(hits / total, 4) if total else 0.0
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.3 on 2026-10-18 06:31
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat_app', '0002_generationjob'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='answer',
+            index=models.Index(fields=['question', '-created_at', '-id'], name='chat_a_question_created'),
+        ),
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(fields=['category', 'user', '-created_at', '-id'], name='chat_q_cat_user_created'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.3 on 2026-10-18 06:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat_app', '0003_history_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='generationjob',
+            index=models.Index(fields=['status', 'locked_at'], name='chat_job_status_locked_at'),
+        ),
+    ]
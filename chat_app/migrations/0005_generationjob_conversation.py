@@ -0,0 +1,18 @@
+# Generated by Django 5.1.3 on 2026-10-18 06:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat_app', '0004_job_locked_at_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='generationjob',
+            name='conversation',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,83 @@
+# Индекс полнотекстового поиска (chat_app/search.py):
+# SQLite — FTS5-таблица chat_search с заполнением из существующих данных;
+# PostgreSQL — GIN-индексы по тому же выражению, что строит SearchVector
+# (словарь должен совпадать с CHAT_SEARCH_CONFIG, по умолчанию 'simple').
+
+from django.db import migrations
+
+BATCH = 1000
+
+SQLITE_CREATE = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS chat_search USING fts5("
+    "body, kind UNINDEXED, doc_id UNINDEXED, question_id UNINDEXED, "
+    "category_id UNINDEXED, user_id UNINDEXED, tokenize='unicode61 remove_diacritics 2')"
+)
+SQLITE_INSERT = (
+    "INSERT INTO chat_search (body, kind, doc_id, question_id, category_id, user_id) "
+    "VALUES (%s, %s, %s, %s, %s, %s)"
+)
+PG_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS chat_q_prompt_fts ON chat_app_question "
+    "USING gin (to_tsvector('simple'::regconfig, COALESCE(prompt, '')))",
+    "CREATE INDEX IF NOT EXISTS chat_a_content_fts ON chat_app_answer "
+    "USING gin (to_tsvector('simple'::regconfig, COALESCE(content, '')))",
+)
+
+
+def _backfill(cursor, rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= BATCH:
+            cursor.executemany(SQLITE_INSERT, batch)
+            batch = []
+    if batch:
+        cursor.executemany(SQLITE_INSERT, batch)
+
+
+def create_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "postgresql":
+        for sql in PG_INDEXES:
+            schema_editor.execute(sql)
+        return
+    if vendor != "sqlite":
+        return
+
+    Question = apps.get_model("chat_app", "Question")
+    Answer = apps.get_model("chat_app", "Answer")
+    schema_editor.execute(SQLITE_CREATE)
+    # id — строкой с дефисами, как их пишет search.py (а не hex, как хранит SQLite)
+    with schema_editor.connection.cursor() as cursor:
+        _backfill(cursor, (
+            (prompt, "question", str(pk), str(pk), str(category_id), user_id)
+            for pk, prompt, category_id, user_id in Question.objects.values_list(
+                "pk", "prompt", "category_id", "user_id"
+            ).iterator(chunk_size=BATCH)
+        ))
+        _backfill(cursor, (
+            (content, "answer", str(pk), str(question_id), str(category_id), user_id)
+            for pk, content, question_id, category_id, user_id in Answer.objects.values_list(
+                "pk", "content", "question_id", "question__category_id", "question__user_id"
+            ).iterator(chunk_size=BATCH)
+        ))
+
+
+def drop_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "sqlite":
+        schema_editor.execute("DROP TABLE IF EXISTS chat_search")
+    elif vendor == "postgresql":
+        schema_editor.execute("DROP INDEX IF EXISTS chat_q_prompt_fts")
+        schema_editor.execute("DROP INDEX IF EXISTS chat_a_content_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat_app', '0006_answer_usage'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.3 on 2026-10-18 07:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat_app', '0007_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='language',
+            field=models.CharField(blank=True, default='', max_length=8),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Удаление из chat_search по doc_id/question_id (колонки FTS5 UNINDEXED)
+# читало всю таблицу. Карта doc_id → rowid в обычной таблице с индексами:
+# search.py находит rowid по индексу и удаляет из FTS5 по rowid.
+# Существующие строки chat_search получают записи со своими rowid.
+
+from django.db import migrations
+
+CREATE = (
+    "CREATE TABLE IF NOT EXISTS chat_search_doc ("
+    "id INTEGER PRIMARY KEY, doc_id TEXT NOT NULL UNIQUE, question_id TEXT NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS chat_search_doc_question ON chat_search_doc (question_id)",
+)
+# дубли doc_id (старый код мог оставить при гонке) — оставляем самую свежую строку
+DEDUPE = "DELETE FROM chat_search WHERE rowid NOT IN (SELECT MAX(rowid) FROM chat_search GROUP BY doc_id)"
+BACKFILL = "INSERT INTO chat_search_doc (id, doc_id, question_id) SELECT rowid, doc_id, question_id FROM chat_search"
+
+
+def create_doc_map(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    for sql in (*CREATE, DEDUPE, BACKFILL):
+        schema_editor.execute(sql)
+
+
+def drop_doc_map(apps, schema_editor):
+    if schema_editor.connection.vendor == "sqlite":
+        schema_editor.execute("DROP TABLE IF EXISTS chat_search_doc")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat_app', '0008_question_language'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_doc_map, drop_doc_map),
+    ]
@@ -1,108 +1,148 @@
 # testing/ai-chat-django/chat_app/model_providers/image_models.py
 from typing import Tuple
+import math
 import requests
 from decouple import config
 import base64
 import uuid
-import os
 import time
-from django.conf import settings
 from django.core.files.base import ContentFile
 import cloudinary.uploader
+from rest_framework.exceptions import APIException
 from ..models import GeneratedImage
+from .. import rate_limit
 
 
 TOGETHER_API_KEY = config("TOGETHER_API_KEY")
 TOGETHER_API_URL = config("TOGETHER_API_URL")
 
-# Глобальная переменная для отслеживания времени последнего запроса
-LAST_REQUEST_TIME = 0
+# Лимит Together.ai (free FLUX): 6 запросов в минуту — на все воркеры сразу
+TOGETHER_RPM = config("TOGETHER_RPM", default=6, cast=float)
+IMAGE_MAX_ATTEMPTS = config("IMAGE_MAX_ATTEMPTS", default=3, cast=int)
+IMAGE_MAX_WAIT_SEC = config("IMAGE_MAX_WAIT_SEC", default=6, cast=int)  # сетевые повторы в запросе — не дольше
+IMAGE_TIMEOUT = (5, 90)  # (connect, read)
+
+
+class ImageRateLimited(Exception):
+    """Лимит исчерпан — повторить не раньше, чем через retry_after секунд."""
+
+    def __init__(self, retry_after: float):
+        self.retry_after = retry_after
+        super().__init__(f"rate limited, retry in {retry_after:.1f}s")
+
+
+class ImageGenerationError(Exception):
+    pass
+
+
+class ImageBusy(APIException):
+    """
+    Лимит Together при генерации прямо в запросе: не спим в воркере
+    веб-сервера, а отвечаем 429 с Retry-After (DRF ставит заголовок по wait).
+    """
+    status_code = 429
+    default_code = "image_rate_limited"
+
+    def __init__(self, retry_after: float):
+        self.wait = max(1, math.ceil(retry_after))
+        super().__init__()
+        self.detail = {"error": "image rate limit exceeded", "retry_after": self.wait}
+
+
+def _headers() -> dict:
+    return {
+        "Authorization": f"Bearer {TOGETHER_API_KEY}",
+        "Content-Type": "application/json",
+    }
+
+
+def _payload(prompt: str) -> dict:
+    return {
+        "model": "black-forest-labs/FLUX.1-schnell-Free",
+        "prompt": prompt,
+        "width": 512,
+        "height": 512,
+        "steps": 4,
+        "seed": int(time.time()),  # Динамический seed для разнообразия
+    }
+
+
+def generate_image(prompt: str) -> str:
+    """
+    Одна попытка генерации: URL картинки или исключение.
+    ImageRateLimited — лимит (свой или 429 от Together), повтор решает вызывающий.
+    """
+    wait = rate_limit.acquire("together", TOGETHER_RPM)
+    if wait:
+        raise ImageRateLimited(wait)
+
+    response = requests.post(TOGETHER_API_URL, headers=_headers(), json=_payload(prompt), timeout=IMAGE_TIMEOUT)
+    print("API response:", response.status_code, response.text[:300])
+
+    if response.status_code == 429:
+        retry_after = rate_limit.parse_retry_after(response.headers.get("retry-after"))
+        rate_limit.penalize("together", TOGETHER_RPM, retry_after)
+        raise ImageRateLimited(retry_after)
+    response.raise_for_status()
+
+    data = response.json().get("data") or []
+    if not data:
+        raise ImageGenerationError("No valid image data in response")
+    image_data = data[0]
+
+    if "url" in image_data:
+        return _upload_from_url(prompt, image_data["url"])
+    if "b64_json" in image_data:
+        img = GeneratedImage(prompt=prompt)
+        img.file.save(
+            f"{uuid.uuid4()}.png",
+            ContentFile(base64.b64decode(image_data["b64_json"])),
+            save=True,
+        )
+        return img.file.url
+    raise ImageGenerationError("No valid image data in response")
 
 
-def query_flux_image(prompt: str) -> Tuple[str, None]:
-    """Генерация изображений через Together.ai API с обработкой лимитов"""
-    global LAST_REQUEST_TIME
-
-    try:
-        # Соблюдаем лимит в 6 запросов в минуту (10 секунд между запросами)
-        current_time = time.time()
-        if current_time - LAST_REQUEST_TIME < 10:
-            wait_time = 10 - (current_time - LAST_REQUEST_TIME)
-            print(f"Waiting {wait_time:.1f} seconds to comply with rate limits...")
-            time.sleep(wait_time)
-
-        headers = {
-            "Authorization": f"Bearer {TOGETHER_API_KEY}",
-            "Content-Type": "application/json",
-        }
-
-        payload = {
-            "model": "black-forest-labs/FLUX.1-schnell-Free",
-            "prompt": prompt,
-            "width": 512,
-            "height": 512,
-            "steps": 4,
-            "seed": int(time.time()),  # Динамический seed для разнообразия
-        }
-
-        response = requests.post(
-            TOGETHER_API_URL, headers=headers, json=payload, timeout=90
-        )
+def _upload_from_url(prompt: str, source_url: str) -> str:
+    """Картинку через нас не качаем: Cloudinary забирает её по URL сам."""
+    upload_result = cloudinary.uploader.upload(
+        source_url,
+        folder="generated-FLUX-schnell",  # опционально, чтобы сгруппировать
+        public_id=str(uuid.uuid4()),
+        resource_type="image",
+    )
+    secure_url = upload_result.get("secure_url")
 
-        LAST_REQUEST_TIME = time.time()  # Обновляем время последнего запроса
-
-        print("API response:", response.status_code, response.text)
-
-        # Обработка успешного ответа
-        if response.status_code == 200:
-            data = response.json()
-            if "data" in data and len(data["data"]) > 0:
-                image_data = data["data"][0]
-
-                if "url" in image_data:
-                    img_response = requests.get(image_data["url"], timeout=90)
-
-                    # img_response = requests.get(image_data["url"])
-                    img_response.raise_for_status()
-
-                    # 1) загружаем в Cloudinary
-                    upload_result = cloudinary.uploader.upload(
-                        img_response.content,
-                        folder="generated-FLUX-schnell",  # опционально, чтобы сгруппировать
-                        public_id=str(uuid.uuid4()),
-                        resource_type="image",
-                    )
-                    secure_url = upload_result.get("secure_url")
-
-                    # 2) сохраняем в модели и возвращаем URL
-                    img = GeneratedImage(prompt=prompt, source_url=image_data["url"])
-                    # мы НЕ используем img.file.save — просто сохраняем URL
-                    img.url = secure_url  # вместо img.file
-                    img.save()
-                    return secure_url, None
-                
-                elif "b64_json" in image_data:
-                    # Обработка base64
-                    img = GeneratedImage(prompt=prompt)
-                    img.file.save(
-                        f"{uuid.uuid4()}.png",
-                        ContentFile(base64.b64decode(image_data["b64_json"])),
-                        save=True,
-                    )
-                    return img.file.url, None
-
-        # Обработка ошибки 429
-        elif response.status_code == 429:
-            retry_after = int(response.headers.get("retry-after", 10))
-            print(f"Rate limit exceeded. Waiting {retry_after} seconds...")
-            time.sleep(retry_after)
-            return query_flux_image(prompt)  # Рекурсивный повтор
-
-        return "[Image Error] No valid image data in response", None
-
-    except requests.exceptions.RequestException as e:
-        print(f"Request error: {str(e)}")
-        return f"[Image Error] Request failed: {str(e)}", None
-    except Exception as e:
-        print(f"Unexpected error: {str(e)}")
-        return f"[Image Error] {str(e)}", None
+    # сохраняем в модели только URL (img.file не используем)
+    GeneratedImage.objects.create(prompt=prompt, source_url=source_url, url=secure_url)
+    return secure_url
+
+
+def query_flux_image(prompt: str) -> Tuple[str, None]:
+    """
+    Синхронная генерация (без очереди): сетевые ошибки повторяем (не больше
+    IMAGE_MAX_ATTEMPTS попыток, суммарная пауза — до IMAGE_MAX_WAIT_SEC),
+    лимит — сразу ImageBusy (429 + Retry-After): ждать минуту в запросе нельзя.
+    Остальные ошибки возвращаем текстом, как и раньше.
+    """
+    waited = 0.0
+    error = "unknown error"
+    for attempt in range(1, IMAGE_MAX_ATTEMPTS + 1):
+        try:
+            return generate_image(prompt), None
+        except ImageRateLimited as e:
+            raise ImageBusy(e.retry_after) from e
+        except requests.exceptions.RequestException as e:
+            pause = 2 ** attempt
+            error = f"Request failed: {str(e)}"
+        except Exception as e:
+            print(f"Unexpected error: {str(e)}")
+            return f"[Image Error] {str(e)}", None
+
+        print(f"[image] попытка {attempt}: {error}")
+        if attempt == IMAGE_MAX_ATTEMPTS or waited + pause > IMAGE_MAX_WAIT_SEC:
+            break
+        time.sleep(pause)
+        waited += pause
+
+    return f"[Image Error] {error}", None
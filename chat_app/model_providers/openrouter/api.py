@@ -1,13 +1,13 @@
 # chat_app/model_providers/openrouter/api.py
-import requests
 from decouple import config
+from . import client
 
 OPENROUTER_MODELS_URL = config("OPENROUTER_MODELS_URL")
 
 
 def fetch_models() -> list[dict]:
     """Загружает все модели с OpenRouter."""
-    response = requests.get(OPENROUTER_MODELS_URL, timeout=10)
+    response = client.get(OPENROUTER_MODELS_URL, timeout=client.default_timeout(10))
     response.raise_for_status()
     return response.json().get("data", [])
 
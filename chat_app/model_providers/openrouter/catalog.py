@@ -0,0 +1,70 @@
+# chat_app/model_providers/openrouter/catalog.py
+import threading
+import time
+from decouple import config
+from django.core.cache import cache
+from .api import fetch_models, is_model_free
+
+# Каталог free-моделей OpenRouter в общем кэше (stale-while-revalidate):
+# свежий — отдаём как есть, устаревший — отдаём и обновляем в фоне.
+CATALOG_CACHE_KEY = "openrouter_catalog_v1"
+CATALOG_LOCK_KEY = "openrouter_catalog_v1:refreshing"
+CATALOG_FRESH_SEC = config("OPENROUTER_CATALOG_TTL", default=600, cast=int)
+CATALOG_STALE_SEC = config("OPENROUTER_CATALOG_STALE_TTL", default=86400, cast=int)
+CATALOG_LOCK_SEC = 60  # не дольше — чтобы упавшее обновление не держало замок
+
+_cold_lock = threading.Lock()
+
+
+def _slim(model: dict) -> dict:
+    # из многомегабайтного ответа храним только то, что нужно селектору
+    return {"id": model["id"], "name": model.get("name", ""), "context_length": model.get("context_length")}
+
+
+def refresh_catalog() -> list[dict] | None:
+    """Скачивает каталог и кладёт в кэш. None — если OpenRouter не ответил."""
+    try:
+        models = [_slim(m) for m in fetch_models() if is_model_free(m) and m.get("id")]
+    except Exception as e:
+        print(f"[catalog] не удалось обновить каталог: {e}")
+        return None
+    cache.set(
+        CATALOG_CACHE_KEY,
+        {"models": models, "fetched_at": time.time()},
+        timeout=CATALOG_STALE_SEC,
+    )
+    return models
+
+
+def _refresh_in_background():
+    try:
+        refresh_catalog()
+    finally:
+        cache.delete(CATALOG_LOCK_KEY)
+
+
+def schedule_refresh() -> bool:
+    """Фоновое обновление; замок в кэше — одно обновление на все воркеры."""
+    if not cache.add(CATALOG_LOCK_KEY, 1, timeout=CATALOG_LOCK_SEC):
+        return False
+    threading.Thread(target=_refresh_in_background, name="openrouter-catalog", daemon=True).start()
+    return True
+
+
+def get_free_models() -> list[dict]:
+    """
+    Free-модели OpenRouter в порядке витрины.
+    Запрос пользователя ждёт загрузку только на холодном кэше (первый запрос
+    после деплоя — для этого есть `manage.py refresh_model_catalog`).
+    """
+    entry = cache.get(CATALOG_CACHE_KEY)
+    if entry:
+        if time.time() - entry["fetched_at"] > CATALOG_FRESH_SEC:
+            schedule_refresh()
+        return entry["models"]
+
+    with _cold_lock:
+        entry = cache.get(CATALOG_CACHE_KEY)  # соседний поток мог уже загрузить
+        if entry:
+            return entry["models"]
+        return refresh_catalog() or []
@@ -0,0 +1,112 @@
+# chat_app/model_providers/openrouter/client.py
+import asyncio
+import os
+import threading
+import weakref
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from decouple import config
+
+# Пул соединений на процесс (gunicorn-воркер): keep-alive до OpenRouter,
+# чтобы каждый запрос не платил TCP+TLS рукопожатие.
+POOL_CONNECTIONS = config("OPENROUTER_POOL_CONNECTIONS", default=4, cast=int)  # число хостов
+POOL_MAXSIZE = config("OPENROUTER_POOL_MAXSIZE", default=10, cast=int)  # соединений на хост
+CONNECT_TIMEOUT = config("OPENROUTER_CONNECT_TIMEOUT", default=5, cast=float)
+READ_TIMEOUT = config("OPENROUTER_READ_TIMEOUT", default=30, cast=float)
+# ASGI: сколько одновременных запросов держит один event loop
+ASYNC_MAX_CONNECTIONS = config("OPENROUTER_ASYNC_MAX_CONNECTIONS", default=200, cast=int)
+
+_lock = threading.Lock()
+_session = None
+_session_pid = None
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def _build_session() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=POOL_CONNECTIONS,
+        pool_maxsize=POOL_MAXSIZE,
+        pool_block=False,  # при нехватке — временное соединение, а не ожидание
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({"Connection": "keep-alive"})
+    return session
+
+
+def get_session() -> requests.Session:
+    """
+    Общая сессия с пулом соединений для текущего процесса.
+    После fork (gunicorn) создаётся заново — сокеты родителя не наследуем.
+    """
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _lock:
+            if _session is None or _session_pid != pid:
+                _session = _build_session()
+                _session_pid = pid
+    return _session
+
+
+def default_timeout(read: float | None = None) -> tuple[float, float]:
+    return (CONNECT_TIMEOUT, read if read is not None else READ_TIMEOUT)
+
+
+def post(url: str, timeout=None, **kwargs) -> requests.Response:
+    return get_session().post(url, timeout=timeout or default_timeout(), **kwargs)
+
+
+def get(url: str, timeout=None, **kwargs) -> requests.Response:
+    return get_session().get(url, timeout=timeout or default_timeout(), **kwargs)
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """
+    Асинхронный клиент с пулом keep-alive соединений, один на event loop
+    (httpx-клиент нельзя делить между циклами).
+    """
+    loop = asyncio.get_running_loop()
+    async_client = _async_clients.get(loop)
+    if async_client is None or async_client.is_closed:
+        async_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=ASYNC_MAX_CONNECTIONS,
+                max_keepalive_connections=POOL_MAXSIZE,
+            ),
+        )
+        _async_clients[loop] = async_client
+    return async_client
+
+
+async def apost(url: str, **kwargs) -> httpx.Response:
+    return await get_async_client().post(url, **kwargs)
+
+
+def pool_stats() -> dict:
+    """
+    Счётчики пула текущего процесса:
+    - misses — сколько раз открывали новое соединение (рукопожатие),
+    - hits — запросы, ушедшие по уже открытому keep-alive соединению.
+    """
+    requests_total, connections = 0, 0
+    if _session is not None and _session_pid == os.getpid():
+        for adapter in set(_session.adapters.values()):
+            for key in list(adapter.poolmanager.pools.keys()):
+                pool = adapter.poolmanager.pools.get(key)
+                if pool is None:
+                    continue
+                requests_total += pool.num_requests
+                connections += pool.num_connections
+    return {
+        "pid": os.getpid(),
+        "pool_maxsize": POOL_MAXSIZE,
+        "requests": requests_total,
+        "hits": max(0, requests_total - connections),
+        "misses": connections,
+    }
@@ -0,0 +1,152 @@
+# chat_app/model_providers/openrouter/health.py
+import time
+from contextlib import contextmanager
+from decouple import config
+from django.core.cache import cache
+
+# Здоровье моделей в общем кэше: последние N исходов (успех + задержка)
+# и счётчик ошибок подряд. После BREAKER_FAILURES ошибок подряд цепь
+# размыкается — модель пропускаем BREAKER_COOLDOWN секунд, затем пускаем
+# один пробный запрос (half-open): успех замыкает цепь, ошибка — снова open.
+HEALTH_PREFIX = "model_health:v1:"
+HEALTH_WINDOW = config("OPENROUTER_HEALTH_WINDOW", default=50, cast=int)
+HEALTH_TTL = config("OPENROUTER_HEALTH_TTL", default=86400, cast=int)
+BREAKER_FAILURES = config("OPENROUTER_BREAKER_FAILURES", default=3, cast=int)
+BREAKER_COOLDOWN = config("OPENROUTER_BREAKER_COOLDOWN", default=120, cast=int)
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class CircuitOpen(Exception):
+    def __init__(self, model: str):
+        self.model = model
+        super().__init__(f"цепь разомкнута: {model}")
+
+
+def _key(model: str) -> str:
+    return HEALTH_PREFIX + model
+
+
+def _probe_key(model: str) -> str:
+    return HEALTH_PREFIX + "probe:" + model
+
+
+def _empty() -> dict:
+    return {"outcomes": [], "failures": 0, "opened_at": None}
+
+
+def record(model: str | None, ok: bool, latency_ms: float) -> None:
+    """
+    Исход запроса к модели. Чтение-запись без блокировки: при гонке воркеров
+    потеряется один исход из окна — для статистики это допустимо.
+    """
+    if not model:
+        return
+    entry = cache.get(_key(model)) or _empty()
+    entry["outcomes"] = (entry["outcomes"] + [(bool(ok), int(latency_ms))])[-HEALTH_WINDOW:]
+    if ok:
+        entry["failures"], entry["opened_at"] = 0, None
+    else:
+        entry["failures"] += 1
+        if entry["failures"] >= BREAKER_FAILURES:
+            entry["opened_at"] = time.time()  # в т.ч. повторно после неудачной пробы
+    cache.set(_key(model), entry, timeout=HEALTH_TTL)
+    cache.delete(_probe_key(model))
+
+
+async def arecord(model: str | None, ok: bool, latency_ms: float) -> None:
+    if not model:
+        return
+    entry = await cache.aget(_key(model)) or _empty()
+    entry["outcomes"] = (entry["outcomes"] + [(bool(ok), int(latency_ms))])[-HEALTH_WINDOW:]
+    if ok:
+        entry["failures"], entry["opened_at"] = 0, None
+    else:
+        entry["failures"] += 1
+        if entry["failures"] >= BREAKER_FAILURES:
+            entry["opened_at"] = time.time()
+    await cache.aset(_key(model), entry, timeout=HEALTH_TTL)
+    await cache.adelete(_probe_key(model))
+
+
+@contextmanager
+def track(model: str | None):
+    """Замеряет вызов: исключение внутри блока — ошибка модели."""
+    started = time.monotonic()
+    try:
+        yield
+    except Exception:
+        record(model, False, (time.monotonic() - started) * 1000)
+        raise
+    record(model, True, (time.monotonic() - started) * 1000)
+
+
+def _state(entry: dict | None) -> str:
+    if not entry or not entry.get("opened_at"):
+        return CLOSED
+    if time.time() - entry["opened_at"] < BREAKER_COOLDOWN:
+        return OPEN
+    return HALF_OPEN
+
+
+def allow(model: str | None) -> bool:
+    """
+    Можно ли слать запрос модели. В half-open пропускаем ровно один пробный
+    запрос на все воркеры (замок в кэше живёт не дольше паузы).
+    """
+    if not model:
+        return True
+    state = _state(cache.get(_key(model)))
+    if state == CLOSED:
+        return True
+    if state == OPEN:
+        return False
+    return cache.add(_probe_key(model), 1, timeout=BREAKER_COOLDOWN)
+
+
+def is_open(model: str | None) -> bool:
+    """Без побочных эффектов (для ранжирования): True — модель сейчас пропускаем."""
+    return bool(model) and _state(cache.get(_key(model))) == OPEN
+
+
+def _percentile(values: list[int], p: float) -> int | None:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+def _summary(entry: dict | None) -> dict:
+    outcomes = (entry or {}).get("outcomes", [])
+    latencies = [ms for ok, ms in outcomes if ok]
+    return {
+        "state": _state(entry),
+        "samples": len(outcomes),
+        "success_rate": round(len(latencies) / len(outcomes), 4) if outcomes else None,
+        "p50_ms": _percentile(latencies, 50),
+        "p95_ms": _percentile(latencies, 95),
+        "consecutive_failures": (entry or {}).get("failures", 0),
+    }
+
+
+def report(models: list[str]) -> dict:
+    """Сводка по моделям: состояние цепи, доля успехов, p50/p95 задержки."""
+    entries = cache.get_many([_key(m) for m in models])
+    return {m: _summary(entries.get(_key(m))) for m in models}
+
+
+def rank(models: list[str]) -> list[str]:
+    """
+    Сортирует модели по здоровью: открытые цепи — в конец, дальше по доле
+    успехов и p95. Сортировка стабильная: модели без истории сохраняют
+    исходный порядок витрины.
+    """
+    summaries = report(models)
+
+    def score(model: str):
+        s = summaries[model]
+        rate = 1.0 if s["success_rate"] is None else s["success_rate"]
+        # доля успехов грубо (шаг 10%), чтобы шум в задержке не перемешивал список
+        return (s["state"] == OPEN, -round(rate, 1), s["p95_ms"] or 0)
+
+    return sorted(models, key=score)
@@ -0,0 +1,70 @@
+# chat_app/model_providers/openrouter/hedge.py
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, TypeVar
+from decouple import config
+
+# Hedged-запросы: основная модель стартует сразу, запасные — через HEDGE_DELAY
+# секунд или сразу после ошибки. Побеждает первый валидный ответ.
+HEDGE_ENABLED = config("OPENROUTER_HEDGE_ENABLED", default=False, cast=bool)
+HEDGE_DELAY = config("OPENROUTER_HEDGE_DELAY", default=4.0, cast=float)
+HEDGE_FANOUT = config("OPENROUTER_HEDGE_FANOUT", default=2, cast=int)  # запасных моделей
+
+T = TypeVar("T")
+
+
+class AllModelsFailed(Exception):
+    def __init__(self, errors: dict):
+        self.errors = errors
+        super().__init__("; ".join(f"{m}: {e}" for m, e in errors.items()) or "no models")
+
+
+def hedged_call(
+    models: list[str],
+    call: Callable[[str], T],
+    validate: Callable[[T], bool] | None = None,
+    delay: float = HEDGE_DELAY,
+) -> tuple[T, str]:
+    """
+    Вызывает call(model) для моделей по очереди с перекрытием и возвращает
+    (результат, модель) первого валидного ответа. Проигравшие запросы
+    отменяются, если ещё не начались; уже начатые HTTP-запросы дорабатывают
+    в фоне, но их результат никто не ждёт.
+    """
+    models = [m for m in dict.fromkeys(models) if m]
+    if not models:
+        raise AllModelsFailed({})
+
+    errors: dict = {}
+    pool = ThreadPoolExecutor(max_workers=len(models), thread_name_prefix="or-hedge")
+    pending: dict = {}
+    queue = list(models)
+
+    def launch_next():
+        model = queue.pop(0)
+        pending[pool.submit(call, model)] = model
+
+    try:
+        launch_next()
+        while pending:
+            done, _ = wait(pending, timeout=delay if queue else None, return_when=FIRST_COMPLETED)
+            if not done:
+                launch_next()  # основная модель тормозит — подключаем запасную
+                continue
+            failed = False
+            for future in done:
+                model = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    errors[model] = e
+                    failed = True
+                    continue
+                if validate is None or validate(result):
+                    return result, model
+                errors[model] = ValueError("invalid response")
+                failed = True
+            if failed and queue:
+                launch_next()  # ошибка — следующую модель без ожидания
+        raise AllModelsFailed(errors)
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
@@ -1,78 +1,143 @@
 # chat_app/model_providers/openrouter/query.py
-import requests
+import json
+import time
+from asgiref.sync import sync_to_async
 from decouple import config
 from django.core.cache import cache
 from django.conf import settings
 from .selector import get_top_models
+from . import client, health
+from .hedge import HEDGE_ENABLED, HEDGE_FANOUT, AllModelsFailed, hedged_call
+from ...tokens import Usage, estimate_usage
 
 OPENROUTER_API_KEY = config("OPENROUTER_API_KEY")
 OPENROUTER_URL = config("OPENROUTER_API_URL")
 
 
-def query_openrouter(
-    prompt: str,
-    model_id: str,
-    language: str = "en",
-    system_prompt: str = None,
-    temperature: float = 0.7,
-):
-    print("prompt", prompt, "model_id", model_id)
-    print(
-        "language", language, "system_prompt", system_prompt, "temperature", temperature
-    )
-    """Обновлённая версия с поддержкой кастомных параметров"""
-    headers = {
+def _headers() -> dict:
+    return {
         "Authorization": f"Bearer {OPENROUTER_API_KEY}",
         "HTTP-Referer": settings.FRONT_URL,
         "X-Title": "AI Chat Demo",
     }
 
-    payload = {
+
+class Completion(tuple):
+    """
+    Ответ модели. Распаковывается как раньше — `content, model = ...`,
+    а учёт (токены из usage провайдера, задержка, finish_reason) — в .usage.
+    """
+
+    def __new__(cls, content: str, model: str | None, usage: Usage | None = None):
+        obj = super().__new__(cls, (content, model))
+        obj.usage = usage or Usage()
+        return obj
+
+    def __getnewargs__(self):
+        # pickle (кэши) по умолчанию вызвал бы __new__ с одним аргументом-кортежем
+        return self[0], self[1], self.usage
+
+    @property
+    def content(self) -> str:
+        return self[0]
+
+    @property
+    def model(self) -> str | None:
+        return self[1]
+
+
+def parse_usage(data: dict, payload: dict, content: str, latency_ms: int | None) -> Usage:
+    """usage из ответа OpenRouter; если его нет — локальная оценка (estimated=True)."""
+    choices = data.get("choices") or [{}]
+    finish_reason = choices[0].get("finish_reason") or ""
+    usage = data.get("usage") or {}
+    if usage.get("prompt_tokens") is None and usage.get("completion_tokens") is None:
+        return estimate_usage(payload["messages"], content, latency_ms, finish_reason)
+    return Usage(
+        prompt_tokens=usage.get("prompt_tokens"),
+        completion_tokens=usage.get("completion_tokens"),
+        latency_ms=latency_ms,
+        finish_reason=finish_reason,
+    )
+
+
+def _ms_since(started: float) -> int:
+    return int((time.monotonic() - started) * 1000)
+
+
+def _payload(
+    prompt: str,
+    model_id: str,
+    system_prompt: str = None,
+    temperature: float = 0.7,
+    history: list[dict] | None = None,
+) -> dict:
+    # history — предыдущие ходы треда (conversation.build_history) между system и вопросом
+    return {
         "model": model_id,
         "messages": [
             {
                 "role": "system",
                 "content": system_prompt or "You are a helpful assistant.",
             },
+            *(history or []),
             {"role": "user", "content": prompt},
         ],
         "temperature": temperature,
     }
 
-    try:
-        response = requests.post(
-            OPENROUTER_URL, headers=headers, json=payload, timeout=30
-        )
-                
-        # сразу перед response.raise_for_status()
-        print("[OR] status:", response.status_code)
+
+def query_openrouter(
+    prompt: str,
+    model_id: str,
+    language: str = "en",
+    system_prompt: str = None,
+    temperature: float = 0.7,
+    history: list[dict] | None = None,
+):
+    print("prompt", prompt, "model_id", model_id)
+    print(
+        "language", language, "system_prompt", system_prompt, "temperature", temperature
+    )
+    """Обновлённая версия с поддержкой кастомных параметров"""
+    headers = _headers()
+    payload = _payload(prompt, model_id, system_prompt, temperature, history)
+
+    if HEDGE_ENABLED:
+        # модели с разомкнутой цепью не дёргаем; если «мертвы» все — пробуем основную
+        candidates = [m for m in [model_id, *_fallback_models(exclude=model_id)] if health.allow(m)]
         try:
+            completion, _model = hedged_call(
+                candidates or [model_id],
+                lambda model: complete_once(headers, {**payload, "model": model}),
+            )
+            return completion
+        except AllModelsFailed as e:
+            print(f"[OR][hedge] все модели упали: {e}")
+            return Completion(_unavailable_message(language), None)
+
+    try:
+        if not health.allow(model_id):
+            raise health.CircuitOpen(model_id)
+        with health.track(model_id):
+            started = time.monotonic()
+            response = client.post(OPENROUTER_URL, headers=headers, json=payload)
+
+            # сразу перед response.raise_for_status()
+            print("[OR] status:", response.status_code)
+            try:
+                data = response.json()
+                if not data.get("choices"):
+                    print("[OR] no choices in payload!")
+            except Exception as jerr:
+                # если не JSON — выведем голый текст начала ответа
+                print("[OR] non-JSON response:", repr(response.text[:400]))
+                raise jerr
+
+            response.raise_for_status()
             data = response.json()
-            # ключи верхнего уровня
-            # print("[OR] top keys:", list(data.keys()))
-            # ключи первого choice
-            if data.get("choices"):
-                # print("[OR] choice[0] keys:", list(data["choices"][0].keys()))
-                # что внутри message / content
-                msg = data["choices"][0].get("message", {})
-                # print("[OR] message keys:", list(msg.keys()) if isinstance(msg, dict) else type(msg))
-                # покажем первые 200 символов «контента» (где бы он ни лежал)
-                content_preview = (
-                    (msg.get("content") if isinstance(msg, dict) else None)
-                    or data["choices"][0].get("content")
-                    or ""
-                )
-                # print("[OR] content preview:", str(content_preview)[:200].replace("\n", " "))
-            else:
-                print("[OR] no choices in payload!")
-        except Exception as jerr:
-            # если не JSON — выведем голый текст начала ответа
-            print("[OR] non-JSON response:", repr(response.text[:400]))
-            raise jerr         
-        
-        response.raise_for_status()
-        content = response.json()["choices"][0]["message"]["content"]
-        return content, model_id
+            content = data["choices"][0]["message"]["content"]
+        return Completion(content, model_id, parse_usage(data, payload, content, _ms_since(started)))
 
     except Exception as e:
         print(f"Ошибка запроса: {str(e)}")
@@ -81,30 +146,154 @@ def query_openrouter(
             print("[OR][error] body:", getattr(e, "response", None) and e.response and e.response.text[:400])
         except Exception:
             pass
-        # Обновляем кэш моделей
-        fresh_models = get_top_models()
-
-        # Берём первую доступную модель
-        fallback_model = fresh_models["code_models"][-1]["model_id"]
-        # fallback_model = fresh_models["text_models"][0]["model_id"]
-        print("fallback_model", fallback_model)
         try:
+            fallback_model = _fallback_model(exclude=model_id)
+            print("fallback_model", fallback_model)
             # Повторный запрос
-            response = requests.post(
-                OPENROUTER_URL,
-                headers=headers,
-                json={**payload, "model": fallback_model},
-                timeout=30,
-            )
-            response.raise_for_status()
-            return response.json()["choices"][0]["message"]["content"], fallback_model
+            with health.track(fallback_model):
+                started = time.monotonic()
+                response = client.post(
+                    OPENROUTER_URL,
+                    headers=headers,
+                    json={**payload, "model": fallback_model},
+                )
+                response.raise_for_status()
+                data = response.json()
+                content = data["choices"][0]["message"]["content"]
+            return Completion(content, fallback_model, parse_usage(data, payload, content, _ms_since(started)))
 
         except Exception as e:
             print(f"Вторая ошибка от fallback_model: {str(e)}")
-            # Формируем сообщение в зависимости от языка
-            error_msg = (
-                "OpenRouter сейчас недоступен. Пожалуйста, попробуйте позже."
-                if language == "ru"
-                else "OpenRouter is currently unavailable. Please try again later."
-            )
-            return error_msg, None
+            return Completion(_unavailable_message(language), None)
+
+
+def _fallback_model(exclude: str | None = None) -> str:
+    # Каталог моделей — из кэша (catalog.py), без живой загрузки;
+    # из запасных берём самую здоровую (health.py), а не просто последнюю code-модель
+    fallbacks = _fallback_models(exclude=exclude, n=1)
+    if fallbacks:
+        return fallbacks[0]
+    return get_top_models()["code_models"][-1]["model_id"]
+
+
+def _fallback_models(exclude: str | None = None, n: int = HEDGE_FANOUT) -> list[str]:
+    """Запасные модели для hedged-режима: сначала привычный _fallback_model, затем остальные."""
+    top = get_top_models()
+    code = [m["model_id"] for m in top.get("code_models", [])]
+    text = [m["model_id"] for m in top.get("text_models", [])]
+    ordered = [m for m in dict.fromkeys([*code[-1:], *code[:-1], *text]) if m != exclude]
+    return [m for m in health.rank(ordered) if not health.is_open(m)][:n]
+
+
+def complete_once(headers: dict, payload: dict) -> Completion:
+    """Одна попытка без fallback: ошибки и пустой ответ — исключение."""
+    with health.track(payload.get("model")):
+        started = time.monotonic()
+        response = client.post(OPENROUTER_URL, headers=headers, json=payload)
+        response.raise_for_status()
+        data = response.json()
+        content = data["choices"][0]["message"]["content"]
+        if not content or not content.strip():
+            raise ValueError(f"пустой ответ от {payload.get('model')}")
+    return Completion(content, payload.get("model"), parse_usage(data, payload, content, _ms_since(started)))
+
+
+def _unavailable_message(language: str) -> str:
+    # Формируем сообщение в зависимости от языка
+    return (
+        "OpenRouter сейчас недоступен. Пожалуйста, попробуйте позже."
+        if language == "ru"
+        else "OpenRouter is currently unavailable. Please try again later."
+    )
+
+
+async def aquery_openrouter(
+    prompt: str,
+    model_id: str,
+    language: str = "en",
+    system_prompt: str = None,
+    temperature: float = 0.7,
+    history: list[dict] | None = None,
+):
+    """
+    Асинхронный двойник query_openrouter (для ASGI-вьюх): тот же payload
+    и тот же fallback, но воркер не блокируется на время генерации.
+    """
+    headers = _headers()
+    payload = _payload(prompt, model_id, system_prompt, temperature, history)
+
+    try:
+        if not await sync_to_async(health.allow)(model_id):
+            raise health.CircuitOpen(model_id)
+        return await _acomplete(headers, payload)
+    except Exception as e:
+        print(f"[OR][async] ошибка запроса: {str(e)}")
+        try:
+            fallback_model = await sync_to_async(_fallback_model)(exclude=model_id)
+            return await _acomplete(headers, {**payload, "model": fallback_model})
+        except Exception as e:
+            print(f"[OR][async] вторая ошибка от fallback_model: {str(e)}")
+            return Completion(_unavailable_message(language), None)
+
+
+async def _acomplete(headers: dict, payload: dict) -> Completion:
+    started = time.monotonic()
+    try:
+        response = await client.apost(OPENROUTER_URL, headers=headers, json=payload)
+        response.raise_for_status()
+        data = response.json()
+        content = data["choices"][0]["message"]["content"]
+    except Exception:
+        await health.arecord(payload.get("model"), False, _ms_since(started))
+        raise
+    await health.arecord(payload.get("model"), True, _ms_since(started))
+    return Completion(content, payload.get("model"), parse_usage(data, payload, content, _ms_since(started)))
+
+
+def stream_openrouter(
+    prompt: str,
+    model_id: str,
+    system_prompt: str = None,
+    temperature: float = 0.7,
+    history: list[dict] | None = None,
+    on_usage=None,
+):
+    """
+    Потоковый ответ (stream: true): отдаёт кусочки текста по мере генерации.
+    Ошибки не глушим — решение о fallback принимает вызывающий код.
+    on_usage(Usage) вызывается после [DONE]: usage OpenRouter присылает последним чанком.
+    """
+    payload = {
+        **_payload(prompt, model_id, system_prompt, temperature, history),
+        "stream": True,
+        "usage": {"include": True},
+    }
+    if not health.allow(model_id):
+        raise health.CircuitOpen(model_id)
+    started = time.monotonic()
+    parts: list[str] = []
+    finish_reason, usage = "", None
+    with health.track(model_id), client.post(OPENROUTER_URL, headers=_headers(), json=payload, stream=True) as response:
+        response.raise_for_status()
+        for raw in response.iter_lines():
+            line = raw.decode("utf-8") if isinstance(raw, bytes) else raw
+            # пустые строки — разделители событий, ":" — keep-alive комментарии OpenRouter
+            if not line or line.startswith(":") or not line.startswith("data:"):
+                continue
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                break
+            chunk = json.loads(data)
+            if chunk.get("error"):
+                raise RuntimeError(chunk["error"].get("message") or str(chunk["error"]))
+            usage = chunk.get("usage") or usage
+            choices = chunk.get("choices") or []
+            if choices and choices[0].get("finish_reason"):
+                finish_reason = choices[0]["finish_reason"]
+            delta = (choices[0].get("delta") or {}).get("content") if choices else None
+            if delta:
+                parts.append(delta)
+                yield delta
+    if on_usage:
+        summary = {"choices": [{"finish_reason": finish_reason}], "usage": usage}
+        on_usage(parse_usage(summary, payload, "".join(parts), _ms_since(started)))
@@ -1,14 +1,26 @@
 # chat_app/model_providers/openrouter/selector.py
 from collections import defaultdict
-from .api import fetch_models, is_model_free
+from .catalog import get_free_models
+from . import health
 
 BAD_HINTS = ("-coder", "vl-", "vl_", "vision")  # лёгкая зачистка «подозрительных» id
 
 def get_top_models() -> dict:
-    """Берём последние (предположительно свежие) free-модели по каждому бренду."""
-    models = fetch_models()
-    free_models = [m for m in models if is_model_free(m)]
+    """
+    Топ free-моделей из кэшированного каталога (без живой загрузки на каждый вызов).
+    Внутри групп модели отсортированы по здоровью (health.py): разомкнутые — в конце.
+    """
+    top = select_top_models(get_free_models())
+    return {kind: _ranked(items) for kind, items in top.items()}
+
+
+def _ranked(items: list[dict]) -> list[dict]:
+    by_id = {m["model_id"]: m for m in items}
+    return [by_id[mid] for mid in health.rank(list(by_id))]
 
+
+def select_top_models(free_models: list[dict]) -> dict:
+    """Берём последние (предположительно свежие) free-модели по каждому бренду."""
     brand_groups = defaultdict(list)
     for m in free_models:
         mid = m["id"]
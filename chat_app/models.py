@@ -1,18 +1,56 @@
 # ai-chat-django/chat_app/models.py
 from django.db import models
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 import uuid
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
 
+class CategoryQuerySet(models.QuerySet):
+    def with_activity(self):
+        """
+        Счётчик вопросов и последняя активность — коррелированными подзапросами
+        по индексу вопросов, а не JOIN + GROUP BY по всем полям категории
+        (тот сортирует во временной таблице).
+        """
+        questions = Question.objects.filter(category=models.OuterRef("pk")).order_by().values("category")
+        return self.annotate(
+            question_count=Coalesce(
+                models.Subquery(questions.annotate(n=models.Count("id")).values("n")), 0
+            ),
+            last_activity=models.Subquery(questions.annotate(m=models.Max("created_at")).values("m")),
+        )
+
+
 class Category(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     name = models.CharField(max_length=100)
     owner = models.ForeignKey(User, related_name='categories', on_delete=models.CASCADE)
+
+    objects = CategoryQuerySet.as_manager()
     
     def __str__(self):
         return self.name
 
+class QuestionQuerySet(models.QuerySet):
+    def with_answers(self):
+        """
+        Вопросы вместе с ответами за константное число запросов: ответы —
+        одним prefetch (свежие сверху), модель последнего ответа — аннотацией.
+        Без этого QuestionSerializer делает по 2 запроса на каждый вопрос.
+        """
+        latest = Answer.objects.filter(question=models.OuterRef("pk")).order_by("-created_at")
+        return self.annotate(
+            latest_answer_model=models.Subquery(latest.values("model")[:1]),
+            has_answers=models.Exists(latest),
+        ).prefetch_related(
+            # внутри вопроса — свежие сверху; question_id первым, чтобы IN по
+            # странице шёл по chat_a_question_created без сортировки
+            models.Prefetch("answers", queryset=Answer.objects.order_by("question_id", "-created_at", "-id"))
+        )
+
+
 class Question(models.Model):
     TEXT = 'text'
     CODE = 'code'
@@ -28,19 +66,32 @@ class Question(models.Model):
     prompt = models.TextField()
     model_type = models.CharField(max_length=10, choices=MODEL_TYPES, blank=True, null=True)
     model = models.CharField(max_length=70, blank=True, null=True)
+    # язык ответа (системный промпт); "" — вопросы, заданные до появления поля
+    language = models.CharField(max_length=8, blank=True, default="")
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = QuestionQuerySet.as_manager()
+
     def __str__(self):
         return f"{self.prompt[:20]} by {self.user}"
     
     class Meta:
         ordering = ["-created_at"]  # самую «свежую» сверху
+        indexes = [
+            # лента вопросов категории: WHERE category, user ORDER BY created_at, id
+            models.Index(fields=["category", "user", "-created_at", "-id"], name="chat_q_cat_user_created"),
+        ]
 
 class Answer(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     question = models.ForeignKey(Question, on_delete=models.CASCADE, related_name="answers")
     content = models.TextField()
-    tokens_used = models.IntegerField(null=True, blank=True)
+    tokens_used = models.IntegerField(null=True, blank=True)  # prompt + completion
+    # учёт из usage провайдера (или локальная оценка, если usage не пришёл)
+    prompt_tokens = models.IntegerField(null=True, blank=True)
+    completion_tokens = models.IntegerField(null=True, blank=True)
+    latency_ms = models.IntegerField(null=True, blank=True)  # None — ответ из кэша
+    finish_reason = models.CharField(max_length=32, blank=True, default="")
     model = models.CharField(max_length=70, blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     
@@ -50,8 +101,13 @@ class Answer(models.Model):
 
     class Meta:
         ordering = ["-created_at"]
-        
-        
+        indexes = [
+            # ответы вопроса (курсор) и «последний ответ» в with_answers()
+            models.Index(fields=["question", "-created_at", "-id"], name="chat_a_question_created"),
+        ]
+
+
+
 class GeneratedImage(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     file = models.ImageField(upload_to='generated/')
@@ -65,3 +121,40 @@ class GeneratedImage(models.Model):
     
     class Meta:
         ordering = ["-created_at"]
+
+
+class GenerationJob(models.Model):
+    """Фоновая генерация ответа: запрос кладёт задачу, воркер заполняет Answer."""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    question = models.ForeignKey(Question, on_delete=models.CASCADE, related_name="jobs")
+    language = models.CharField(max_length=8, default="en")
+    conversation = models.BooleanField(default=False)  # с историей категории (conversation.py)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.IntegerField(default=0)
+    error = models.TextField(blank=True, default="")
+    run_after = models.DateTimeField(default=timezone.now)  # отложенный повтор после ошибки
+    locked_by = models.CharField(max_length=64, blank=True, default="")  # какой воркер взял
+    locked_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.status} job for {self.question_id}"
+
+    class Meta:
+        ordering = ["created_at"]
+        indexes = [
+            models.Index(fields=["status", "run_after"], name="chat_job_status_run_after"),
+            # requeue_stale: WHERE status = running AND locked_at < …
+            models.Index(fields=["status", "locked_at"], name="chat_job_status_locked_at"),
+        ]
@@ -0,0 +1,18 @@
+# chat_app/pagination.py
+from decouple import config
+from rest_framework.pagination import CursorPagination
+
+HISTORY_PAGE_SIZE = config("CHAT_HISTORY_PAGE_SIZE", default=20, cast=int)
+
+
+class HistoryCursorPagination(CursorPagination):
+    """
+    Keyset-пагинация истории (свежие сверху): курсор по (created_at, id),
+    поэтому глубокая прокрутка стоит O(page_size), а не OFFSET по всей истории.
+    id — тай-брейкер для записей с одинаковым created_at.
+    """
+
+    ordering = ("-created_at", "-id")
+    page_size = HISTORY_PAGE_SIZE
+    page_size_query_param = "page_size"
+    max_page_size = 100
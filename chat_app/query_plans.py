@@ -0,0 +1,60 @@
+# chat_app/query_plans.py
+import uuid
+from django.db import connection, transaction
+from django.utils import timezone
+from .jobs import ready_jobs
+from .models import Answer, Category, GenerationJob, Question
+
+# Горячие запросы chat_app в том виде, в каком их строят вьюхи и воркер.
+# `manage.py check_query_plans` прогоняет по каждому EXPLAIN и падает, если
+# план читает таблицу целиком или сортирует во временной структуре.
+_ANY_ID = uuid.UUID(int=0)  # значения фильтров на план не влияют
+_ANY_USER = 0
+PAGE = 21  # page_size + 1: столько берёт CursorPagination
+
+HOT_QUERIES = {
+    "question_feed": lambda: Question.objects.filter(category_id=_ANY_ID, user_id=_ANY_USER)
+    .with_answers()
+    .order_by("-created_at", "-id")[:PAGE],
+    "question_feed_after_cursor": lambda: Question.objects.filter(
+        category_id=_ANY_ID, user_id=_ANY_USER, created_at__lt=timezone.now()
+    ).order_by("-created_at", "-id")[:PAGE],
+    "answer_feed": lambda: Answer.objects.filter(question_id=_ANY_ID).order_by("-created_at", "-id")[:PAGE],
+    # prefetch_related страницы: IN на PAGE вопросов (одно значение планировщик свёл бы к «=»)
+    "answers_prefetch": lambda: Answer.objects.filter(
+        question_id__in=[uuid.UUID(int=i) for i in range(1, PAGE + 1)]
+    ).order_by("question_id", "-created_at", "-id"),
+    # финальная сортировка по last_activity — по подзапросу, её индексом не снять;
+    # проверяем выборку и подзапросы (категорий у пользователя единицы-десятки)
+    "category_list": lambda: Category.objects.filter(owner_id=_ANY_USER).with_activity(),
+    "job_claim": lambda: ready_jobs(timezone.now()).values_list("pk", flat=True)[:5],
+    # requeue_stale делает UPDATE — без ORDER BY из Meta.ordering
+    "job_requeue_stale": lambda: GenerationJob.objects.filter(
+        status=GenerationJob.RUNNING, locked_at__lt=timezone.now()
+    ).order_by(),
+}
+
+# признаки плохого плана: полный проход по таблице / сортировка без индекса
+BAD_PLAN_MARKERS = {
+    "sqlite": ("SCAN ", "USE TEMP B-TREE"),
+    "postgresql": ("Seq Scan", "Sort"),
+}
+
+
+def plan_problems(plan: str, vendor: str) -> list[str]:
+    """Строки плана с признаками полного прохода или сортировки."""
+    markers = BAD_PLAN_MARKERS.get(vendor, ())
+    return [line.strip() for line in plan.splitlines() if any(m in line for m in markers)]
+
+
+def explain(name: str) -> tuple[str, list[str]]:
+    """(план, проблемы) для одного запроса из HOT_QUERIES."""
+    vendor = connection.vendor
+    with transaction.atomic():
+        if vendor == "postgresql":
+            # на маленькой/пустой базе планировщик и так выберет Seq Scan —
+            # проверяем, что индекс вообще есть и подходит
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL enable_seqscan = off")
+        plan = HOT_QUERIES[name]().explain()
+    return plan, plan_problems(plan, vendor)
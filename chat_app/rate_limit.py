@@ -0,0 +1,66 @@
+# chat_app/rate_limit.py
+import math
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from django.core.cache import cache
+
+# Общий для всех воркеров лимит запросов к внешнему API (ведро токенов в кэше).
+# У кэша Django есть атомарный incr, но нет compare-and-set, поэтому ведро
+# пополняется окнами: окно длиной burst * 60 / rate секунд, в нём не больше
+# burst токенов. Для burst=1 это ровно «один запрос раз в 60/rate секунд».
+RATE_PREFIX = "rate:"
+
+
+def acquire(name: str, rate_per_min: float, burst: int = 1) -> float:
+    """
+    Берёт токен. 0 — можно слать запрос сейчас, иначе — сколько секунд
+    ждать до следующего окна (не спим здесь: решает вызывающий код).
+    """
+    window = burst * 60.0 / rate_per_min
+    now = time.time()
+    slot = int(now // window)
+    key = f"{RATE_PREFIX}{name}:{slot}"
+
+    cache.add(key, 0, timeout=int(window) + 1)
+    try:
+        taken = cache.incr(key)
+    except ValueError:  # ключ вытеснили между add и incr
+        cache.set(key, 1, timeout=int(window) + 1)
+        taken = 1
+    if taken <= burst:
+        return 0.0
+    return round((slot + 1) * window - now, 3)
+
+
+def penalize(name: str, rate_per_min: float, seconds: float, burst: int = 1) -> None:
+    """
+    Провайдер сам ответил 429: сжигаем токены окон на ближайшие seconds,
+    чтобы другие воркеры тоже подождали.
+    """
+    window = burst * 60.0 / rate_per_min
+    now = time.time()
+    first, last = int(now // window), int((now + seconds) // window)
+    for slot in range(first, last + 1):
+        cache.set(f"{RATE_PREFIX}{name}:{slot}", burst, timeout=int(seconds + window) + 1)
+
+
+def parse_retry_after(value: str | None, default: float = 10.0) -> float:
+    """
+    Retry-After — число секунд или HTTP-дата («Wed, 21 Oct 2026 07:28:00 GMT»).
+    Возвращает секунды до повтора (не меньше 0); непонятное значение — default.
+    """
+    if not value:
+        return default
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            when = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return default
+        if when.tzinfo is None:
+            when = when.replace(tzinfo=timezone.utc)
+        seconds = (when - datetime.now(timezone.utc)).total_seconds()
+    # inf/nan сломали бы penalize (окна до бесконечности)
+    return max(0.0, seconds) if math.isfinite(seconds) else default
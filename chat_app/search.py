@@ -0,0 +1,238 @@
+# chat_app/search.py
+import re
+from decouple import config
+from django.db import connection
+from .models import Answer, Question
+
+# Полнотекстовый поиск по истории пользователя (Question.prompt, Answer.content).
+# Бэкенд выбирается по СУБД:
+#   sqlite     — отдельная FTS5-таблица chat_search (миграция 0007), её держат
+#                в актуальном состоянии сигналы (signals.py) и импорт (transfer.py).
+#                Колонки FTS5 без индекса, поэтому doc_id → rowid держим в обычной
+#                таблице chat_search_doc (миграция 0009) и удаляем только по rowid;
+#   postgresql — встроенный полнотекст поверх самих таблиц (GIN-индексы по
+#                тому же выражению to_tsvector — в той же миграции), синхронизировать нечего.
+# Остальные СУБД — простой icontains без ранжирования.
+SEARCH_CONFIG = config("CHAT_SEARCH_CONFIG", default="simple")  # словарь PostgreSQL
+SNIPPET_WORDS = 12
+MARK_START, MARK_END = "<mark>", "</mark>"
+
+QUESTION, ANSWER = "question", "answer"
+_TERM = re.compile(r"\w+", re.UNICODE)
+
+
+def terms(query: str) -> list[str]:
+    return _TERM.findall(query or "")[:16]
+
+
+class SearchBackend:
+    """Индекс + поиск. hit: kind, id, question_id, category_id, snippet, rank (меньше — лучше)."""
+
+    # new=True — строки только что вставлены (bulk_create, post_save created):
+    # старой записи в индексе быть не может, искать её не нужно
+
+    def index_question(self, question: Question, new: bool = False) -> None:
+        pass
+
+    def index_answer(self, answer: Answer, new: bool = False) -> None:
+        pass
+
+    def index_many(self, questions: list[Question], answers: list[Answer], new: bool = False) -> None:
+        for question in questions:
+            self.index_question(question, new)
+        for answer in answers:
+            self.index_answer(answer, new)
+
+    def remove(self, kind: str, pk) -> None:
+        pass
+
+    def search(self, user_id, query: str, category_id=None, limit: int = 20, offset: int = 0) -> list[dict]:
+        raise NotImplementedError
+
+
+class SqliteFtsBackend(SearchBackend):
+    TABLE = "chat_search"
+    DOCS = "chat_search_doc"  # id = rowid в chat_search; индексы по doc_id и question_id
+    CHUNK = 500  # параметров в одном IN — под лимит переменных SQLite
+
+    def _rows(self, questions, answers) -> list[tuple]:
+        rows = [
+            (q.prompt, QUESTION, str(q.pk), str(q.pk), str(q.category_id), q.user_id)
+            for q in questions
+        ]
+        if answers:
+            # у ответа нет своих category/user — берём у вопроса: из той же
+            # пачки (импорт) или одним запросом на недостающие
+            owners = {str(q.pk): (str(q.category_id), q.user_id) for q in questions}
+            missing = {a.question_id for a in answers if str(a.question_id) not in owners}
+            if missing:
+                owners.update(
+                    (str(pk), (str(category_id), user_id))
+                    for pk, category_id, user_id in Question.objects.filter(pk__in=missing).values_list(
+                        "pk", "category_id", "user_id"
+                    )
+                )
+            rows += [
+                (a.content, ANSWER, str(a.pk), str(a.question_id), *owners[str(a.question_id)])
+                for a in answers
+                if str(a.question_id) in owners
+            ]
+        return rows
+
+    def _rowids(self, cursor, column: str, values: list[str]) -> dict[str, int]:
+        """{doc_id: rowid} по индексированной колонке chat_search_doc."""
+        found = {}
+        for i in range(0, len(values), self.CHUNK):
+            chunk = values[i: i + self.CHUNK]
+            cursor.execute(
+                f"SELECT doc_id, id FROM {self.DOCS} WHERE {column} IN ({', '.join(['%s'] * len(chunk))})",
+                chunk,
+            )
+            found.update(cursor.fetchall())
+        return found
+
+    def _delete(self, cursor, rowids) -> None:
+        params = [(rowid,) for rowid in rowids]
+        if params:
+            cursor.executemany(f"DELETE FROM {self.TABLE} WHERE rowid = %s", params)
+            cursor.executemany(f"DELETE FROM {self.DOCS} WHERE id = %s", params)
+
+    def index_many(self, questions, answers, new: bool = False) -> None:
+        rows = self._rows(questions, answers)
+        if not rows:
+            return
+        doc_ids = [r[2] for r in rows]
+        with connection.cursor() as cursor:
+            if not new:  # переиндексация: старую запись заменяем, а не дублируем
+                self._delete(cursor, self._rowids(cursor, "doc_id", doc_ids).values())
+            cursor.executemany(
+                f"INSERT INTO {self.DOCS} (doc_id, question_id) VALUES (%s, %s)", [(r[2], r[3]) for r in rows]
+            )
+            rowids = self._rowids(cursor, "doc_id", doc_ids)
+            cursor.executemany(
+                f"INSERT INTO {self.TABLE} (rowid, body, kind, doc_id, question_id, category_id, user_id) "
+                "VALUES (%s, %s, %s, %s, %s, %s, %s)",
+                [(rowids[r[2]], *r) for r in rows],
+            )
+
+    def index_question(self, question, new: bool = False) -> None:
+        self.index_many([question], [], new)
+
+    def index_answer(self, answer, new: bool = False) -> None:
+        self.index_many([], [answer], new)
+
+    def remove(self, kind, pk) -> None:
+        with connection.cursor() as cursor:
+            rowids = self._rowids(cursor, "doc_id", [str(pk)])
+            if kind == QUESTION:  # каскад: ответы удалённого вопроса
+                rowids.update(self._rowids(cursor, "question_id", [str(pk)]))
+            self._delete(cursor, rowids.values())
+
+    @staticmethod
+    def match_expression(query: str) -> str:
+        # ввод пользователя не пускаем в синтаксис FTS5: каждое слово — фраза с префиксом
+        return " ".join('"%s"*' % t.replace('"', '""') for t in terms(query))
+
+    def search(self, user_id, query, category_id=None, limit=20, offset=0):
+        expression = self.match_expression(query)
+        if not expression:
+            return []
+        sql = (
+            f"SELECT kind, doc_id, question_id, category_id, "
+            f"snippet({self.TABLE}, 0, %s, %s, '…', %s), bm25({self.TABLE}) AS rank "
+            f"FROM {self.TABLE} WHERE {self.TABLE} MATCH %s AND user_id = %s"
+        )
+        params = [MARK_START, MARK_END, SNIPPET_WORDS, expression, user_id]
+        if category_id:
+            sql += " AND category_id = %s"
+            params.append(str(category_id))
+        sql += " ORDER BY rank, doc_id LIMIT %s OFFSET %s"
+        params += [limit, offset]
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return [
+                {"kind": kind, "id": doc_id, "question_id": question_id, "category_id": category,
+                 "snippet": snippet, "rank": round(rank, 4)}
+                for kind, doc_id, question_id, category, snippet, rank in cursor.fetchall()
+            ]
+
+
+class PostgresBackend(SearchBackend):
+    """Индексировать нечего: to_tsvector считается по GIN-индексу (миграция 0007)."""
+
+    def _ranked(self, model, field: str, query, user_filter: dict):
+        from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank, SearchVector
+
+        vector = SearchVector(field, config=SEARCH_CONFIG)
+        search_query = SearchQuery(query, config=SEARCH_CONFIG, search_type="websearch")
+        return (
+            model.objects.annotate(rank=SearchRank(vector, search_query))
+            .filter(**user_filter)
+            .annotate(
+                match=vector,
+                snippet=SearchHeadline(
+                    field, search_query, config=SEARCH_CONFIG,
+                    start_sel=MARK_START, stop_sel=MARK_END, max_words=SNIPPET_WORDS, min_words=3,
+                ),
+            )
+            .filter(match=search_query)
+            .order_by("-rank")
+        )
+
+    def search(self, user_id, query, category_id=None, limit=20, offset=0):
+        if not terms(query):
+            return []
+        question_filter = {"user_id": user_id}
+        answer_filter = {"question__user_id": user_id}
+        if category_id:
+            question_filter["category_id"] = category_id
+            answer_filter["question__category_id"] = category_id
+        questions = self._ranked(Question, "prompt", query, question_filter).values_list(
+            "pk", "category_id", "snippet", "rank"
+        )
+        answers = self._ranked(Answer, "content", query, answer_filter).values_list(
+            "pk", "question_id", "question__category_id", "snippet", "rank"
+        )
+        # ts_rank: больше — лучше; наружу отдаём как у bm25: меньше — лучше
+        hits = sorted(
+            [(QUESTION, row[0], *row) for row in questions[: offset + limit]]
+            + [(ANSWER, *row) for row in answers[: offset + limit]],
+            key=lambda hit: -hit[-1],
+        )[offset: offset + limit]
+        return [
+            {"kind": kind, "id": str(pk), "question_id": str(question_id), "category_id": str(category),
+             "snippet": snippet, "rank": round(-rank, 4)}
+            for kind, pk, question_id, category, snippet, rank in hits
+        ]
+
+
+class BasicBackend(SearchBackend):
+    """Запасной вариант без индекса: подстрока, свежие сверху."""
+
+    def search(self, user_id, query, category_id=None, limit=20, offset=0):
+        words = terms(query)
+        if not words:
+            return []
+        questions = Question.objects.filter(user_id=user_id, prompt__icontains=words[0])
+        answers = Answer.objects.filter(question__user_id=user_id, content__icontains=words[0])
+        if category_id:
+            questions = questions.filter(category_id=category_id)
+            answers = answers.filter(question__category_id=category_id)
+        hits = [
+            (q.created_at, {"kind": QUESTION, "id": str(q.pk), "question_id": str(q.pk),
+                            "category_id": str(q.category_id), "snippet": q.prompt[:200], "rank": 0.0})
+            for q in questions.order_by("-created_at")[: offset + limit]
+        ] + [
+            (a.created_at, {"kind": ANSWER, "id": str(a.pk), "question_id": str(a.question_id),
+                            "category_id": str(a.question.category_id), "snippet": a.content[:200], "rank": 0.0})
+            for a in answers.select_related("question").order_by("-created_at")[: offset + limit]
+        ]
+        hits.sort(key=lambda hit: hit[0], reverse=True)
+        return [hit for _created, hit in hits[offset: offset + limit]]
+
+
+_BACKENDS = {"sqlite": SqliteFtsBackend, "postgresql": PostgresBackend}
+
+
+def get_backend() -> SearchBackend:
+    return _BACKENDS.get(connection.vendor, BasicBackend)()
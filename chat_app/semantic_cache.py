@@ -0,0 +1,192 @@
+# chat_app/semantic_cache.py
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from decouple import config
+from . import metrics
+from .models import Answer, Question
+
+# Кэш «почти одинаковых» вопросов: нормализация + SimHash (64 бита) по словам
+# и биграммам, индекс в памяти процесса. Отдаёт уже сохранённый Answer вместо
+# нового запроса к модели. Выключен по умолчанию.
+# Область поиска — тип, модель, язык ответа и пользователь: чужие ответы
+# по умолчанию не отдаём (в них может быть личное). SEMANTIC_CACHE_SHARED=True
+# делает кэш общим для всех пользователей — только если это осознанный выбор.
+SEMANTIC_CACHE_ENABLED = config("SEMANTIC_CACHE_ENABLED", default=False, cast=bool)
+SEMANTIC_CACHE_THRESHOLD = config("SEMANTIC_CACHE_THRESHOLD", default=0.9, cast=float)  # 1.0 — только точные
+SEMANTIC_CACHE_MAX_ENTRIES = config("SEMANTIC_CACHE_MAX_ENTRIES", default=10000, cast=int)
+SEMANTIC_CACHE_WARM = config("SEMANTIC_CACHE_WARM", default=2000, cast=int)  # ответов из БД при старте
+SEMANTIC_CACHE_SHARED = config("SEMANTIC_CACHE_SHARED", default=False, cast=bool)
+MIN_WORDS = 3  # на 1–2 словах SimHash ненадёжен
+
+BITS = 64
+BANDS = 8  # 8 полос по 8 бит: при ≤7 отличающихся битах хотя бы одна полоса совпадёт
+BAND_BITS = BITS // BANDS
+
+_PUNCT = re.compile(r"[^\w\s]+", re.UNICODE)
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_prompt(text: str) -> str:
+    """Регистр, пунктуация, пробелы — то, что не меняет смысл вопроса."""
+    text = _PUNCT.sub(" ", (text or "").lower().replace("ё", "е"))
+    return _SPACES.sub(" ", text).strip()
+
+
+def _features(words: list[str]) -> list[str]:
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+def simhash(normalized: str) -> int:
+    weights = [0] * BITS
+    for feature in _features(normalized.split()):
+        h = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "big")
+        for bit in range(BITS):
+            weights[bit] += 1 if h >> bit & 1 else -1
+    return sum(1 << bit for bit in range(BITS) if weights[bit] > 0)
+
+
+def similarity(a: int, b: int) -> float:
+    return 1 - bin(a ^ b).count("1") / BITS
+
+
+def _bands(fingerprint: int) -> list[int]:
+    mask = (1 << BAND_BITS) - 1
+    return [fingerprint >> (i * BAND_BITS) & mask for i in range(BANDS)]
+
+
+class SemanticIndex:
+    """LSH-индекс по полосам SimHash; область поиска — _scope()."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: OrderedDict = OrderedDict()  # answer_id -> (scope, fingerprint)
+        self._buckets: dict = {}  # (scope, band_no, band) -> set(answer_id)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, scope: tuple, fingerprint: int, answer_id) -> None:
+        with self._lock:
+            if answer_id in self._entries:
+                self._entries.move_to_end(answer_id)
+                return
+            self._entries[answer_id] = (scope, fingerprint)
+            for i, band in enumerate(_bands(fingerprint)):
+                self._buckets.setdefault((scope, i, band), set()).add(answer_id)
+            while len(self._entries) > self.max_entries:
+                self._evict_oldest()
+
+    def _evict_oldest(self) -> None:
+        old_id, (scope, fingerprint) = self._entries.popitem(last=False)
+        for i, band in enumerate(_bands(fingerprint)):
+            bucket = self._buckets.get((scope, i, band))
+            if bucket is not None:
+                bucket.discard(old_id)
+                if not bucket:
+                    del self._buckets[(scope, i, band)]
+
+    def discard(self, answer_id) -> None:
+        with self._lock:
+            if answer_id in self._entries:
+                self._entries.move_to_end(answer_id, last=False)
+                self._evict_oldest()
+
+    def nearest(self, scope: tuple, fingerprint: int, threshold: float):
+        """(answer_id, similarity) лучшего кандидата не ниже порога или None."""
+        best = None
+        with self._lock:
+            candidates = set()
+            for i, band in enumerate(_bands(fingerprint)):
+                candidates |= self._buckets.get((scope, i, band), set())
+            for answer_id in candidates:
+                score = similarity(fingerprint, self._entries[answer_id][1])
+                if score >= threshold and (best is None or score > best[1]):
+                    best = (answer_id, score)
+            if best:
+                self._entries.move_to_end(best[0])
+        return best
+
+
+_index = SemanticIndex(SEMANTIC_CACHE_MAX_ENTRIES)
+_warm_lock = threading.Lock()
+_warmed = False
+
+
+def _scope(question: Question, language: str) -> tuple:
+    # ответ написан на языке запроса: «ru»-ответ на «en»-вопрос не годится
+    owner = None if SEMANTIC_CACHE_SHARED else question.user_id
+    return (question.model_type or Question.TEXT, question.model or "", language, owner)
+
+
+def _fingerprint(prompt: str) -> int | None:
+    normalized = normalize_prompt(prompt)
+    if len(normalized.split()) < MIN_WORDS:
+        return None
+    return simhash(normalized)
+
+
+def _warm_up() -> None:
+    """Первый вызов в процессе подтягивает последние ответы из БД."""
+    global _warmed
+    if _warmed:
+        return
+    with _warm_lock:
+        if _warmed:
+            return
+        recent = (
+            Answer.objects.filter(question__model_type__in=[Question.TEXT, Question.CODE], model__isnull=False)
+            .exclude(question__language="")  # язык неизвестен — не угадываем
+            .select_related("question")
+            .order_by("-created_at")[:SEMANTIC_CACHE_WARM]
+        )
+        # с конца, чтобы свежие оказались «моложе» в LRU
+        for answer in reversed(list(recent)):
+            _index_answer(answer, answer.question.language)
+        _warmed = True
+
+
+def _index_answer(answer: Answer, language: str) -> None:
+    question = answer.question
+    fingerprint = _fingerprint(question.prompt)
+    if fingerprint is not None:
+        _index.add(_scope(question, language), fingerprint, answer.id)
+
+
+def remember(answer: Answer, language: str) -> None:
+    """Добавляет свежий ответ модели в индекс (ошибки провайдера не кэшируем)."""
+    if SEMANTIC_CACHE_ENABLED and answer.model:
+        _index_answer(answer, language)
+
+
+def find_answer(question: Question, language: str) -> Answer | None:
+    """Ранее сохранённый Answer на почти такой же вопрос (того же языка и владельца) или None."""
+    if not SEMANTIC_CACHE_ENABLED:
+        return None
+    fingerprint = _fingerprint(question.prompt)
+    if fingerprint is None:
+        return None
+    _warm_up()
+
+    found = _index.nearest(_scope(question, language), fingerprint, SEMANTIC_CACHE_THRESHOLD)
+    answer = Answer.objects.filter(id=found[0]).first() if found else None
+    if found and answer is None:
+        _index.discard(found[0])  # ответ удалён вместе с категорией/вопросом
+    metrics.incr("semantic_cache.hits" if answer else "semantic_cache.misses")
+    return answer
+
+
+def stats() -> dict:
+    counters = metrics.read("semantic_cache.hits", "semantic_cache.misses")
+    hits, misses = counters["semantic_cache.hits"], counters["semantic_cache.misses"]
+    return {
+        "enabled": SEMANTIC_CACHE_ENABLED,
+        "threshold": SEMANTIC_CACHE_THRESHOLD,
+        "shared": SEMANTIC_CACHE_SHARED,
+        "indexed": len(_index),
+        "hits": hits,
+        "misses": misses,
+        "hit_ratio": metrics.hit_ratio(hits, misses),
+    }
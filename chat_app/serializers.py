@@ -1,10 +1,10 @@
 # ai-chat-django/chat_app/serializers.py
-from rest_framework.response import Response
 from rest_framework import serializers
 from .models import Category, Question, Answer, GeneratedImage
 from django.conf import settings
-from .utils import query_provider
-from .model_providers.image_models import query_flux_image
+from .utils import answer_question
+from .conversation import CONVERSATION_DEFAULT
+from .compare import COMPARE_MAX_MODELS, comparable_models
 
 
 class AnswerSerializer(serializers.ModelSerializer):
@@ -19,6 +19,10 @@ class AnswerSerializer(serializers.ModelSerializer):
             "model",
             "image_url",
             "tokens_used",
+            "prompt_tokens",
+            "completion_tokens",
+            "latency_ms",
+            "finish_reason",
             "created_at",
         ]
 
@@ -36,6 +40,8 @@ class QuestionSerializer(serializers.ModelSerializer):
     answers = AnswerSerializer(many=True, read_only=True)
     category_id = serializers.UUIDField(write_only=True)
     language = serializers.CharField(write_only=True)
+    # категория как тред: в промпт идут предыдущие вопросы/ответы (conversation.py)
+    conversation = serializers.BooleanField(write_only=True, required=False, default=CONVERSATION_DEFAULT)
 
     class Meta:
         model = Question
@@ -51,57 +57,38 @@ class QuestionSerializer(serializers.ModelSerializer):
             "created_at",
             "answers",
             "language",
+            "conversation",
         ]
         read_only_fields = ["category", "user", "created_at", "answers"]
 
     def get_actual_model(self, obj):
+        # из аннотации Question.objects.with_answers() — без запроса на каждый вопрос
+        if hasattr(obj, "has_answers"):
+            return obj.latest_answer_model if obj.has_answers else obj.model
         last_answer = obj.answers.order_by("-created_at").first()
         return last_answer.model if last_answer else obj.model
 
-    def create(self, validated_data):
-        model_type = validated_data.pop("model_type")
-        model_name = validated_data.pop("model")
-        prompt_text = validated_data.get("prompt")
-        category_id = validated_data.pop("category_id")
-        language = validated_data.pop("language", "en")
-
-        category = Category.objects.get(id=category_id)
+    def create_question(self, validated_data):
+        """Только запись вопроса — без обращения к модели."""
+        category = Category.objects.get(id=validated_data["category_id"])
         user = self.context["request"].user
 
-        question = Question.objects.create(
-            prompt=prompt_text,
+        return Question.objects.create(
+            prompt=validated_data.get("prompt"),
             category=category,
             user=user,
-            model=model_name,
-            model_type=model_type,
+            model=validated_data["model"],
+            model_type=validated_data["model_type"],
+            language=validated_data.get("language", "en"),
         )
 
-        if model_type == "image":
-            image_url, error = query_flux_image(prompt_text)
-            if error:
-                return Response({"error": error}, status=400)
-
-            Answer.objects.create(
-                question=question,
-                content=image_url,
-                tokens_used=0,
-                model=model_name,  # Для изображений используем исходную модель
-            )
-        else:
-            # Получаем content, tokens И реальную модель
-            text, tokens, used_model = query_provider(
-                prompt=prompt_text,
-                model_type=model_type,
-                model_id=model_name,
-                language=language,
-            )
-            Answer.objects.create(
-                question=question,
-                content=text,
-                tokens_used=tokens,
-                model=used_model,  # Сохраняем реально использованную модель
-            )
-
+    def create(self, validated_data):
+        question = self.create_question(validated_data)
+        self.answer = answer_question(
+            question,
+            validated_data.get("language", "en"),
+            conversation_mode=validated_data.get("conversation", CONVERSATION_DEFAULT),
+        )
         return question
 
 
@@ -114,6 +101,18 @@ class CategorySerializer(serializers.ModelSerializer):
         read_only_fields = ["owner"]
 
 
+class CategoryListSerializer(serializers.ModelSerializer):
+    """Лёгкий список категорий: счётчик и последняя активность вместо всей истории."""
+
+    question_count = serializers.IntegerField(read_only=True)
+    last_activity = serializers.DateTimeField(read_only=True, allow_null=True)
+
+    class Meta:
+        model = Category
+        fields = ["id", "name", "owner", "question_count", "last_activity"]
+        read_only_fields = ["owner"]
+
+
 class GeneratedImageSerializer(serializers.ModelSerializer):
     file_url = serializers.SerializerMethodField()
 
@@ -123,3 +122,25 @@ class GeneratedImageSerializer(serializers.ModelSerializer):
 
     def get_file_url(self, obj):
         return obj.file.url if obj.file else None
+
+
+class CompareSerializer(serializers.Serializer):
+    """Вход /compare/: один промпт и модели из get_top_models() (по умолчанию — первые по здоровью)."""
+    prompt = serializers.CharField()
+    model_type = serializers.ChoiceField(choices=[Question.TEXT, Question.CODE], default=Question.TEXT)
+    category_id = serializers.UUIDField()
+    language = serializers.CharField(default="en")
+    models = serializers.ListField(
+        child=serializers.CharField(), required=False, min_length=2, max_length=COMPARE_MAX_MODELS
+    )
+
+    def validate(self, attrs):
+        available = comparable_models(attrs["model_type"])
+        models = list(dict.fromkeys(attrs.get("models") or available[:COMPARE_MAX_MODELS]))
+        unknown = [m for m in models if m not in available]
+        if unknown:
+            raise serializers.ValidationError({"models": f"not in current model list: {', '.join(unknown)}"})
+        if len(models) < 2:
+            raise serializers.ValidationError({"models": "at least two models are required"})
+        attrs["models"] = models
+        return attrs
@@ -0,0 +1,25 @@
+# chat_app/signals.py
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .models import Answer, Question
+from .search import ANSWER, QUESTION, get_backend
+
+
+@receiver(post_save, sender=Question)
+def index_question(sender, instance, created=False, **kwargs):
+    get_backend().index_question(instance, new=created)
+
+
+@receiver(post_save, sender=Answer)
+def index_answer(sender, instance, created=False, **kwargs):
+    get_backend().index_answer(instance, new=created)
+
+
+@receiver(post_delete, sender=Question)
+def unindex_question(sender, instance, **kwargs):
+    get_backend().remove(QUESTION, instance.pk)
+
+
+@receiver(post_delete, sender=Answer)
+def unindex_answer(sender, instance, **kwargs):
+    get_backend().remove(ANSWER, instance.pk)
@@ -0,0 +1,132 @@
+# chat_app/streaming.py
+import json
+from rest_framework.renderers import BaseRenderer
+from .models import Answer, Question
+from . import completion_cache, conversation, semantic_cache
+from .model_providers.openrouter.query import stream_openrouter
+from .tokens import Usage, estimate_usage
+from .utils import completion_cache_key, copy_answer, provider_params, query_provider
+from auth_app import quota
+
+
+def sse_event(event: str, data) -> str:
+    """Одно server-sent событие: `event: ...` + JSON в `data:`."""
+    payload = json.dumps(data, ensure_ascii=False, default=str)
+    return f"event: {event}\ndata: {payload}\n\n"
+
+
+class EventStreamRenderer(BaseRenderer):
+    """Чтобы DRF не отвечал 406 клиентам с `Accept: text/event-stream`."""
+    media_type = "text/event-stream"
+    format = "sse"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return sse_event("error", data).encode(self.charset)
+
+
+def stream_answer(question: Question, language: str = "en", conversation_mode: bool = False):
+    """
+    Генератор SSE-событий для текстового/кодового вопроса:
+    question → token* → done (или error).
+    Answer сохраняется, когда поток закончился (или клиент отключился).
+    """
+    yield sse_event("question", {"id": question.id, "model": question.model})
+
+    history = conversation.build_history(question, language) if conversation_mode else []
+    if not history and (similar := semantic_cache.find_answer(question, language)):
+        answer = copy_answer(question, similar)
+        yield sse_event("token", {"text": answer.content})
+        yield sse_event("done", _answer_payload(answer))
+        return
+
+    cache_key = completion_cache_key(question.prompt, question.model_type, question.model, language, history)
+    if cached := completion_cache.lookup(cache_key):
+        content, _tokens, used_model, usage = cached
+        yield sse_event("token", {"text": content})
+        answer = Answer.objects.create(
+            question=question, content=content, model=used_model, **usage.answer_fields()
+        )
+        conversation.remember_turn(question, answer)
+        yield sse_event("done", _answer_payload(answer))
+        return
+
+    system_prompt, temperature = provider_params(question.model_type, language)
+    messages = [{"content": system_prompt}, *history, {"content": question.prompt}]  # для оценки токенов
+    parts: list[str] = []
+    used_model = question.model
+    usage_reports: list[Usage] = []  # заполнит stream_openrouter после [DONE]
+    answer = None
+    interrupted = False
+    try:
+        try:
+            for delta in stream_openrouter(
+                prompt=question.prompt,
+                model_id=question.model,
+                system_prompt=system_prompt,
+                temperature=temperature,
+                history=history,
+                on_usage=usage_reports.append,
+            ):
+                parts.append(delta)
+                yield sse_event("token", {"text": delta})
+        except Exception as e:
+            print(f"[stream] ошибка потока: {e}")
+            if parts:
+                interrupted = True
+                yield sse_event("error", {"error": "stream interrupted"})
+            else:
+                # до первого токена — обычный запрос с fallback-логикой
+                content, _tokens, used_model, fallback_usage = query_provider(
+                    prompt=question.prompt,
+                    model_type=question.model_type,
+                    model_id=question.model,
+                    language=language,
+                    history=history,
+                )
+                parts = [content]
+                usage_reports.append(fallback_usage)
+                if used_model is None:  # ни одна модель не ответила — квоту возвращаем
+                    quota.refund(question.user, question.model_type)
+                yield sse_event("token", {"text": content})
+
+        content = "".join(parts)
+        final_usage = usage_reports[-1] if usage_reports else estimate_usage(
+            messages, content, finish_reason="interrupted" if interrupted else ""
+        )
+        answer = _save_answer(question, content, used_model, final_usage)
+        if not interrupted:  # обрывки не кэшируем
+            if not history:
+                semantic_cache.remember(answer, language)
+            completion_cache.store(cache_key, content, answer.tokens_used, used_model, final_usage)
+            conversation.remember_turn(question, answer)
+        yield sse_event("done", _answer_payload(answer))
+    finally:
+        # клиент отключился посреди потока — сохраняем то, что успели получить
+        if answer is None and parts:
+            content = "".join(parts)
+            _save_answer(question, content, used_model, estimate_usage(messages, content, finish_reason="disconnected"))
+
+
+def _save_answer(question: Question, content: str, used_model: str, usage: Usage) -> Answer:
+    return Answer.objects.create(
+        question=question,
+        content=content,
+        model=used_model,
+        **usage.answer_fields(),
+    )
+
+
+def _answer_payload(answer: Answer) -> dict:
+    return {
+        "id": answer.id,
+        "question": answer.question_id,
+        "content": answer.content,
+        "model": answer.model,
+        "tokens_used": answer.tokens_used,
+        "prompt_tokens": answer.prompt_tokens,
+        "completion_tokens": answer.completion_tokens,
+        "latency_ms": answer.latency_ms,
+        "finish_reason": answer.finish_reason,
+        "created_at": answer.created_at,
+    }
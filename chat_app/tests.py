@@ -1,3 +1,1020 @@
-from django.test import TestCase
+# ai-chat-django/chat_app/tests.py
+import io
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
-# Create your tests here.
+import pytest
+from django.contrib.auth import get_user_model
+from django.core.cache import cache, caches
+from rest_framework.test import APIClient
+
+from chat_app.models import Answer, Category, Question
+from chat_app.model_providers.openrouter import client as or_client
+
+User = get_user_model()
+
+
+@pytest.fixture(autouse=True)
+def _clear_cache():
+    for c in caches.all():
+        c.clear()
+    yield
+    for c in caches.all():
+        c.clear()
+
+
+@pytest.fixture
+def user():
+    return User.objects.create_user(email="u@test.io", password="x")
+
+
+@pytest.fixture
+def api(user):
+    client = APIClient()
+    client.force_authenticate(user)
+    return client
+
+
+@pytest.fixture
+def category(user):
+    return Category.objects.create(name="Тест", owner=user)
+
+
+def _parse_sse(body: str) -> list[tuple[str, dict]]:
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+class _KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive по умолчанию
+
+    def do_GET(self):
+        body = b'{"data": []}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _KeepAliveHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+# Пул соединений OpenRouter
+
+def test_session_reuses_keep_alive_connection(stub_server, monkeypatch):
+    monkeypatch.setattr(or_client, "_session", None)
+    for _ in range(3):
+        assert or_client.get(f"{stub_server}/models").status_code == 200
+
+    stats = or_client.pool_stats()
+    assert stats["misses"] == 1  # одно рукопожатие
+    assert stats["hits"] == 2    # остальные — по открытому соединению
+
+
+def test_session_is_recreated_after_fork(monkeypatch):
+    first = or_client.get_session()
+    monkeypatch.setattr(or_client, "_session_pid", -1)  # имитируем дочерний процесс
+    assert or_client.get_session() is not first
+
+
+# Потоковый ответ (SSE)
+
+@pytest.mark.django_db
+def test_stream_relays_tokens_and_persists_answer(api, category, monkeypatch):
+    monkeypatch.setattr(
+        "chat_app.streaming.stream_openrouter",
+        lambda **kw: iter(["При", "вет", "!"]),
+    )
+    resp = api.post(
+        f"/api/chat/categories/{category.id}/questions/stream/",
+        data={
+            "prompt": "привет",
+            "model": "mock/model",
+            "model_type": "text",
+            "category_id": str(category.id),
+            "language": "ru",
+        },
+        format="json",
+        HTTP_ACCEPT="text/event-stream",
+    )
+    assert resp.status_code == 200
+    assert resp["Content-Type"].startswith("text/event-stream")
+
+    events = _parse_sse(b"".join(resp.streaming_content).decode())
+    assert [e for e, _ in events] == ["question", "token", "token", "token", "done"]
+    assert events[-1][1]["content"] == "Привет!"
+
+    answer = Answer.objects.get(question__category=category)
+    assert answer.content == "Привет!"
+    assert answer.model == "mock/model"
+
+
+
+@pytest.mark.django_db
+def test_compare_streams_answers_as_they_complete_and_stores_each(api, user, category, monkeypatch):
+    import time
+    from auth_app import quota
+    from chat_app.model_providers.openrouter.query import Completion
+    from chat_app.tokens import Usage
+
+    monkeypatch.setattr(
+        "chat_app.compare.get_top_models",
+        lambda: {"text_models": [{"brand": b, "model_id": f"{b}/m"} for b in ("slow", "fast", "down")]},
+    )
+    delays = {"slow/m": 0.4, "fast/m": 0.05, "down/m": 0.1}
+
+    def _fake_complete(headers, payload):
+        time.sleep(delays[payload["model"]])
+        if payload["model"] == "down/m":
+            raise ConnectionError("upstream down")
+        return Completion(f"ответ {payload['model']}", payload["model"], Usage(prompt_tokens=3, completion_tokens=2))
+
+    monkeypatch.setattr("chat_app.compare.complete_once", _fake_complete)
+    monkeypatch.setattr(quota, "QUOTA_ENABLED", True)
+    url = f"/api/chat/categories/{category.id}/questions/compare/"
+    body = {"prompt": "сравни", "category_id": str(category.id), "language": "ru"}
+
+    started = time.monotonic()
+    resp = api.post(url, body, format="json", HTTP_ACCEPT="text/event-stream")
+    events = _parse_sse(b"".join(resp.streaming_content).decode())
+    elapsed = time.monotonic() - started
+
+    assert [e for e, _ in events] == ["question", "answer", "model_error", "answer", "done"]
+    assert [d.get("requested_model") or d.get("model") for _, d in events[1:4]] == ["fast/m", "down/m", "slow/m"]
+    assert events[-1][1]["failed"] == ["down/m"]
+    assert elapsed < sum(delays.values())  # параллельно: max, а не сумма
+
+    question = Question.objects.get(category=category)
+    assert sorted(question.answers.values_list("model", flat=True)) == ["fast/m", "slow/m"]
+    assert {a.tokens_used for a in question.answers.all()} == {5}
+
+    bad = api.post(url, {**body, "models": ["fast/m", "unknown/m"]}, format="json")
+    assert bad.status_code == 400
+
+    # сравнение — одна единица квоты; у бесплатного тарифа (реальные лимиты) она одна на окно
+    assert quota.usage(user)["text"] == 1
+    assert api.post(url, body, format="json").status_code == 429
+
+@pytest.mark.django_db
+def test_stream_falls_back_to_blocking_query_before_first_token(api, category, monkeypatch):
+    def _broken_stream(**kw):
+        raise ConnectionError("upstream down")
+        yield  # pragma: no cover
+
+    monkeypatch.setattr("chat_app.streaming.stream_openrouter", _broken_stream)
+    monkeypatch.setattr(
+        "chat_app.utils.query_openrouter",
+        lambda **kw: ("полный ответ", "fallback/model"),
+    )
+    resp = api.post(
+        f"/api/chat/categories/{category.id}/questions/stream/",
+        data={
+            "prompt": "вопрос",
+            "model": "mock/model",
+            "model_type": "code",
+            "category_id": str(category.id),
+            "language": "ru",
+        },
+        format="json",
+    )
+    events = _parse_sse(b"".join(resp.streaming_content).decode())
+    assert events[-1][0] == "done"
+    assert events[-1][1]["model"] == "fallback/model"
+    assert Question.objects.get().answers.get().content == "полный ответ"
+
+
+# Async (ASGI) вьюхи
+
+@pytest.mark.django_db
+def test_async_create_question_matches_sync_contract(client, user, category, monkeypatch):
+    from rest_framework_simplejwt.tokens import RefreshToken
+
+    async def _fake_aquery(**kw):
+        return "асинхронный ответ", kw["model_id"]
+
+    monkeypatch.setattr("chat_app.utils.aquery_openrouter", _fake_aquery)
+    token = str(RefreshToken.for_user(user).access_token)
+
+    resp = client.post(
+        f"/api/chat/async/categories/{category.id}/questions/",
+        data=json.dumps({
+            "prompt": "вопрос",
+            "model": "mock/model",
+            "model_type": "text",
+            "category_id": str(category.id),
+            "language": "ru",
+        }),
+        content_type="application/json",
+        HTTP_AUTHORIZATION=f"Bearer {token}",
+    )
+    assert resp.status_code == 201
+    data = resp.json()
+    assert data["actual_model"] == "mock/model"
+    assert data["answers"][0]["content"] == "асинхронный ответ"
+
+    user.refresh_from_db()
+    assert user.quantity == 1
+
+
+@pytest.mark.django_db
+def test_async_view_requires_token(client, category):
+    resp = client.post(
+        f"/api/chat/async/categories/{category.id}/questions/",
+        data="{}",
+        content_type="application/json",
+    )
+    assert resp.status_code == 401
+
+
+# Каталог моделей (stale-while-revalidate)
+
+FAKE_MODELS = [
+    {"id": "alpha/one:free", "pricing": {"prompt": "0", "completion": "0", "request": "0"}},
+    {"id": "beta/two:free", "pricing": {"prompt": "0", "completion": "0", "request": "0"}},
+    {"id": "gamma/paid", "pricing": {"prompt": "0.001", "completion": "0", "request": "0"}},
+]
+
+
+def test_catalog_is_fetched_once_and_served_from_cache(monkeypatch):
+    from chat_app.model_providers.openrouter import catalog
+    from chat_app.model_providers.openrouter.selector import get_top_models
+
+    calls = {"n": 0}
+
+    def _fetch():
+        calls["n"] += 1
+        return FAKE_MODELS
+
+    monkeypatch.setattr(catalog, "fetch_models", _fetch)
+    first = get_top_models()
+    second = get_top_models()
+
+    assert calls["n"] == 1
+    assert first == second
+    ids = [m["model_id"] for group in first.values() for m in group]
+    assert "gamma/paid" not in ids
+
+
+def test_stale_catalog_is_served_while_refreshing_in_background(monkeypatch):
+    from chat_app.model_providers.openrouter import catalog
+
+    cache.set(catalog.CATALOG_CACHE_KEY, {"models": [{"id": "old/model"}], "fetched_at": 0})
+    scheduled = []
+    monkeypatch.setattr(catalog, "schedule_refresh", lambda: scheduled.append(True))
+    monkeypatch.setattr(catalog, "fetch_models", lambda: pytest.fail("no blocking fetch"))
+
+    assert catalog.get_free_models() == [{"id": "old/model"}]
+    assert scheduled == [True]
+
+
+def test_catalog_failure_on_cold_cache_returns_empty(monkeypatch):
+    from chat_app.model_providers.openrouter import catalog
+
+    def _down():
+        raise ConnectionError("down")
+
+    monkeypatch.setattr(catalog, "fetch_models", _down)
+    assert catalog.get_free_models() == []
+
+
+# Кэш ответов (content-addressed)
+
+def test_completion_key_is_stable_and_covers_all_inputs():
+    from chat_app.completion_cache import completion_key
+
+    base = dict(prompt="p", model_id="m", model_type="text", language="en",
+                system_prompt="s", temperature=0.7)
+    assert completion_key(**base) == completion_key(**base)
+    # фиксированный дайджест — одинаковый в любом воркере и после рестарта
+    assert completion_key(**base).startswith("completion:v1:")
+    assert len(completion_key(**base).rsplit(":", 1)[1]) == 64
+    for field, value in [("temperature", 0.3), ("system_prompt", "x"), ("language", "ru")]:
+        assert completion_key(**{**base, field: value}) != completion_key(**base)
+
+
+def test_query_provider_serves_repeat_from_cache(monkeypatch):
+    from chat_app import completion_cache
+    from chat_app.utils import query_provider
+
+    calls = {"n": 0}
+
+    def _fake(**kw):
+        calls["n"] += 1
+        return "ответ", kw["model_id"]
+
+    monkeypatch.setattr("chat_app.utils.query_openrouter", _fake)
+    assert query_provider("q", "text", "m/1", "ru") == query_provider("q", "text", "m/1", "ru")
+    assert calls["n"] == 1
+    assert completion_cache.stats() == {"hits": 1, "misses": 1, "hit_ratio": 0.5}
+
+
+def test_unavailable_message_is_not_cached(monkeypatch):
+    from chat_app.utils import query_provider
+
+    calls = {"n": 0}
+
+    def _down(**kw):
+        calls["n"] += 1
+        return "OpenRouter is currently unavailable.", None
+
+    monkeypatch.setattr("chat_app.utils.query_openrouter", _down)
+    query_provider("q", "text", "m/1")
+    query_provider("q", "text", "m/1")
+    assert calls["n"] == 2
+
+
+# Семантический кэш
+
+def test_normalize_and_simhash_ignore_case_punctuation_and_spaces():
+    from chat_app.semantic_cache import normalize_prompt, similarity, simhash
+
+    a = normalize_prompt("Как написать   сортировку пузырьком на Python?")
+    b = normalize_prompt("как написать сортировку пузырьком на python")
+    assert a == b
+    far = normalize_prompt("Рецепт борща со свёклой и фасолью")
+    assert similarity(simhash(a), simhash(far)) < 0.9
+
+
+@pytest.mark.django_db
+def test_near_duplicate_question_reuses_stored_answer(user, category, monkeypatch):
+    from chat_app import semantic_cache
+    from chat_app.utils import answer_question
+
+    monkeypatch.setattr(semantic_cache, "SEMANTIC_CACHE_ENABLED", True)
+    monkeypatch.setattr(semantic_cache, "SEMANTIC_CACHE_THRESHOLD", 0.9)
+    monkeypatch.setattr(semantic_cache, "_index", semantic_cache.SemanticIndex(100))
+    monkeypatch.setattr(semantic_cache, "_warmed", True)
+
+    calls = {"n": 0}
+
+    def _fake(**kw):
+        calls["n"] += 1
+        return "ответ модели", kw["model_id"]
+
+    monkeypatch.setattr("chat_app.utils.query_openrouter", _fake)
+
+    def ask(prompt, language="ru", owner=user, where=category):
+        q = Question.objects.create(
+            category=where, user=owner, prompt=prompt, model="m/1", model_type="text", language=language
+        )
+        return answer_question(q, language)
+
+    first = ask("Как отсортировать список словарей по ключу в Python?")
+    second = ask("как отсортировать список словарей по ключу в python")
+    other = ask("Объясни разницу между TCP и UDP простыми словами")
+
+    assert calls["n"] == 2  # второй вопрос обслужен из кэша
+    assert second.content == first.content
+    assert other.content == "ответ модели"
+    assert semantic_cache.stats()["hits"] == 1
+
+    # тот же вопрос, но ответ нужен на другом языке или другому пользователю — к модели
+    ask("Как отсортировать список словарей по ключу в Python?", language="en")
+    stranger = User.objects.create_user(email="stranger@test.io", password="x", username="stranger")
+    ask(
+        "как отсортировать список словарей по ключу в python",  # не точный повтор — мимо кэша completion
+        owner=stranger, where=Category.objects.create(name="чужая", owner=stranger),
+    )
+    assert calls["n"] == 4
+
+    # после рестарта индекс прогревается из БД с теми же границами
+    monkeypatch.setattr(semantic_cache, "_index", semantic_cache.SemanticIndex(100))
+    monkeypatch.setattr(semantic_cache, "_warmed", False)
+    assert ask("Как отсортировать список словарей по ключу в Python").content == "ответ модели"
+    assert calls["n"] == 4
+    assert semantic_cache.stats()["hits"] == 2
+
+
+# Очередь генерации
+
+@pytest.mark.django_db
+def test_queued_question_returns_202_and_worker_fills_answer(api, category, monkeypatch):
+    from django.core.management import call_command
+
+    monkeypatch.setattr("chat_app.utils.query_openrouter", lambda **kw: ("из воркера", kw["model_id"]))
+    resp = api.post(
+        f"/api/chat/categories/{category.id}/questions/?queue=1",
+        data={
+            "prompt": "долгий вопрос",
+            "model": "slow/model",
+            "model_type": "text",
+            "category_id": str(category.id),
+            "language": "ru",
+        },
+        format="json",
+    )
+    assert resp.status_code == 202
+    job_id = resp.json()["job_id"]
+    assert api.get(f"/api/chat/jobs/{job_id}/").json()["status"] == "queued"
+    assert not Answer.objects.exists()
+
+    call_command("run_generation_worker", "--once", stdout=io.StringIO())
+
+    status = api.get(f"/api/chat/jobs/{job_id}/").json()
+    assert status["status"] == "done"
+    assert status["answer"]["content"] == "из воркера"
+
+
+@pytest.mark.django_db
+def test_failed_job_is_retried_with_backoff_then_marked_failed(user, category, monkeypatch):
+    from chat_app import jobs
+    from chat_app.models import GenerationJob
+
+    def _boom(*a, **kw):
+        raise RuntimeError("provider exploded")
+
+    monkeypatch.setattr(jobs, "answer_question", _boom)
+    question = Question.objects.create(category=category, user=user, prompt="q", model="m", model_type="text")
+    job = jobs.enqueue(question)
+
+    for attempt in range(1, jobs.JOB_MAX_ATTEMPTS + 1):
+        GenerationJob.objects.filter(pk=job.pk).update(run_after=job.created_at)  # пропускаем паузу
+        claimed = jobs.claim_next("test-worker")
+        assert claimed.attempts == attempt
+        jobs.run_job(claimed)
+
+    job.refresh_from_db()
+    assert job.status == GenerationJob.FAILED
+    assert "provider exploded" in job.error
+    assert jobs.claim_next("test-worker") is None
+
+
+@pytest.mark.django_db
+def test_unavailable_text_answer_is_retried_not_stored(user, category, monkeypatch):
+    from chat_app import jobs
+    from chat_app.models import GenerationJob
+    from chat_app.tokens import Usage
+
+    monkeypatch.setattr("chat_app.utils.query_provider", lambda **kw: ("Модель недоступна", 0, None, Usage()))
+    question = Question.objects.create(category=category, user=user, prompt="q", model="m", model_type="text")
+    jobs.enqueue(question)
+
+    job = jobs.run_job(jobs.claim_next("w"))
+    assert job.status == GenerationJob.QUEUED and job.attempts == 1
+    assert "no model available" in job.error
+    assert not question.answers.exists()
+
+
+@pytest.mark.django_db
+def test_stale_jobs_count_as_attempts_and_fail_after_max(user, category):
+    from chat_app import jobs
+    from chat_app.models import GenerationJob
+    from datetime import timedelta
+    from django.utils import timezone
+
+    question = Question.objects.create(category=category, user=user, prompt="q", model="m", model_type="text")
+    job = jobs.enqueue(question)
+    long_ago = timezone.now() - timedelta(seconds=jobs.JOB_STALE_SEC + 1)
+
+    # воркер каждый раз умирает посреди задачи
+    for attempt in range(1, jobs.JOB_MAX_ATTEMPTS + 1):
+        GenerationJob.objects.filter(pk=job.pk).update(run_after=job.created_at)
+        assert jobs.claim_next("dead-worker").attempts == attempt
+        GenerationJob.objects.filter(pk=job.pk).update(locked_at=long_ago)
+        assert jobs.requeue_stale() == 1
+
+    job.refresh_from_db()
+    assert job.status == GenerationJob.FAILED
+    assert "dead-worker" in job.error
+    assert jobs.claim_next("w") is None
+
+
+def test_completion_survives_pickle_round_trip():
+    import pickle
+    from chat_app.model_providers.openrouter.query import Completion
+    from chat_app.tokens import Usage
+
+    completion = Completion("ответ", "m/1", Usage(prompt_tokens=3, completion_tokens=2, latency_ms=40))
+    restored = pickle.loads(pickle.dumps(completion))
+    assert restored == ("ответ", "m/1")
+    assert (restored.content, restored.model) == ("ответ", "m/1")
+    assert restored.usage == completion.usage
+    assert pickle.loads(pickle.dumps(Completion("нет модели", None))).usage == Usage()
+
+
+# Hedged-запросы
+
+def test_hedge_slow_primary_loses_to_fast_fallback():
+    import time
+    from chat_app.model_providers.openrouter.hedge import hedged_call
+
+    def _call(model):
+        if model == "slow":
+            time.sleep(1.0)
+        return f"ответ {model}"
+
+    started = time.monotonic()
+    result, model = hedged_call(["slow", "fast"], _call, delay=0.05)
+    assert (result, model) == ("ответ fast", "fast")
+    assert time.monotonic() - started < 0.5
+
+
+def test_hedge_error_launches_next_model_immediately_and_skips_invalid():
+    import time
+    from chat_app.model_providers.openrouter.hedge import AllModelsFailed, hedged_call
+
+    def _call(model):
+        if model == "broken":
+            raise ConnectionError("503")
+        return "" if model == "empty" else "ok"
+
+    started = time.monotonic()
+    # задержка большая — третья модель стартует только благодаря ошибкам первых двух
+    assert hedged_call(["broken", "empty", "good"], _call, validate=bool, delay=5) == ("ok", "good")
+    assert time.monotonic() - started < 1
+
+    with pytest.raises(AllModelsFailed) as exc:
+        hedged_call(["broken"], _call, delay=5)
+    assert "broken" in exc.value.errors
+
+
+def test_query_openrouter_hedged_returns_unavailable_when_all_fail(monkeypatch):
+    from chat_app.model_providers.openrouter import query
+
+    monkeypatch.setattr(query, "HEDGE_ENABLED", True)
+    monkeypatch.setattr(query, "_fallback_models", lambda exclude=None: ["b/free"])
+
+    def _complete(headers, payload):
+        if payload["model"] == "b/free":
+            return query.Completion("from fallback", "b/free")
+        raise ConnectionError("down")
+
+    monkeypatch.setattr(query, "complete_once", _complete)
+    assert query.query_openrouter("q", "a/free") == ("from fallback", "b/free")
+
+    monkeypatch.setattr(query, "complete_once", lambda h, p: (_ for _ in ()).throw(ConnectionError("down")))
+    assert query.query_openrouter("q", "a/free", language="ru") == (query._unavailable_message("ru"), None)
+
+
+# Здоровье моделей и circuit breaker
+
+def test_circuit_opens_after_consecutive_failures_and_probes_after_cooldown(monkeypatch):
+    from chat_app.model_providers.openrouter import health
+
+    for _ in range(health.BREAKER_FAILURES):
+        health.record("dead/free", False, 30000)
+    assert health.is_open("dead/free") and not health.allow("dead/free")
+
+    # пауза прошла: ровно один пробный запрос на все воркеры
+    entry = cache.get(health._key("dead/free"))
+    entry["opened_at"] -= health.BREAKER_COOLDOWN + 1
+    cache.set(health._key("dead/free"), entry)
+    assert health.allow("dead/free") is True
+    assert health.allow("dead/free") is False
+
+    health.record("dead/free", True, 800)
+    summary = health.report(["dead/free"])["dead/free"]
+    assert summary["state"] == health.CLOSED and summary["consecutive_failures"] == 0
+    assert summary["p50_ms"] == 800
+
+
+def test_ranking_and_fallback_skip_open_circuit_models(monkeypatch):
+    from chat_app.model_providers.openrouter import catalog, health, query
+
+    monkeypatch.setattr(catalog, "get_free_models", lambda: [
+        {"id": f"{brand}/m-{i}:free"} for i, brand in enumerate(["a", "a", "b", "b", "c", "d"])
+    ])
+    monkeypatch.setattr("chat_app.model_providers.openrouter.selector.get_free_models", catalog.get_free_models)
+    for _ in range(health.BREAKER_FAILURES):
+        health.record("a/m-1:free", False, 30000)
+    health.record("b/m-3:free", True, 500)
+
+    pool = query._fallback_models(n=10)
+    assert "a/m-1:free" not in pool
+    assert health.rank(["a/m-1:free", "c/m-4:free"]) == ["c/m-4:free", "a/m-1:free"]
+
+    calls = []
+
+    def _post(url, json=None, **kw):
+        calls.append(json["model"])
+        raise ConnectionError("down")
+
+    monkeypatch.setattr(query.client, "post", _post)
+    query.query_openrouter("q", "a/m-1:free")
+    assert "a/m-1:free" not in calls  # разомкнутую основную модель даже не пробуем
+
+
+# Картинки: общий лимит и очередь
+
+def test_token_bucket_is_shared_and_429_penalizes_everyone():
+    from chat_app import rate_limit
+
+    assert rate_limit.acquire("t", rate_per_min=6) == 0.0
+    wait = rate_limit.acquire("t", rate_per_min=6)  # второй воркер в том же окне
+    assert 0 < wait <= 10
+
+    rate_limit.penalize("u", rate_per_min=6, seconds=25)
+    assert rate_limit.acquire("u", rate_per_min=6) > 0
+
+
+def test_retry_after_accepts_seconds_and_http_date():
+    from datetime import datetime, timedelta, timezone
+    from email.utils import format_datetime
+    from chat_app import rate_limit
+
+    assert rate_limit.parse_retry_after("12") == 12.0
+    in_a_minute = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=60), usegmt=True)
+    assert 55 <= rate_limit.parse_retry_after(in_a_minute) <= 60
+    assert rate_limit.parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0  # уже прошло
+    assert rate_limit.parse_retry_after(None) == 10.0
+    assert rate_limit.parse_retry_after("soon") == 10.0
+    assert rate_limit.parse_retry_after("inf") == 10.0
+
+
+@pytest.mark.django_db
+def test_image_question_is_queued_and_rate_limit_defers_without_spending_attempts(api, category, monkeypatch):
+    from chat_app import jobs
+    from chat_app.model_providers import image_models
+    from chat_app.models import GenerationJob
+
+    monkeypatch.setattr("chat_app.views.IMAGE_QUEUE", True)
+    resp = api.post(
+        f"/api/chat/categories/{category.id}/questions/",
+        {"prompt": "кот", "model": "flux", "model_type": "image", "category_id": str(category.id), "language": "ru"},
+        format="json",
+    )
+    assert resp.status_code == 202
+
+    monkeypatch.setattr(image_models.rate_limit, "acquire", lambda *a, **kw: 7.5)
+    job = jobs.run_job(jobs.claim_next("w"))
+    job.refresh_from_db()
+    assert job.status == GenerationJob.QUEUED and job.attempts == 0
+    assert job.run_after > job.updated_at  # отложена, а не крутится в цикле
+
+    class _Resp:
+        status_code = 200
+        text = ""
+        headers = {}
+
+        def raise_for_status(self):
+            pass
+
+        def json(self):
+            return {"data": [{"url": "https://together/img.png"}]}
+
+    uploaded = {}
+    monkeypatch.setattr(image_models.rate_limit, "acquire", lambda *a, **kw: 0.0)
+    monkeypatch.setattr(image_models.requests, "post", lambda *a, **kw: _Resp())
+    monkeypatch.setattr(image_models.requests, "get", lambda *a, **kw: pytest.fail("картинку качает Cloudinary"))
+    monkeypatch.setattr(
+        image_models.cloudinary.uploader, "upload",
+        lambda source, **kw: uploaded.update(source=source) or {"secure_url": "https://cdn/img.png"},
+    )
+    GenerationJob.objects.filter(pk=job.pk).update(run_after=job.created_at)
+    job = jobs.run_job(jobs.claim_next("w"))
+    assert job.status == GenerationJob.DONE
+    assert uploaded["source"] == "https://together/img.png"  # Cloudinary забирает по URL сам
+    assert Answer.objects.get(question_id=job.question_id).content == "https://cdn/img.png"
+
+
+@pytest.mark.django_db
+def test_inline_image_rate_limit_returns_429_without_sleeping(api, category, monkeypatch):
+    from chat_app.model_providers import image_models
+
+    monkeypatch.setattr(image_models.rate_limit, "acquire", lambda *a, **kw: 42.5)
+    monkeypatch.setattr(image_models.time, "sleep", lambda s: pytest.fail("в запросе не спим"))
+    resp = api.post(
+        f"/api/chat/categories/{category.id}/questions/",
+        {"prompt": "кот", "model": "flux", "model_type": "image", "category_id": str(category.id), "language": "ru"},
+        format="json",
+    )
+    assert resp.status_code == 429
+    assert resp["Retry-After"] == "43"
+    assert resp.json()["retry_after"] == 43
+
+
+# Количество SQL-запросов (регрессия N+1)
+
+@pytest.fixture
+def chat_history(user):
+    """3 категории × 4 вопроса × 2 ответа; последний ответ — от другой модели."""
+    for c in range(3):
+        category = Category.objects.create(name=f"c{c}", owner=user)
+        for q in range(4):
+            question = Question.objects.create(
+                category=category, user=user, prompt=f"q{q}", model="asked/model", model_type="text"
+            )
+            Answer.objects.create(question=question, content="a1", model="first/model")
+            Answer.objects.create(question=question, content="a2", model="latest/model")
+    return user
+
+
+@pytest.mark.django_db
+def test_category_detail_query_count_is_constant(api, chat_history, django_assert_num_queries):
+    category = Category.objects.filter(owner=chat_history).first()
+    # категория + вопросы (с аннотацией) + ответы
+    with django_assert_num_queries(3):
+        resp = api.get(f"/api/chat/categories/{category.id}/")
+    assert resp.status_code == 200
+    questions = resp.data["questions"]
+    assert len(questions) == 4
+    assert {q["actual_model"] for q in questions} == {"latest/model"}
+    assert all(q["answers"][0]["content"] == "a2" for q in questions)
+
+
+@pytest.mark.django_db
+def test_category_list_is_lightweight(api, chat_history, django_assert_num_queries):
+    Category.objects.create(name="empty", owner=chat_history)
+    with django_assert_num_queries(1):
+        resp = api.get("/api/chat/categories/")
+    assert [c["question_count"] for c in resp.data] == [4, 4, 4, 0]
+    assert "questions" not in resp.data[0]
+    assert resp.data[0]["last_activity"] is not None and resp.data[-1]["last_activity"] is None
+
+
+@pytest.mark.django_db
+def test_question_list_query_count_is_constant(api, chat_history, django_assert_num_queries):
+    category = Category.objects.filter(owner=chat_history).first()
+    Question.objects.create(category=category, user=chat_history, prompt="new", model="asked/model", model_type="text")
+    with django_assert_num_queries(2):
+        resp = api.get(f"/api/chat/categories/{category.id}/questions/")
+    results = resp.data["results"]
+    assert len(results) == 5
+    # вопрос без ответов — как и раньше, исходная модель
+    assert results[0]["prompt"] == "new" and results[0]["actual_model"] == "asked/model"
+
+
+@pytest.mark.django_db
+def test_question_history_cursor_walks_every_row_once(api, chat_history, django_assert_num_queries):
+    category = Category.objects.filter(owner=chat_history).first()
+    url, seen = f"/api/chat/categories/{category.id}/questions/?page_size=3", []
+    while url:
+        with django_assert_num_queries(2):  # страница стоит одинаково на любой глубине
+            resp = api.get(url)
+        seen += [q["id"] for q in resp.data["results"]]
+        url = resp.data["next"]
+    expected = Question.objects.filter(category=category).order_by("-created_at", "-id")
+    assert seen == [str(q.id) for q in expected]
+
+    answers = api.get(f"/api/chat/questions/{seen[0]}/answers/?page_size=1").data
+    assert answers["results"][0]["content"] == "a2" and answers["next"]
+
+
+
+@pytest.mark.django_db
+def test_category_export_import_roundtrip_in_batches_without_provider(
+    api, chat_history, monkeypatch, django_assert_max_num_queries
+):
+    from django.core.files.uploadedfile import SimpleUploadedFile
+
+    def _no_provider(**kw):
+        raise AssertionError("импорт не должен обращаться к модели")
+
+    monkeypatch.setattr("chat_app.utils.query_openrouter", _no_provider)
+    monkeypatch.setattr("chat_app.transfer.IMPORT_BATCH", 5)  # вопрос + 2 ответа → пачка из двух вопросов
+    source = Category.objects.filter(owner=chat_history).first()
+
+    resp = api.get(f"/api/chat/categories/{source.id}/export/")
+    assert resp["Content-Type"] == "application/x-ndjson"
+    lines = b"".join(resp.streaming_content).decode().splitlines()
+    assert json.loads(lines[0])["type"] == "category"
+    assert [json.loads(line)["prompt"] for line in lines[1:]] == ["q0", "q1", "q2", "q3"]
+
+    target = Category.objects.create(name="копия", owner=chat_history)
+    body = "\n".join(lines + ["{broken", json.dumps({"type": "question", "prompt": ""})]).encode()
+    # категория + 2 пачки × (savepoint, 2 INSERT, индекс поиска: карта rowid INSERT + SELECT,
+    # FTS INSERT — без DELETE, строки новые, release)
+    with django_assert_max_num_queries(15):
+        resp = api.post(
+            f"/api/chat/categories/{target.id}/import/",
+            {"file": SimpleUploadedFile("c.ndjson", body)},
+            format="multipart",
+        )
+    assert resp.status_code == 201
+    assert resp.data["questions"] == 4 and resp.data["answers"] == 8
+    assert [e["line"] for e in resp.data["errors"]] == [6, 7]
+
+    copied = Question.objects.filter(category=target).order_by("created_at")
+    assert [q.prompt for q in copied] == ["q0", "q1", "q2", "q3"]
+    assert sorted(copied[0].answers.values_list("content", flat=True)) == ["a1", "a2"]
+
+
+@pytest.mark.django_db
+def test_category_import_reports_bad_numeric_fields_and_limits_size(api, category, monkeypatch):
+    from django.core.files.uploadedfile import SimpleUploadedFile
+
+    def _question(prompt, **answer):
+        return json.dumps({"type": "question", "prompt": prompt, "answers": [{"content": "a", **answer}]})
+
+    body = "\n".join([
+        _question("ok", tokens_used="12", latency_ms=300),
+        _question("bad tokens", tokens_used="abc"),
+        _question("bad latency", latency_ms={"ms": 1}),
+        _question("negative", prompt_tokens=-1),
+        _question("bad reason", finish_reason=["stop"]),
+    ]).encode()
+    url = f"/api/chat/categories/{category.id}/import/"
+    resp = api.post(url, {"file": SimpleUploadedFile("c.ndjson", body)}, format="multipart")
+    assert resp.status_code == 201
+    assert resp.data["questions"] == 1 and resp.data["skipped"] == 4
+    assert [e["line"] for e in resp.data["errors"]] == [2, 3, 4, 5]
+    answer = Answer.objects.get(question__category=category)
+    assert (answer.tokens_used, answer.latency_ms) == (12, 300)
+
+    monkeypatch.setattr("chat_app.views.IMPORT_MAX_BYTES", 10)
+    resp = api.post(url, {"file": SimpleUploadedFile("c.ndjson", body)}, format="multipart")
+    assert resp.status_code == 413
+    assert Question.objects.filter(category=category).count() == 1
+
+
+@pytest.mark.django_db
+def test_search_ranks_hits_with_snippets_and_follows_changes(api, user, category):
+    other = User.objects.create_user(email="other@test.io", password="x", username="other")
+    other_category = Category.objects.create(name="чужая", owner=other)
+    Question.objects.create(category=other_category, user=other, prompt="Кэширование в Django", model="m")
+
+    q1 = Question.objects.create(category=category, user=user, prompt="Как настроить кэширование в Django?", model="m")
+    Answer.objects.create(question=q1, content="Используйте CACHES и кэширование шаблонов: кэширование страниц.", model="m")
+    q2 = Question.objects.create(category=category, user=user, prompt="Рецепт борща", model="m")
+    Answer.objects.create(question=q2, content="Свёкла, капуста, кэширование не нужно.", model="m")
+
+    resp = api.get("/api/chat/search/", {"q": "кэширование"})
+    assert resp.status_code == 200
+    hits = resp.data["results"]
+    assert len(hits) == 3  # чужой вопрос не виден
+    assert hits[0]["kind"] == "answer" and hits[0]["question_id"] == str(q1.id)  # три совпадения — выше
+    assert "<mark>кэширование</mark>" in hits[0]["snippet"]
+    assert [h["rank"] for h in hits] == sorted(h["rank"] for h in hits)
+
+    page = api.get("/api/chat/search/", {"q": "кэш", "limit": 2}).data  # префикс
+    assert len(page["results"]) == 2 and page["next"]
+    rest = api.get(page["next"]).data
+    assert len(rest["results"]) == 1 and rest["next"] is None
+
+    q2.prompt = "Рецепт окрошки"
+    q2.save()
+    assert api.get("/api/chat/search/", {"q": "борщ"}).data["results"] == []
+    q1.delete()  # вместе с ответом
+    assert [h["question_id"] for h in api.get("/api/chat/search/", {"q": "кэширование"}).data["results"]] == [
+        str(q2.id)
+    ]
+    assert api.get("/api/chat/search/", {"q": "окрошки", "category": "nope"}).status_code == 400
+
+
+@pytest.mark.django_db
+def test_search_reindex_replaces_row_and_finds_it_by_index(user, category):
+    from django.db import connection
+    from chat_app.search import get_backend
+
+    question = Question.objects.create(category=category, user=user, prompt="Первый вариант", model="m")
+    Answer.objects.create(question=question, content="ответ", model="m")
+    get_backend().index_question(question)  # повторная индексация без изменений
+    question.prompt = "Второй вариант"
+    question.save()
+
+    def count(table, column, value):
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT COUNT(*) FROM {table} WHERE {column} = %s", [value])
+            return cursor.fetchone()[0]
+
+    assert count("chat_search", "doc_id", str(question.pk)) == 1
+    assert count("chat_search_doc", "doc_id", str(question.pk)) == 1
+    assert get_backend().search(user.id, "второй")[0]["id"] == str(question.pk)
+    assert get_backend().search(user.id, "первый") == []
+
+    # удаление ищет rowid по индексу, а не проходом по FTS-таблице
+    with connection.cursor() as cursor:
+        for column in ("doc_id", "question_id"):
+            cursor.execute(f"EXPLAIN QUERY PLAN SELECT doc_id, id FROM chat_search_doc WHERE {column} IN (%s)", ["x"])
+            assert not any("SCAN" in str(row[-1]) for row in cursor.fetchall())
+
+    question.delete()
+    assert count("chat_search", "question_id", str(question.pk)) == 0
+    assert count("chat_search_doc", "question_id", str(question.pk)) == 0
+
+@pytest.mark.django_db
+def test_hot_query_plans_use_indexes():
+    from django.core.management import call_command
+    from chat_app.query_plans import plan_problems
+
+    out = io.StringIO()
+    call_command("check_query_plans", stdout=out)
+    assert "FAIL" not in out.getvalue()
+    # детектор действительно ловит полный проход и сортировку
+    assert plan_problems("SCAN chat_app_answer\nUSE TEMP B-TREE FOR ORDER BY", "sqlite") == [
+        "SCAN chat_app_answer", "USE TEMP B-TREE FOR ORDER BY",
+    ]
+    assert plan_problems("Index Scan using chat_a_question_created", "postgresql") == []
+
+
+# Режим диалога: история категории в промпте
+
+def _turn(category, user, prompt, answer):
+    question = Question.objects.create(category=category, user=user, prompt=prompt, model="m/1", model_type="text")
+    Answer.objects.create(question=question, content=answer, model="m/1")
+    return question
+
+
+@pytest.mark.django_db
+def test_history_fits_budget_and_folds_older_turns_into_summary(user, category, monkeypatch, django_assert_max_num_queries):
+    from chat_app import conversation
+
+    monkeypatch.setattr(conversation, "RECENT_TURNS", 2)
+    for i in range(5):
+        _turn(category, user, f"вопрос {i}", f"ответ {i} " + "слово " * 20)
+    current = Question.objects.create(category=category, user=user, prompt="и что дальше?", model="m/1", model_type="text")
+
+    history = conversation.build_history(current, "ru", budget=400)
+    # два последних хода целиком, три старых — строками свёртки
+    assert [m["role"] for m in history] == ["system", "user", "assistant", "user", "assistant"]
+    assert history[1]["content"] == "вопрос 3" and history[3]["content"] == "вопрос 4"
+    assert "вопрос 2" in history[0]["content"] and "вопрос 3" not in history[0]["content"]
+
+    from chat_app.tokens import message_tokens
+    assert message_tokens(history) <= 400
+
+    # свёртка уже в кэше: сборка промпта — один запрос к БД
+    with django_assert_max_num_queries(1):
+        conversation.build_history(current, "ru", budget=400)
+
+
+@pytest.mark.django_db
+def test_conversation_mode_sends_history_and_keys_cache_on_it(user, category, monkeypatch):
+    from chat_app.utils import answer_question
+
+    sent = []
+
+    def _fake(**kw):
+        sent.append(kw.get("history"))
+        return "ответ", kw["model_id"]
+
+    monkeypatch.setattr("chat_app.utils.query_openrouter", _fake)
+    _turn(category, user, "как зовут кота?", "Барсик")
+    same_prompt = [
+        Question.objects.create(category=category, user=user, prompt="а сколько ему лет?", model="m/1", model_type="text")
+        for _ in range(2)
+    ]
+    answer_question(same_prompt[0], "ru", conversation_mode=True)
+    answer_question(same_prompt[1], "ru", conversation_mode=False)
+
+    assert sent[0][-2:] == [{"role": "user", "content": "как зовут кота?"}, {"role": "assistant", "content": "Барсик"}]
+    assert sent[1] == []  # без истории — другой ключ кэша, поэтому новый запрос
+
+
+# Учёт токенов из usage провайдера
+
+class _JsonResponse:
+    status_code = 200
+    text = ""
+
+    def __init__(self, data):
+        self._data = data
+
+    def json(self):
+        return self._data
+
+    def raise_for_status(self):
+        pass
+
+
+@pytest.mark.django_db
+def test_provider_usage_is_persisted_on_answer(user, category, monkeypatch):
+    from chat_app.model_providers.openrouter import query
+    from chat_app.utils import answer_question
+
+    body = {
+        "choices": [{"message": {"content": "ответ"}, "finish_reason": "length"}],
+        "usage": {"prompt_tokens": 120, "completion_tokens": 30, "total_tokens": 150},
+    }
+    monkeypatch.setattr(query.client, "post", lambda *a, **kw: _JsonResponse(body))
+
+    result = query.query_openrouter("q", "m/1")
+    content, model = result  # старый контракт распаковки сохранён
+    assert (content, model) == ("ответ", "m/1") and result.usage.completion_tokens == 30
+
+    question = Question.objects.create(category=category, user=user, prompt="q", model="m/1", model_type="text")
+    answer = answer_question(question, "en")
+    assert (answer.prompt_tokens, answer.completion_tokens, answer.tokens_used) == (120, 30, 150)
+    assert answer.finish_reason == "length" and answer.latency_ms is not None
+
+    # повтор из кэша ответов: те же токены, но без задержки провайдера
+    again = answer_question(
+        Question.objects.create(category=category, user=user, prompt="q", model="m/1", model_type="text"), "en"
+    )
+    assert again.tokens_used == 150 and again.latency_ms is None
+
+
+def test_usage_falls_back_to_local_estimate_when_provider_omits_it(monkeypatch):
+    from chat_app.model_providers.openrouter import query
+
+    body = {"choices": [{"message": {"content": "hello world, " * 10}, "finish_reason": "stop"}]}
+    monkeypatch.setattr(query.client, "post", lambda *a, **kw: _JsonResponse(body))
+
+    usage = query.query_openrouter("q", "m/1", system_prompt="sys").usage
+    assert usage.estimated and usage.finish_reason == "stop"
+    assert usage.completion_tokens == 32 and usage.prompt_tokens > 0
@@ -0,0 +1,72 @@
+# chat_app/tokens.py
+from dataclasses import asdict, dataclass
+
+# Оценка токенов без токенизатора (когда провайдер не вернул usage):
+# латиница/цифры — ~4 символа на токен, кириллица и прочее — ~2.
+ASCII_CHARS_PER_TOKEN = 4
+OTHER_CHARS_PER_TOKEN = 2
+MESSAGE_OVERHEAD = 4  # роль и разделители сообщения в chat-формате
+
+
+@dataclass(frozen=True)
+class Usage:
+    """Учёт одного ответа модели: токены, задержка, причина остановки."""
+
+    prompt_tokens: int | None = None
+    completion_tokens: int | None = None
+    latency_ms: int | None = None
+    finish_reason: str = ""
+    estimated: bool = False  # True — посчитано локально, провайдер usage не прислал
+
+    @property
+    def total_tokens(self) -> int:
+        return (self.prompt_tokens or 0) + (self.completion_tokens or 0)
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: dict | None) -> "Usage":
+        return cls(**data) if data else cls()
+
+    def answer_fields(self) -> dict:
+        """Поля Answer: tokens_used — то, что считаем и лимитируем (prompt + completion)."""
+        return {
+            "tokens_used": self.total_tokens,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "latency_ms": self.latency_ms,
+            "finish_reason": self.finish_reason,
+        }
+
+
+def estimate_tokens(content: str) -> int:
+    if not content:
+        return 0
+    ascii_chars = sum(1 for ch in content if ch.isascii())
+    other = len(content) - ascii_chars
+    return max(1, round(ascii_chars / ASCII_CHARS_PER_TOKEN + other / OTHER_CHARS_PER_TOKEN))
+
+
+def message_tokens(messages: list[dict]) -> int:
+    return sum(estimate_tokens(m.get("content") or "") + MESSAGE_OVERHEAD for m in messages)
+
+
+def estimate_usage(messages: list[dict], content: str, latency_ms: int | None = None, finish_reason: str = "") -> Usage:
+    return Usage(
+        prompt_tokens=message_tokens(messages),
+        completion_tokens=estimate_tokens(content),
+        latency_ms=latency_ms,
+        finish_reason=finish_reason,
+        estimated=True,
+    )
+
+
+def truncate_to_tokens(text: str, budget: int) -> str:
+    """Обрезает текст под бюджет (по оценке), добавляя «…»."""
+    text = text or ""
+    tokens = estimate_tokens(text)
+    if tokens <= budget:
+        return text
+    limit = int(len(text) * max(budget, 0) / tokens)  # пропорционально плотности текста
+    return text[: max(limit - 1, 0)].rstrip() + "…"
@@ -0,0 +1,158 @@
+# chat_app/transfer.py
+import json
+from decouple import config
+from django.db import transaction
+from django.db.models import Prefetch
+from .models import Answer, Category, Question
+from .search import get_backend
+
+# Перенос категорий: экспорт в NDJSON (строка = вопрос со своими ответами)
+# и обратный импорт пачками через bulk_create — без обращения к моделям.
+# И там и там память не зависит от размера категории: выгрузка идёт
+# iterator() с чанками, загрузка читает файл построчно и держит одну пачку.
+EXPORT_VERSION = 1
+EXPORT_CHUNK = config("CHAT_EXPORT_CHUNK", default=500, cast=int)
+IMPORT_BATCH = config("CHAT_IMPORT_BATCH", default=1000, cast=int)
+IMPORT_MAX_BYTES = config("CHAT_IMPORT_MAX_BYTES", default=20 * 1024 * 1024, cast=int)
+MAX_REPORTED_ERRORS = 20
+MAX_INT = 2**31 - 1  # IntegerField
+
+QUESTION_FIELDS = ("prompt", "model", "model_type", "language")
+ANSWER_FIELDS = (
+    "content", "model", "tokens_used", "prompt_tokens", "completion_tokens", "latency_ms", "finish_reason",
+)
+
+
+def _line(data: dict) -> str:
+    return json.dumps(data, ensure_ascii=False, default=str) + "\n"
+
+
+def export_category(category: Category):
+    """Генератор NDJSON: заголовок категории, затем вопросы от старых к новым."""
+    yield _line({"type": "category", "version": EXPORT_VERSION, "name": category.name})
+    questions = (
+        Question.objects.filter(category=category)
+        .order_by("created_at", "id")
+        .prefetch_related(Prefetch("answers", queryset=Answer.objects.order_by("created_at", "id")))
+    )
+    for question in questions.iterator(chunk_size=EXPORT_CHUNK):
+        yield _line({
+            "type": "question",
+            **{f: getattr(question, f) for f in QUESTION_FIELDS},
+            "created_at": question.created_at,
+            "answers": [
+                {**{f: getattr(a, f) for f in ANSWER_FIELDS}, "created_at": a.created_at}
+                for a in question.answers.all()
+            ],
+        })
+
+
+def _int_field(data: dict, field: str) -> int | None:
+    value = data.get(field)
+    if value is None:
+        return None
+    # bool — подкласс int, "12" из самописного файла принимаем
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError(f"{field} must be an integer")
+    try:
+        number = int(value)
+    except ValueError:
+        raise ValueError(f"{field} must be an integer") from None
+    if not 0 <= number <= MAX_INT:
+        raise ValueError(f"{field} out of range")
+    return number
+
+
+def _str_field(data: dict, field: str, max_length: int) -> str | None:
+    value = data.get(field)
+    if value is None:
+        return None
+    if not isinstance(value, str) or len(value) > max_length:
+        raise ValueError(f"{field} must be a string up to {max_length} chars")
+    return value
+
+
+def _parse_answer(data: dict, question: Question) -> Answer:
+    return Answer(
+        question=question,
+        content=str(data.get("content") or ""),
+        model=_str_field(data, "model", Answer._meta.get_field("model").max_length),
+        tokens_used=_int_field(data, "tokens_used"),
+        prompt_tokens=_int_field(data, "prompt_tokens"),
+        completion_tokens=_int_field(data, "completion_tokens"),
+        latency_ms=_int_field(data, "latency_ms"),
+        finish_reason=_str_field(data, "finish_reason", Answer._meta.get_field("finish_reason").max_length) or "",
+    )
+
+
+def _parse_question(record: dict, category: Category, user) -> tuple[Question, list[Answer]]:
+    """Вопрос и ответы строки; любое негодное поле — ValueError, строку пропускаем целиком."""
+    prompt = record.get("prompt")
+    if not isinstance(prompt, str) or not prompt.strip():
+        raise ValueError("prompt is required")
+    model_type = record.get("model_type") or Question.TEXT
+    if model_type not in dict(Question.MODEL_TYPES):
+        raise ValueError(f"unknown model_type: {model_type}")
+    answers = record.get("answers") or []
+    if not isinstance(answers, list):
+        raise ValueError("answers must be a list")
+
+    model = _str_field(record, "model", Question._meta.get_field("model").max_length)
+    language = _str_field(record, "language", Question._meta.get_field("language").max_length) or ""
+    question = Question(
+        category=category, user=user, prompt=prompt, model=model, model_type=model_type, language=language
+    )
+    return question, [_parse_answer(a, question) for a in answers if isinstance(a, dict)]
+
+
+def _flush(questions: list[Question], answers: list[Answer]) -> None:
+    # id у Question — uuid4 на клиенте, поэтому ответы ссылаются на вопросы
+    # ещё до вставки и пачка уходит двумя INSERT-ами. bulk_create не шлёт
+    # post_save — индекс поиска обновляем сами, той же пачкой.
+    with transaction.atomic():
+        Question.objects.bulk_create(questions)
+        Answer.objects.bulk_create(answers)
+        get_backend().index_many(questions, answers, new=True)
+
+
+def import_category(category: Category, user, lines) -> dict:
+    """
+    Импорт NDJSON в категорию. lines — любой итератор строк (bytes или str),
+    например загруженный файл. Битые строки пропускаем и сообщаем номера.
+    created_at ставится заново (auto_now_add), порядок вопросов сохраняется.
+    """
+    questions: list[Question] = []
+    answers: list[Answer] = []
+    stats = {"questions": 0, "answers": 0, "skipped": 0, "errors": []}
+
+    for number, raw in enumerate(lines, start=1):
+        if isinstance(raw, bytes):
+            raw = raw.decode("utf-8", errors="replace")
+        if not raw.strip():
+            continue
+        try:
+            record = json.loads(raw)
+            if not isinstance(record, dict):
+                raise ValueError("JSON object expected")
+            if record.get("type") == "category":
+                continue
+            question, question_answers = _parse_question(record, category, user)
+        except ValueError as e:  # JSONDecodeError — тоже ValueError
+            stats["skipped"] += 1
+            if len(stats["errors"]) < MAX_REPORTED_ERRORS:
+                stats["errors"].append({"line": number, "error": str(e)[:200]})
+            continue
+
+        questions.append(question)
+        answers.extend(question_answers)
+        if len(questions) + len(answers) >= IMPORT_BATCH:
+            _flush(questions, answers)
+            stats["questions"] += len(questions)
+            stats["answers"] += len(answers)
+            questions, answers = [], []
+
+    if questions:
+        _flush(questions, answers)
+        stats["questions"] += len(questions)
+        stats["answers"] += len(answers)
+    return stats
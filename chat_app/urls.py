@@ -2,7 +2,8 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import CategoryViewSet, QuestionViewSet, AnswerViewSet
-from .views import get_models, ask_model
+from .views import get_models, ask_model, provider_stats, job_status, search_history
+from . import async_views
 
 
 router = DefaultRouter()
@@ -17,4 +18,14 @@ urlpatterns = [
     path('', include(router.urls)),
     path("models/", get_models, name="models_overview"),
     path("test-query/", ask_model, name="test_query"),
+    path("stats/", provider_stats, name="provider_stats"),
+    path("jobs/<uuid:pk>/", job_status, name="job_status"),  # статус фоновой генерации
+    path("search/", search_history, name="search_history"),  # полнотекстовый поиск по истории
+    # ASGI: async-версии LLM-вьюх (под uvicorn/daphne один воркер держит сотни запросов)
+    path("async/test-query/", async_views.ask_model, name="test_query_async"),
+    path(
+        "async/categories/<uuid:category_pk>/questions/",
+        async_views.create_question,
+        name="question_create_async",
+    ),
 ]
@@ -1,25 +1,199 @@
 # chat_app/utils.py
-from django.core.cache import cache
-from .model_providers.openrouter.query import query_openrouter
+from asgiref.sync import sync_to_async
+from .models import Answer, Question
+from . import completion_cache, conversation, semantic_cache
+from .tokens import Usage, estimate_tokens, estimate_usage
+from .model_providers.openrouter.query import aquery_openrouter, query_openrouter
 from .model_providers.prompt_config import prompt_config
+from .model_providers.image_models import generate_image, query_flux_image
 
-def query_provider(prompt: str, model_type: str, model_id: str, language: str = "en"):
-    """Возвращает: (content, tokens_used, real_used_model)"""
-    cache_key = f"{model_type}_{model_id}_{language}_{hash(prompt)}"
-    if cached := cache.get(cache_key):
-        return cached[0], cached[1], cached[2]
 
+def provider_params(model_type: str, language: str = "en") -> tuple[str, float]:
+    """Системный промпт и температура под тип модели и язык."""
     config = prompt_config.get(model_type, prompt_config["text"])
     system_prompt = config["default_systems"].get(language, config["default_systems"]["en"])
-    
-    content, used_model = query_openrouter(
+    return system_prompt, config["temperature"]
+
+
+def completion_cache_key(
+    prompt: str, model_type: str, model_id: str, language: str = "en", history: list[dict] | None = None
+) -> str:
+    system_prompt, temperature = provider_params(model_type, language)
+    return completion_cache.completion_key(
+        prompt=prompt,
+        model_id=model_id,
+        model_type=model_type,
+        language=language,
+        system_prompt=system_prompt,
+        temperature=temperature,
+        history=history,
+    )
+
+
+def result_usage(result, prompt: str, system_prompt: str, history: list[dict] | None = None) -> Usage:
+    """
+    Usage из Completion; если провайдер его не дал (или результат — обычный
+    кортеж) — локальная оценка. Сообщение «OpenRouter недоступен» — 0 токенов.
+    """
+    content, used_model = result
+    if used_model is None:
+        return Usage()
+    usage = getattr(result, "usage", None)
+    if usage and (usage.prompt_tokens is not None or usage.completion_tokens is not None):
+        return usage
+    messages = [{"content": system_prompt}, *(history or []), {"content": prompt}]
+    return estimate_usage(messages, content)
+
+
+def query_provider(
+    prompt: str, model_type: str, model_id: str, language: str = "en", history: list[dict] | None = None
+):
+    """Возвращает: (content, tokens_used, real_used_model, usage)"""
+    cache_key = completion_cache_key(prompt, model_type, model_id, language, history)
+    if cached := completion_cache.lookup(cache_key):
+        return cached
+
+    system_prompt, temperature = provider_params(model_type, language)
+
+    result = query_openrouter(
+        prompt=prompt,
+        model_id=model_id,
+        language=language,
+        system_prompt=system_prompt,
+        temperature=temperature,
+        history=history,
+    )
+    content, used_model = result
+    usage = result_usage(result, prompt, system_prompt, history)
+
+    completion_cache.store(cache_key, content, usage.total_tokens, used_model, usage)
+    return content, usage.total_tokens, used_model, usage
+
+
+async def aquery_provider(
+    prompt: str, model_type: str, model_id: str, language: str = "en", history: list[dict] | None = None
+):
+    """Асинхронная версия query_provider (тот же кэш и тот же результат)."""
+    cache_key = completion_cache_key(prompt, model_type, model_id, language, history)
+    if cached := await completion_cache.alookup(cache_key):
+        return cached
+
+    system_prompt, temperature = provider_params(model_type, language)
+
+    result = await aquery_openrouter(
         prompt=prompt,
         model_id=model_id,
         language=language,
         system_prompt=system_prompt,
-        temperature=config["temperature"]
+        temperature=temperature,
+        history=history,
+    )
+    content, used_model = result
+    usage = result_usage(result, prompt, system_prompt, history)
+
+    await completion_cache.astore(cache_key, content, usage.total_tokens, used_model, usage)
+    return content, usage.total_tokens, used_model, usage
+
+
+def answer_question(question: Question, language: str = "en", conversation_mode: bool = False) -> Answer:
+    """
+    Синхронно получает ответ модели (текст/код/картинка) и сохраняет Answer.
+    conversation_mode — в промпт идёт история категории (conversation.py).
+    """
+    if question.model_type == Question.IMAGE:
+        image_url, _error = query_flux_image(question.prompt)
+        return Answer.objects.create(
+            question=question,
+            content=image_url,
+            tokens_used=0,
+            model=question.model,  # Для изображений используем исходную модель
+        )
+
+    history = conversation.build_history(question, language) if conversation_mode else []
+    # ответ в контексте треда зависит от истории — семантический кэш только без неё
+    if not history and (similar := semantic_cache.find_answer(question, language)):
+        return copy_answer(question, similar)
+
+    # Получаем content, tokens И реальную модель
+    text, _tokens, used_model, usage = query_provider(
+        prompt=question.prompt,
+        model_type=question.model_type,
+        model_id=question.model,
+        language=language,
+        history=history,
+    )
+    answer = Answer.objects.create(
+        question=question,
+        content=text,
+        model=used_model,  # Сохраняем реально использованную модель
+        **usage.answer_fields(),
+    )
+    if not history:
+        semantic_cache.remember(answer, language)
+    conversation.remember_turn(question, answer)
+    return answer
+
+
+def answer_image(question: Question) -> Answer:
+    """
+    Одна попытка генерации картинки для воркера очереди: ошибки и лимит
+    пробрасываем (ImageRateLimited), повтор и паузу решает jobs.run_job.
+    """
+    image_url = generate_image(question.prompt)
+    return Answer.objects.create(
+        question=question,
+        content=image_url,
+        tokens_used=0,
+        model=question.model,
+    )
+
+
+def answer_failed(answer: Answer) -> bool:
+    """Провайдер не ответил: заглушка «модель недоступна» или ошибка картинки — квоту возвращаем."""
+    return answer.model is None or (answer.content or "").startswith("[Image Error]")
+
+
+def copy_answer(question: Question, source: Answer) -> Answer:
+    """Ответ на почти такой же вопрос (семантический кэш) — без запроса к модели."""
+    return Answer.objects.create(
+        question=question,
+        content=source.content,
+        tokens_used=source.tokens_used,
+        prompt_tokens=source.prompt_tokens,
+        completion_tokens=source.completion_tokens,
+        finish_reason=source.finish_reason,
+        model=source.model,
+    )
+
+
+async def aanswer_question(question: Question, language: str = "en", conversation_mode: bool = False) -> Answer:
+    """Async-версия answer_question: текст/код — без блокировки event loop."""
+    if question.model_type == Question.IMAGE:
+        # FLUX + Cloudinary пока синхронные — уводим в поток
+        return await sync_to_async(answer_question, thread_sensitive=False)(question, language)
+
+    history = []
+    if conversation_mode:
+        history = await sync_to_async(conversation.build_history)(question, language)
+    if not history:
+        similar = await sync_to_async(semantic_cache.find_answer)(question, language)
+        if similar:
+            return await sync_to_async(copy_answer)(question, similar)
+
+    text, _tokens, used_model, usage = await aquery_provider(
+        prompt=question.prompt,
+        model_type=question.model_type,
+        model_id=question.model,
+        language=language,
+        history=history,
+    )
+    answer = await Answer.objects.acreate(
+        question=question,
+        content=text,
+        model=used_model,
+        **usage.answer_fields(),
     )
-    
-    tokens_used = len(content) // 4 if content else 0
-    cache.set(cache_key, (content, tokens_used, used_model), timeout=3600)
-    return content, tokens_used, used_model
+    if not history:
+        semantic_cache.remember(answer, language)
+    conversation.remember_turn(question, answer)
+    return answer
@@ -1,13 +1,33 @@
 # ai-chat-django/chat_app/views.py
+import uuid
 from rest_framework import status, mixins, viewsets
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
 from rest_framework.response import Response
-from django.db.models import F
-from rest_framework.decorators import api_view, permission_classes
-from .models import Category, Question, Answer
-from .serializers import CategorySerializer, QuestionSerializer, AnswerSerializer
+from django.db.models import F, Prefetch
+from rest_framework.decorators import api_view, permission_classes, action
+from django.http import StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from .models import Category, Question, Answer, GenerationJob
+from .serializers import CategorySerializer, CategoryListSerializer, CompareSerializer, QuestionSerializer, AnswerSerializer
+from .pagination import HistoryCursorPagination
 from .model_providers.openrouter.selector import get_top_models
 from .model_providers.openrouter.query import query_openrouter
+from .model_providers.openrouter.client import pool_stats
+from .model_providers.openrouter import health
+from rest_framework.renderers import JSONRenderer
+from .streaming import EventStreamRenderer, stream_answer
+from .compare import stream_comparison
+from .transfer import IMPORT_MAX_BYTES, export_category, import_category
+from .search import get_backend as search_backend
+from rest_framework.utils.urls import replace_query_param
+from . import completion_cache, semantic_cache
+from .jobs import GENERATION_QUEUE_DEFAULT, IMAGE_QUEUE, enqueue, job_payload
+from .utils import answer_failed
+from auth_app import quota
+
+
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 50
 
 
 class CategoryViewSet(
@@ -20,37 +40,179 @@ class CategoryViewSet(
     serializer_class = CategorySerializer
 
     def get_queryset(self):
-        return Category.objects.filter(owner=self.request.user)
+        categories = Category.objects.filter(owner=self.request.user)
+        if self.action == "list":
+            # список — без истории: счётчик и последняя активность одним запросом
+            return categories.with_activity().order_by(F("last_activity").desc(nulls_last=True), "name")
+        # одна категория — с вопросами и ответами, тремя запросами
+        return categories.prefetch_related(
+            Prefetch("questions", queryset=Question.objects.order_by("-created_at").with_answers())
+        )
+
+    def get_serializer_class(self):
+        return CategoryListSerializer if self.action == "list" else CategorySerializer
 
     def perform_create(self, serializer):
         serializer.save(owner=self.request.user)
 
+    @action(detail=True, methods=["get"], url_path="export")
+    def export(self, request, pk=None):
+        """Вопросы и ответы категории потоком NDJSON (память не растёт с размером)."""
+        category = get_object_or_404(Category, pk=pk, owner=request.user)
+        response = StreamingHttpResponse(export_category(category), content_type="application/x-ndjson")
+        response["Content-Disposition"] = f'attachment; filename="category-{category.id}.ndjson"'
+        return response
+
+    @action(detail=True, methods=["post"], url_path="import")
+    def import_questions(self, request, pk=None):
+        """Загрузка NDJSON (поле file) пачками bulk_create — без запросов к моделям."""
+        category = get_object_or_404(Category, pk=pk, owner=request.user)
+        upload = request.FILES.get("file")
+        if upload is None:
+            return Response({"error": "file is required"}, status=status.HTTP_400_BAD_REQUEST)
+        if upload.size > IMPORT_MAX_BYTES:
+            return Response(
+                {"error": "file too large", "max_bytes": IMPORT_MAX_BYTES},
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            )
+        stats = import_category(category, request.user, upload)
+        return Response(stats, status=status.HTTP_201_CREATED)
+
 
 class QuestionViewSet(
     mixins.ListModelMixin, mixins.CreateModelMixin, viewsets.GenericViewSet
 ):
     permission_classes = [IsAuthenticated]
     serializer_class = QuestionSerializer
+    pagination_class = HistoryCursorPagination
 
     def get_queryset(self):
         category_pk = self.kwargs.get("category_pk")
-        return Question.objects.filter(category_id=category_pk, user=self.request.user)
+        return Question.objects.filter(category_id=category_pk, user=self.request.user).with_answers()
 
     def perform_create(self, serializer):
-        serializer.save()
+        kind = serializer.validated_data["model_type"]
+        quota.consume(self.request.user, kind)  # до запроса к модели
+        try:
+            serializer.save()
+        except Exception:
+            # упал провайдер или запись (в т.ч. 429 лимита картинок) — ответа нет
+            quota.refund(self.request.user, kind)
+            raise
+        if answer_failed(serializer.answer):
+            quota.refund(self.request.user, kind)
         self.request.user.quantity = F("quantity") + 1
         self.request.user.save(update_fields=["quantity"])
 
     def create(self, request, *args, **kwargs):
+        if self._use_queue():
+            return self._enqueue(request)
         response = super().create(request, *args, **kwargs)
-        question = Question.objects.get(id=response.data["id"])
+        question = Question.objects.with_answers().get(id=response.data["id"])
         serializer = self.get_serializer(question)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+    def _use_queue(self) -> bool:
+        if IMAGE_QUEUE and self.request.data.get("model_type") == Question.IMAGE:
+            return True
+        flag = self.request.query_params.get("queue")
+        if flag is None:
+            return GENERATION_QUEUE_DEFAULT
+        return flag.lower() in ("1", "true", "yes")
+
+    def _enqueue(self, request):
+        """Вопрос сохраняем сразу, ответ сгенерирует воркер — 202 и id задачи."""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        quota.consume(self.request.user, serializer.validated_data["model_type"])
+        question = serializer.create_question(serializer.validated_data)
+        job = enqueue(
+            question,
+            serializer.validated_data.get("language", "en"),
+            conversation=serializer.validated_data.get("conversation", False),
+        )
+        self.request.user.quantity = F("quantity") + 1
+        self.request.user.save(update_fields=["quantity"])
+        return Response(
+            {"job_id": job.id, "question_id": question.id, "status": job.status},
+            status=status.HTTP_202_ACCEPTED,
+        )
+
+    @action(
+        detail=False,
+        methods=["post"],
+        url_path="stream",
+        renderer_classes=[JSONRenderer, EventStreamRenderer],
+    )
+    def stream(self, request, *args, **kwargs):
+        """Создание вопроса с потоковым ответом (text/event-stream)."""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        if serializer.validated_data["model_type"] == Question.IMAGE:
+            return Response(
+                {"error": "streaming is available for text and code only"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        quota.consume(self.request.user, serializer.validated_data["model_type"])
+        question = serializer.create_question(serializer.validated_data)
+        self.request.user.quantity = F("quantity") + 1
+        self.request.user.save(update_fields=["quantity"])
+
+        response = StreamingHttpResponse(
+            stream_answer(
+                question,
+                serializer.validated_data.get("language", "en"),
+                conversation_mode=serializer.validated_data.get("conversation", False),
+            ),
+            content_type="text/event-stream",
+        )
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"  # nginx/Render не должны буферизовать поток
+        return response
+
+    @action(
+        detail=False,
+        methods=["post"],
+        url_path="compare",
+        renderer_classes=[JSONRenderer, EventStreamRenderer],
+    )
+    def compare(self, request, *args, **kwargs):
+        """
+        Один промпт — несколько моделей параллельно (text/event-stream).
+        Каждый ответ — отдельный Answer одного Question. Квота — один запрос на
+        сравнение: по единице на модель бесплатный тариф (1 в окно) не сравнил бы и двух.
+        """
+        serializer = CompareSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        category = get_object_or_404(Category, id=data["category_id"], owner=request.user)
+
+        quota.consume(request.user, data["model_type"])
+        question = Question.objects.create(
+            prompt=data["prompt"],
+            category=category,
+            user=request.user,
+            model=data["models"][0],
+            model_type=data["model_type"],
+            language=data["language"],
+        )
+        self.request.user.quantity = F("quantity") + 1
+        self.request.user.save(update_fields=["quantity"])
+
+        response = StreamingHttpResponse(
+            stream_comparison(question, data["models"], data["language"]),
+            content_type="text/event-stream",
+        )
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"
+        return response
+
 
 class AnswerViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
     permission_classes = [AllowAny]
     serializer_class = AnswerSerializer
+    pagination_class = HistoryCursorPagination
 
     def get_queryset(self):
         question_pk = self.kwargs.get("question_pk")
@@ -68,10 +230,70 @@ def get_models(request):
 @permission_classes([AllowAny])
 def ask_model(request):
     data = request.data
+    quota.consume(request.user, "text")  # гостю лимит 0 — открытый прокси к модели закрыт
 
     result = query_openrouter(
         prompt=data["prompt"],
         model_id=data["model_id"],
         language=data.get("language", "en"),
     )
+    if result[1] is None:  # «модель недоступна» — запрос не состоялся
+        quota.refund(request.user, "text")
     return Response(result)
+
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def search_history(request):
+    """
+    Поиск по своим вопросам и ответам: ?q=...&category=<id>&limit=&offset=.
+    Выдача по релевантности со сниппетами (совпадения в <mark>).
+    """
+    query = (request.query_params.get("q") or "").strip()
+    if not query:
+        return Response({"error": "q is required"}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        limit = max(1, min(int(request.query_params.get("limit", SEARCH_PAGE_SIZE)), SEARCH_MAX_PAGE_SIZE))
+        offset = max(0, int(request.query_params.get("offset", 0)))
+    except ValueError:
+        return Response({"error": "limit and offset must be integers"}, status=status.HTTP_400_BAD_REQUEST)
+
+    category_id = request.query_params.get("category") or None
+    if category_id:
+        try:
+            category_id = uuid.UUID(category_id)
+        except ValueError:
+            return Response({"error": "invalid category"}, status=status.HTTP_400_BAD_REQUEST)
+
+    hits = search_backend().search(request.user.id, query, category_id=category_id, limit=limit + 1, offset=offset)
+    url = request.build_absolute_uri()
+    next_url = replace_query_param(url, "offset", offset + limit) if len(hits) > limit else None
+    return Response({"query": query, "results": hits[:limit], "next": next_url})
+
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def job_status(request, pk):
+    """Поллинг фоновой генерации: queued → running → done/failed."""
+    job = (
+        GenerationJob.objects.select_related("question")
+        .filter(pk=pk, question__user=request.user)
+        .first()
+    )
+    if job is None:
+        return Response({"error": "job not found"}, status=status.HTTP_404_NOT_FOUND)
+    return Response(job_payload(job))
+
+
+@api_view(["GET"])
+@permission_classes([IsAdminUser])
+def provider_stats(request):
+    """Счётчики пула соединений к OpenRouter (по текущему воркеру), кэшей ответов и здоровья моделей."""
+    top = get_top_models()
+    models = [m["model_id"] for kind in ("code_models", "text_models") for m in top.get(kind, [])]
+    return Response({
+        "openrouter_pool": pool_stats(),
+        "completion_cache": completion_cache.stats(),
+        "semantic_cache": semantic_cache.stats(),
+        "model_health": health.report(models),
+    })
@@ -17,7 +17,7 @@ class DiagramAdmin(admin.ModelAdmin):
 
 @admin.register(DiagramRevision)
 class DiagramRevisionAdmin(admin.ModelAdmin):
-    list_display = ("diagram", "short_note", "created_at")
+    list_display = ("diagram", "short_note", "is_snapshot", "created_at")
     search_fields = ("diagram__title", "note")
     date_hierarchy = "created_at"
 
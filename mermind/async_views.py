@@ -0,0 +1,53 @@
+# mermind/async_views.py
+from django.http import JsonResponse
+from chat_app.async_api import async_api_view
+from .services.openrouter_mermaid import aadjust, agenerate
+from .services import generation_cache
+from auth_app import quota
+from .views import PROVIDER_UNAVAILABLE, REFUND_WARNINGS, adjusted, generated, has_mermaid_header, wants_fresh
+
+
+@async_api_view()
+async def generate_mermaid(request):
+    """Async-двойник /generate/: тот же контракт ответа."""
+    text = (request.data.get("text") or "").strip()
+    prefer_type = (request.data.get("type") or "").strip()
+    lang = request.data.get("language") or "ru"
+    model_id = request.data.get("model_id") or request.data.get("model")
+    if not text:
+        return JsonResponse({"error": "empty text"}, status=400)
+    fresh = wants_fresh(request.data)
+    if not fresh and (hit := await generation_cache.alookup(request.api_user, text, prefer_type, lang, model_id)):
+        return JsonResponse(generated(*hit[0], cached=True, diagram_id=hit[1]))
+    await quota.aconsume(request.api_user, "diagram")
+    try:
+        t, code, warnings, used_model = await agenerate(text, prefer_type, lang, model_id)
+    except RuntimeError:
+        await quota.arefund(request.api_user, "diagram")
+        return JsonResponse({"error": PROVIDER_UNAVAILABLE}, status=503)
+    if not has_mermaid_header(code):
+        await quota.arefund(request.api_user, "diagram")
+        return JsonResponse({"error": PROVIDER_UNAVAILABLE}, status=503)
+    if REFUND_WARNINGS.intersection(warnings):
+        await quota.arefund(request.api_user, "diagram")
+    await generation_cache.astore(text, prefer_type, lang, model_id, t, code, warnings, used_model)
+    return JsonResponse(generated(t, code, warnings, used_model))
+
+
+@async_api_view()
+async def adjust_mermaid(request):
+    """Async-двойник /adjust/."""
+    code = (request.data.get("code") or "").strip()
+    t = request.data.get("type") or "flowchart"
+    instr = (request.data.get("instruction") or "").strip()
+    lang = "ru"
+    model = request.data.get("model_id") or request.data.get("model")
+
+    if not code or not instr:
+        return JsonResponse({"error": "empty code or instruction"}, status=400)
+    await quota.aconsume(request.api_user, "diagram")
+
+    fixed, warnings, used, mode = await aadjust(code, t, instr, lang, model)
+    if REFUND_WARNINGS.intersection(warnings):
+        await quota.arefund(request.api_user, "diagram")
+    return JsonResponse(adjusted(t, fixed, used, warnings, mode))
@@ -0,0 +1,91 @@
+# Generated by Django 5.1.3 on 2026-10-18 06:58
+
+from difflib import SequenceMatcher
+from django.db import migrations, models
+
+# Копии mermind.services.revisions на момент миграции: код приложения и
+# MERMIND_REVISION_SNAPSHOT_EVERY из окружения могут измениться, а миграция —
+# нет. Формат дельты тот же: [[i1, i2, [строки]], ...].
+SNAPSHOT_EVERY = 10
+
+
+def diff_lines(old, new):
+    a, b = old.splitlines(keepends=True), new.splitlines(keepends=True)
+    return [
+        [i1, i2, b[j1:j2]]
+        for tag, i1, i2, j1, j2 in SequenceMatcher(None, a, b, autojunk=False).get_opcodes()
+        if tag != "equal"
+    ]
+
+
+def apply_delta(old, delta):
+    lines = old.splitlines(keepends=True)
+    for i1, i2, replacement in reversed(delta):
+        lines[i1:i2] = replacement
+    return "".join(lines)
+
+
+def delta_size(delta):
+    return sum(len(line) for _i1, _i2, lines in delta for line in lines) + 8 * len(delta)
+
+
+def compact_revisions(apps, schema_editor):
+    """Старые ревизии — полные копии: между снимками переводим их в дельты."""
+    DiagramRevision = apps.get_model("mermind", "DiagramRevision")
+    diagram_ids = DiagramRevision.objects.values_list("diagram_id", flat=True).order_by().distinct()
+    for diagram_id in diagram_ids.iterator():
+        previous, since_snapshot, changed = None, 0, []
+        for revision in DiagramRevision.objects.filter(diagram_id=diagram_id).order_by("id").iterator():
+            code = revision.code
+            if previous is not None and since_snapshot + 1 < SNAPSHOT_EVERY:
+                delta = diff_lines(previous, code)
+                if delta_size(delta) < len(code):
+                    revision.code, revision.delta, revision.is_snapshot = "", delta, False
+                    changed.append(revision)
+                    since_snapshot += 1
+                    previous = code
+                    continue
+            since_snapshot, previous = 0, code
+        DiagramRevision.objects.bulk_update(changed, ["code", "delta", "is_snapshot"], batch_size=500)
+
+
+def expand_revisions(apps, schema_editor):
+    """Обратно: каждую ревизию — снова полной копией."""
+    DiagramRevision = apps.get_model("mermind", "DiagramRevision")
+    diagram_ids = DiagramRevision.objects.filter(is_snapshot=False).values_list("diagram_id", flat=True).order_by().distinct()
+    for diagram_id in diagram_ids.iterator():
+        code, changed = "", []
+        for revision in DiagramRevision.objects.filter(diagram_id=diagram_id).order_by("id").iterator():
+            if revision.is_snapshot:
+                code = revision.code
+                continue
+            code = apply_delta(code, revision.delta or [])
+            revision.code, revision.delta, revision.is_snapshot = code, None, True
+            changed.append(revision)
+        DiagramRevision.objects.bulk_update(changed, ["code", "delta", "is_snapshot"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mermind', '0002_alter_diagram_options_alter_diagramrevision_options_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='diagramrevision',
+            name='delta',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='diagramrevision',
+            name='is_snapshot',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AlterField(
+            model_name='diagramrevision',
+            name='code',
+            field=models.TextField(blank=True),
+        ),
+        migrations.RunPython(compact_revisions, expand_revisions),
+    ]
@@ -47,7 +47,11 @@ class DiagramRevision(models.Model):
     diagram = models.ForeignKey(
         Diagram, on_delete=models.CASCADE, related_name="revisions"
     )
-    code = models.TextField()
+    # снимок хранит code целиком, остальные — delta от предыдущей ревизии
+    # (services/revisions.py); code у них пустой, читать через revisions.page()
+    code = models.TextField(blank=True)
+    delta = models.JSONField(null=True, blank=True)
+    is_snapshot = models.BooleanField(default=True)
     note = models.CharField(max_length=200, blank=True)
     created_at = models.DateTimeField(auto_now_add=True, db_index=True)
 
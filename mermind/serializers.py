@@ -3,21 +3,21 @@ from rest_framework import serializers
 from .models import Diagram, DiagramRevision
 
 class DiagramRevisionSerializer(serializers.ModelSerializer):
+    # code у дельт восстанавливает services.revisions.page()
     class Meta:
         model = DiagramRevision
         fields = ("id", "code", "note", "created_at")
 
 class DiagramSerializer(serializers.ModelSerializer):
-    revisions = DiagramRevisionSerializer(many=True, read_only=True)
-
+    # ревизии — отдельно и постранично: GET /api/mermaid/<id>/revisions/
     class Meta:
         model = Diagram
         fields = (
             "id", "title", "source_text", "type", "code",
             "model_used", "language", "warnings", "tags",
-            "created_at", "updated_at", "revisions",
+            "created_at", "updated_at",
         )
-        read_only_fields = ("created_at", "updated_at", "revisions")
+        read_only_fields = ("created_at", "updated_at")
 
 
 class DiagramPatchSerializer(serializers.ModelSerializer):
@@ -0,0 +1,113 @@
+# mermind/services/classifier.py
+import re
+from decouple import config
+
+# Локальный классификатор типа диаграммы: словарь ключевых слов (ru/en) с
+# весами вместо отдельного запроса к LLM. Уверенность — насколько лучший тип
+# оторвался от второго; ниже порога решение отдаём модели (openrouter_mermaid).
+LOCAL_CONFIDENCE = config("MERMIND_LOCAL_CLASSIFY_CONFIDENCE", default=0.6, cast=float)
+# без сильного правила нужен хотя бы такой вес (по умолчанию — два средних):
+# одно «api» или «статус» — ещё не повод рисовать sequence/state без LLM
+LOCAL_MIN_SCORE = config("MERMIND_LOCAL_CLASSIFY_MIN_SCORE", default=4, cast=int)
+
+STRONG, MEDIUM, WEAK = 3, 2, 1
+
+
+def _rules(*pairs) -> list[tuple[re.Pattern, int]]:
+    return [(re.compile(pattern, re.IGNORECASE), weight) for pattern, weight in pairs]
+
+
+# \b + основа слова: «последовательност» ловит все падежи
+RULES = {
+    "sequence": _rules(
+        (r"\bsequence\s*diagram|\bдиаграмм\w*\s+последовательност", STRONG),
+        (r"\bпоследовательност\w*\s+(вызов|запрос|сообщен)", STRONG),
+        (r"\b(запрос\w*|request\w*)\b.*\b(ответ\w*|response\w*)", MEDIUM),
+        (r"\b(webhook\w*|вебхук\w*|callback\w*|колбэк\w*|api)\b", MEDIUM),
+        (r"\b(клиент|client|фронт\w*|frontend)\b.*\b(сервер\w*|server|бэкенд\w*|backend)", MEDIUM),
+        (r"\b(отправля\w*|присыла\w*|вызыва\w*|sends?|calls?)\b", WEAK),
+    ),
+    "flowchart": _rules(
+        (r"\bflow\s*chart|\bблок-?схем\w*", STRONG),
+        (r"\b(алгоритм\w*|algorithm\w*|workflow|процесс\w*|process\w*)\b", MEDIUM),
+        (r"\b(если|иначе|условие\w*|ветвлени\w*|решени\w*|if|else|decision\w*)\b", WEAK),
+        (r"\b(шаг\w*|этап\w*|steps?)\b", WEAK),
+    ),
+    "state": _rules(
+        (r"\bstate\s*(diagram|machine)|\bдиаграмм\w*\s+состояни|\bконечн\w*\s+автомат", STRONG),
+        (r"\b(состояни\w*|статус\w*|states?|status\w*)\b", MEDIUM),
+        (r"\b(переход\w*|transition\w*|жизненн\w*\s+цикл\w*|lifecycle)\b", MEDIUM),
+    ),
+    "er": _rules(
+        (r"\ber[-\s]?(diagram|диаграмм\w*|модел\w*)|\bentity[-\s]relationship", STRONG),
+        (r"\b(сущност\w*|entit\w*|таблиц\w*|tables?|схем\w*\s+(бд|данных|базы))\b", MEDIUM),
+        (r"\b(баз\w*\s+данных|бд|database|foreign\s+key|внешн\w*\s+ключ\w*|один\s+ко\s+многим)\b", MEDIUM),
+    ),
+    "class": _rules(
+        (r"\bclass\s*diagram|\bдиаграмм\w*\s+класс", STRONG),
+        (r"\b(класс\w*|classes|наследован\w*|inherit\w*|интерфейс\w*|interface\w*)\b", MEDIUM),
+        (r"\b(ооп|oop|метод\w*|methods?|атрибут\w*|attributes?)\b", WEAK),
+    ),
+    "journey": _rules(
+        (r"\b(user|customer)\s+journey|\bпут\w*\s+(пользовател|клиент)\w*|\bcjm\b", STRONG),
+        (r"\b(journey|опыт\w*\s+пользовател\w*|ux)\b", MEDIUM),
+    ),
+    "gantt": _rules(
+        (r"\bgantt|\bгант\w*", STRONG),
+        (r"\b(roadmap|роадмап\w*|дорожн\w*\s+карт\w*|план\w*\s+(работ|проекта)|milestone\w*)\b", MEDIUM),
+        (r"\b(срок\w*|дедлайн\w*|deadline\w*|спринт\w*|sprint\w*|квартал\w*|недел\w*)\b", WEAK),
+    ),
+    "timeline": _rules(
+        (r"\btimeline|\bтаймлайн\w*|\bхронолог\w*", STRONG),
+        (r"\b(истори\w*|history|эпох\w*|веха|вехи)\b", MEDIUM),
+        (r"\b(1[5-9]|20)\d\d\b", WEAK),  # годы
+    ),
+    "pie": _rules(
+        (r"\bpie\s*chart|\bкругов\w*\s+диаграмм\w*", STRONG),
+        (r"\b(дол[яиею]|процент\w*|percent\w*|share|breakdown|распределени\w*)\b", MEDIUM),
+        (r"\d+\s*%", MEDIUM),
+    ),
+    "mindmap": _rules(
+        (r"\bmind\s*map|\bмайнд-?мап\w*|\bинтеллект\w*\s+карт\w*|\bкарт\w*\s+мысл\w*", STRONG),
+        (r"\b(мозгов\w*\s+штурм\w*|brainstorm\w*|иде[ийя]\w*|ideas?)\b", MEDIUM),
+    ),
+    "gitGraph": _rules(
+        (r"\bgit\s*graph|\bgit\b", STRONG),
+        (r"\b(ветк\w*|branch\w*|коммит\w*|commit\w*|merge\w*|мерж\w*|rebase)\b", MEDIUM),
+    ),
+    "quadrant": _rules(
+        (r"\bquadrant|\bквадрант\w*|\b2\s*[xх×]\s*2\b|\bэйзенхауэр\w*|\beisenhower", STRONG),
+        (r"\b(матриц\w*|matrix|приоритизац\w*|prioriti[sz]\w*)\b", MEDIUM),
+    ),
+}
+
+
+def scores(text: str) -> dict[str, int]:
+    """Сумма весов сработавших правил по каждому типу (правило считается один раз)."""
+    return {
+        diagram_type: sum(weight for pattern, weight in rules if pattern.search(text or ""))
+        for diagram_type, rules in RULES.items()
+    }
+
+
+def _has_strong(text: str, diagram_type: str) -> bool:
+    return any(weight >= STRONG and pattern.search(text or "") for pattern, weight in RULES[diagram_type])
+
+
+def classify_local(text: str) -> tuple[str, float]:
+    """
+    (тип, уверенность 0..1). Уверенность — отрыв лучшего типа от второго
+    с поправкой на силу сигнала: одно сильное правило ≈ 0.75, два средних — 0.8.
+    Без сильного правила и с весом ниже LOCAL_MIN_SCORE — 0: тип лишь догадка.
+    """
+    ranked = sorted(scores(text).items(), key=lambda item: item[1], reverse=True)
+    (best_type, best), (_second_type, second) = ranked[0], ranked[1]
+    if best == 0:
+        return "flowchart", 0.0
+    if best < LOCAL_MIN_SCORE and not _has_strong(text, best_type):
+        return best_type, 0.0
+    return best_type, round((best - second) / (best + 1), 3)
+
+
+def is_confident(confidence: float) -> bool:
+    return confidence >= LOCAL_CONFIDENCE
@@ -0,0 +1,96 @@
+# mermind/services/generation_cache.py
+import hashlib
+import json
+from decouple import config
+from django.core.cache import caches
+from chat_app import metrics
+from ..models import Diagram
+
+# Кэш генерации диаграмм: одинаковое описание (с точностью до регистра и
+# пробелов) + тип + язык + модель → готовые type/code/warnings без запроса
+# к OpenRouter. Отдельный алиас кэша (settings.CACHES["diagrams"]) со своим
+# лимитом записей: LocMem при переполнении вытесняет давно не читанные.
+# Второй источник — уже сохранённая диаграмма пользователя с тем же source_text.
+CACHE_ALIAS = "diagrams"
+GENERATION_TTL = config("MERMIND_GENERATION_CACHE_TTL", default=86400, cast=int)
+KEY_VERSION = "v1"
+# результаты с такими предупреждениями не кэшируем: следующая попытка может выйти лучше
+UNCACHEABLE_WARNINGS = {"template_fallback", "syntax_errors"}
+
+
+def normalize_text(text: str) -> str:
+    return " ".join((text or "").split()).casefold()
+
+
+def generation_key(text: str, prefer_type: str | None, language: str, model_id: str | None) -> str:
+    raw = json.dumps(
+        [normalize_text(text), prefer_type or "", language or "ru", model_id or ""],
+        ensure_ascii=False, separators=(",", ":"),
+    )
+    return f"mermind:gen:{KEY_VERSION}:{hashlib.sha256(raw.encode('utf-8')).hexdigest()}"
+
+
+def _cacheable(code: str, warnings: list[str]) -> bool:
+    return bool(code) and not UNCACHEABLE_WARNINGS.intersection(warnings or [])
+
+
+def _pack(t: str, code: str, warnings: list[str], used_model: str) -> tuple:
+    # fallback_used к повтору не относится — из кэша отдаём без него
+    return t, code, [w for w in warnings if w != "fallback_used"], used_model
+
+
+def _saved_diagrams(user, text: str, prefer_type: str | None, language: str):
+    qs = Diagram.objects.filter(user=user, source_text=text.strip(), language=language or "ru")
+    if prefer_type:
+        qs = qs.filter(type=prefer_type)
+    return qs.order_by("-updated_at").only("pk", "type", "code", "warnings", "model_used")
+
+
+def _from_diagram(diagram: Diagram | None):
+    if diagram is None:
+        return None
+    return _pack(diagram.type, diagram.code, list(diagram.warnings or []), diagram.model_used), diagram.pk
+
+
+def lookup(user, text: str, prefer_type: str | None, language: str, model_id: str | None):
+    """
+    ((type, code, warnings, used_model), diagram_id | None) или None.
+    Сначала общий кэш, потом сохранённые диаграммы пользователя.
+    """
+    key = generation_key(text, prefer_type, language, model_id)
+    if value := caches[CACHE_ALIAS].get(key):
+        metrics.incr("diagram_cache.hits")
+        return tuple(value), None
+    if hit := _from_diagram(_saved_diagrams(user, text, prefer_type, language).first()):
+        # в общий кэш не кладём: сохранённая диаграмма — только для её владельца
+        metrics.incr("diagram_cache.diagram_hits")
+        return hit
+    metrics.incr("diagram_cache.misses")
+    return None
+
+
+def store(text: str, prefer_type: str | None, language: str, model_id: str | None,
+          t: str, code: str, warnings: list[str], used_model: str) -> None:
+    if _cacheable(code, warnings):
+        key = generation_key(text, prefer_type, language, model_id)
+        caches[CACHE_ALIAS].set(key, _pack(t, code, warnings, used_model), timeout=GENERATION_TTL)
+
+
+async def alookup(user, text: str, prefer_type: str | None, language: str, model_id: str | None):
+    key = generation_key(text, prefer_type, language, model_id)
+    if value := await caches[CACHE_ALIAS].aget(key):
+        await metrics.aincr("diagram_cache.hits")
+        return tuple(value), None
+    if hit := _from_diagram(await _saved_diagrams(user, text, prefer_type, language).afirst()):
+        await metrics.aincr("diagram_cache.diagram_hits")
+        return hit
+    await metrics.aincr("diagram_cache.misses")
+    return None
+
+
+async def astore(text: str, prefer_type: str | None, language: str, model_id: str | None,
+                 t: str, code: str, warnings: list[str], used_model: str) -> None:
+    if _cacheable(code, warnings):
+        key = generation_key(text, prefer_type, language, model_id)
+        await caches[CACHE_ALIAS].aset(key, _pack(t, code, warnings, used_model), timeout=GENERATION_TTL)
+
@@ -6,6 +6,49 @@ MERMAID_HEADS = (
     "journey", "gantt", "timeline", "pie", "mindmap", "gitgraph", "quadrant",
 )
 
+# первое слово «головы» → тип из prompt_presets.DIAGRAM_TYPES
+HEAD_TYPES = {
+    "flowchart": "flowchart", "graph": "flowchart",
+    "sequencediagram": "sequence",
+    "statediagram": "state", "statediagram-v2": "state",
+    "erdiagram": "er",
+    "classdiagram": "class",
+    "journey": "journey",
+    "gantt": "gantt",
+    "timeline": "timeline",
+    "pie": "pie",
+    "mindmap": "mindmap",
+    "gitgraph": "gitGraph",
+    "quadrantchart": "quadrant",
+}
+
+
+def strip_frontmatter(code: str) -> str:
+    """
+    YAML-шапка `---` … `---` перед заголовком (title, config) — пустыми
+    строками, чтобы номера строк не съехали. Незакрытую шапку не трогаем.
+    """
+    lines = (code or "").splitlines()
+    first = next((i for i, line in enumerate(lines) if line.strip()), None)
+    if first is None or lines[first].strip() != "---":
+        return code or ""
+    for end in range(first + 1, len(lines)):
+        if lines[end].strip() == "---":
+            return "\n" * (end + 1) + "\n".join(lines[end + 1:])
+    return code
+
+
+def type_from_code(code: str) -> str | None:
+    """Тип диаграммы по первой значимой строке кода (None — не Mermaid)."""
+    for line in strip_frontmatter(code).splitlines():
+        stripped = line.strip()
+        if not stripped or stripped.startswith("%%"):
+            continue
+        head = stripped.split()[0].rstrip(":").lower()
+        return HEAD_TYPES.get(head)
+    return None
+
+
 def extract_fenced(text: str) -> str:
     if not text:
         return ""
@@ -1,38 +1,69 @@
 # mermind/services/openrouter_mermaid.py
 import json
-from chat_app.model_providers.openrouter.query import query_openrouter
+import logging
+from asgiref.sync import sync_to_async
+from decouple import config
+from chat_app.model_providers.openrouter import health
+from chat_app.model_providers.openrouter.hedge import HEDGE_ENABLED, HEDGE_FANOUT, AllModelsFailed, hedged_call
+from chat_app.model_providers.openrouter.query import _headers, _payload, aquery_openrouter, complete_once, query_openrouter
 from ..prompt_presets import CLASSIFIER_SYSTEM, DIAGRAM_TYPES, GEN_TEMPLATES
-from .normalize import MERMAID_HEADS, extract_fenced, looks_like_mermaid, normalize_brand_names, sanitize_mermaid
-from .model_pool import pick_next_model_after
+from .normalize import MERMAID_HEADS, looks_like_mermaid, normalize_brand_names, sanitize_mermaid, type_from_code
+from . import model_pool
+from .model_pool import get_model_pool
+from .classifier import classify_local, is_confident
+from .patch import PatchError, apply_patch, numbered, parse_patch
+from .validator import is_valid
+
+logger = logging.getLogger("mermind")
+
+# Тип диаграммы определяем локально (classifier.py). Если уверенности мало —
+# один комбинированный запрос «выбери тип и сразу нарисуй» вместо двух
+# (classify + генерация). False — по-старому: LLM-классификатор, потом генерация.
+COMBINED_PROMPT = config("MERMIND_COMBINED_PROMPT", default=True, cast=bool)
+# /adjust/ для больших диаграмм: модель возвращает построчный патч (patch.py),
+# а не весь код заново; не применился или не прошёл validator — полный режим.
+ADJUST_PATCH = config("MERMIND_ADJUST_PATCH", default=True, cast=bool)
+ADJUST_PATCH_MIN_LINES = config("MERMIND_ADJUST_PATCH_MIN_LINES", default=25, cast=int)
+
+def _classify_prompt(text: str) -> str:
+    return f"Определи тип диаграммы для описания:\n{text}\nВерни только JSON."
+
+
+def _parse_type(out: str) -> str:
+    try:
+        data = json.loads(out)
+        t = data.get("type", "").strip()
+        return t if t in DIAGRAM_TYPES else "flowchart"
+    except Exception:
+        return "flowchart"
+
 
 def classify(text: str, lang: str = "ru", model: str | None = None) -> str:
     """
     Классифицирует тип диаграммы.
     """
-    user = f"Определи тип диаграммы для описания:\n{text}\nВерни только JSON."
     out, _used_model = query_openrouter(
-        prompt=user,
+        prompt=_classify_prompt(text),
         model_id=model,
         language=lang,
         system_prompt=CLASSIFIER_SYSTEM,
         temperature=0.2,
     )
-    try:
-        data = json.loads(out)
-        t = data.get("type", "").strip()
-        return t if t in DIAGRAM_TYPES else "flowchart"
-    except Exception:
-        return "flowchart"
-
+    return _parse_type(out)
 
-def _clean_or_template(code: str, t: str) -> str:
-    c = extract_fenced(code)
-    return c if looks_like_mermaid(c) else GEN_TEMPLATES.get(t, "flowchart TD\nA-->B")
 
+async def aclassify(text: str, lang: str = "ru", model: str | None = None) -> str:
+    out, _used_model = await aquery_openrouter(
+        prompt=_classify_prompt(text),
+        model_id=model,
+        language=lang,
+        system_prompt=CLASSIFIER_SYSTEM,
+        temperature=0.2,
+    )
+    return _parse_type(out)
 
-def generate(text: str, prefer_type: str | None, lang="ru", model: str | None = None):
-    t = prefer_type if prefer_type in MERMAID_HEADS else classify(text, lang, model)
 
+def _generation_prompts(text: str, t: str) -> tuple[str, str]:
     sys = (
         f"Скорректируй Mermaid {t} код.\n"
         f"Верни ТОЛЬКО код Mermaid (без Markdown и пояснений).\n"
@@ -41,6 +72,97 @@ def generate(text: str, prefer_type: str | None, lang="ru", model: str | None =
         f"одним непрерывным блоком (без вставки комментариев между линиями диаграммы)."
     )
     user = f"Описание:\n{text}\nСтартуй коротким рабочим шаблоном."
+    return sys, user
+
+
+def _combined_prompts(text: str, guess: str) -> tuple[str, str]:
+    sys = (
+        f"Выбери лучший тип диаграммы Mermaid для описания ({', '.join(DIAGRAM_TYPES)}) "
+        f"и сразу напиши её код. Если сомневаешься — {guess}.\n"
+        f"Верни ТОЛЬКО код Mermaid (без Markdown и пояснений), первая строка — заголовок диаграммы.\n"
+        f"Отвечай на русском.\n"
+        f"Добавь КОРОТКИЙ блок комментариев на русском с разметкой '%%' В КОНЦЕ кода, "
+        f"одним непрерывным блоком (без вставки комментариев между линиями диаграммы)."
+    )
+    user = f"Описание:\n{text}"
+    return sys, user
+
+
+def _resolve_type(text: str, prefer_type: str | None) -> tuple[str, bool]:
+    """(тип, нужен ли комбинированный запрос). Явный тип и уверенный локальный — без LLM."""
+    if prefer_type in MERMAID_HEADS:
+        return prefer_type, False
+    guess, confidence = classify_local(text)
+    return guess, not is_confident(confidence)
+
+
+def _result(out: str, t: str, combined: bool) -> tuple[str, str]:
+    """(тип, код): в комбинированном режиме тип читаем из заголовка кода."""
+    code = _postprocess(out, t)
+    return (type_from_code(code) or t) if combined else t, code
+
+
+def _postprocess(out: str, t: str) -> str:
+    # без подстановки шаблона: годится ли код, решает validator (шаблон — в самом конце)
+    return normalize_brand_names(sanitize_mermaid(out))
+
+
+def _template(t: str) -> str:
+    # крайний шаблон
+    return normalize_brand_names(GEN_TEMPLATES.get(t, "flowchart TD\nA-->B"))
+
+
+def _hedge_candidates(model: str | None) -> list[str]:
+    # основная модель + следующие по пулу (как pick_next_model_after, только сразу несколько)
+    pool = get_model_pool()
+    if not pool:
+        return [model] if model else []
+    start = pool.index(model) + 1 if model in pool else 0
+    following = [pool[(start + i) % len(pool)] for i in range(len(pool))]
+    alive = [m for m in dict.fromkeys([model, *following]) if m and not health.is_open(m)]
+    return alive[: HEDGE_FANOUT + 1] or ([model] if model else [])
+
+
+def _generate_hedged(sys: str, user: str, t: str, combined: bool, model: str | None):
+    """Основная и запасные модели с перекрытием; побеждает первый код без синтаксических ошибок."""
+    candidates = _hedge_candidates(model)
+    headers = _headers()
+    attempts: list[tuple[str, str]] = []  # (код, модель) — на случай, если валидных не будет
+
+    def call(model_id: str) -> str:
+        out = complete_once(headers, _payload(user, model_id, sys, 0.4))
+        code = _postprocess(out.content, t)
+        attempts.append((code, model_id))
+        return code
+
+    try:
+        code, used = hedged_call(candidates, call, validate=is_valid)
+    except AllModelsFailed:
+        return _best_effort(attempts, t, combined, model)
+    warnings = [] if used == (candidates[0] if candidates else None) else ["fallback_used"]
+    return (type_from_code(code) or t) if combined else t, code, warnings, used
+
+
+def _best_effort(attempts: list[tuple[str, str]], t: str, combined: bool, model: str | None):
+    """
+    Ни одна модель не дала кода без ошибок: отдаём первый ответ, который хотя бы
+    Mermaid (пусть пользователь поправит строку из issues), и только если нет
+    и такого — шаблон.
+    """
+    for code, used in attempts:
+        if looks_like_mermaid(code):
+            return (type_from_code(code) or t) if combined else t, code, ["syntax_errors"], (used or model or "")
+    used = attempts[0][1] if attempts else None
+    return t, _template(t), ["template_fallback"], (used or model or "")
+
+
+def generate(text: str, prefer_type: str | None, lang="ru", model: str | None = None):
+    t, combined = _resolve_type(text, prefer_type)
+    if combined and not COMBINED_PROMPT:
+        t, combined = classify(text, lang, model), False
+    sys, user = _combined_prompts(text, t) if combined else _generation_prompts(text, t)
+    if HEDGE_ENABLED:
+        return _generate_hedged(sys, user, t, combined, model)
 
     out, used = query_openrouter(
         prompt=user,
@@ -49,13 +171,13 @@ def generate(text: str, prefer_type: str | None, lang="ru", model: str | None =
         system_prompt=sys,
         temperature=0.4,
     )
-    code = sanitize_mermaid(_clean_or_template(out, t))
-    code = normalize_brand_names(code)
-    if looks_like_mermaid(code):
-        return t, code, [], (used or model or "")
+    t_out, code = _result(out, t, combined)
+    if is_valid(code):
+        return t_out, code, [], (used or model or "")
+    attempts = [(code, used or model)]
 
     # fallback по пулу (как и было)
-    next_model = pick_next_model_after(used or model)
+    next_model = model_pool.pick_next_model_after(used or model)
     if next_model:
         out2, used2 = query_openrouter(
             prompt=user,
@@ -64,11 +186,161 @@ def generate(text: str, prefer_type: str | None, lang="ru", model: str | None =
             system_prompt=sys,
             temperature=0.3,
         )
-        code2 = sanitize_mermaid(_clean_or_template(out2, t))
-        code2 = normalize_brand_names(code2)
-        if looks_like_mermaid(code2):
-            return t, code2, ["fallback_used"], (used2 or next_model)
+        t2, code2 = _result(out2, t, combined)
+        if is_valid(code2):
+            return t2, code2, ["fallback_used"], (used2 or next_model)
+        attempts.append((code2, used2 or next_model))
 
-    # крайний шаблон
-    tpl = GEN_TEMPLATES.get(t, "flowchart TD\nA-->B")
-    return t, normalize_brand_names(tpl), ["template_fallback"], (used or model or "")
\ No newline at end of file
+    return _best_effort(attempts, t, combined, model)
+
+
+async def agenerate(text: str, prefer_type: str | None, lang="ru", model: str | None = None):
+    """Async-версия generate: те же промпты, fallback и шаблон."""
+    t, combined = _resolve_type(text, prefer_type)
+    if combined and not COMBINED_PROMPT:
+        t, combined = await aclassify(text, lang, model), False
+    sys, user = _combined_prompts(text, t) if combined else _generation_prompts(text, t)
+
+    out, used = await aquery_openrouter(
+        prompt=user,
+        model_id=model,
+        language=lang,
+        system_prompt=sys,
+        temperature=0.4,
+    )
+    t_out, code = _result(out, t, combined)
+    if is_valid(code):
+        return t_out, code, [], (used or model or "")
+    attempts = [(code, used or model)]
+
+    next_model = await sync_to_async(model_pool.pick_next_model_after)(used or model)
+    if next_model:
+        out2, used2 = await aquery_openrouter(
+            prompt=user,
+            model_id=next_model,
+            language=lang,
+            system_prompt=sys,
+            temperature=0.3,
+        )
+        t2, code2 = _result(out2, t, combined)
+        if is_valid(code2):
+            return t2, code2, ["fallback_used"], (used2 or next_model)
+        attempts.append((code2, used2 or next_model))
+
+    return _best_effort(attempts, t, combined, model)
+
+
+# Итерация по инструкции (/adjust/)
+
+def adjust_prompts(t: str, instr: str, code: str) -> tuple[str, str]:
+    system = f"""
+        Ты модифицируешь Mermaid {t} код.
+        Верни ТОЛЬКО код Mermaid в тройных кавычках (fenced), без пояснений.
+        Не добавляй Markdown, описания или текст вне кода.
+        Комментарии внутри кода — только через '%%', строки с '#' не используй.
+        """.strip()
+    user = f"Инструкция:\n{instr}\n\nТекущий код:\n```mermaid\n{code}\n```"
+    return system, user
+
+
+def patch_prompts(t: str, instr: str, code: str) -> tuple[str, str]:
+    system = f"""
+        Ты модифицируешь Mermaid {t} код. Строки кода пронумерованы ("<n>| <строка>").
+        Верни ТОЛЬКО изменения, по одной операции в строке, без пояснений:
+        REP <n> <новая строка> — заменить строку n;
+        INS <n> <новая строка> — вставить после строки n (0 — в начало);
+        DEL <n> — удалить строку n.
+        Номера — по исходному коду. Строки, которые не меняются, не повторяй.
+        Комментарии внутри кода — только через '%%', строки с '#' не используй.
+        """.strip()
+    user = f"Инструкция:\n{instr}\n\nТекущий код:\n{numbered(code)}"
+    return system, user
+
+
+def clean_adjusted(out: str) -> str:
+    fixed = sanitize_mermaid(out)
+    return normalize_brand_names(fixed)
+
+
+def _use_patch(code: str) -> bool:
+    return ADJUST_PATCH and len(code.splitlines()) >= ADJUST_PATCH_MIN_LINES
+
+
+def _patched(code: str, out: str) -> str | None:
+    """Код после патча, если патч разобрался и результат без ошибок."""
+    try:
+        fixed = normalize_brand_names(apply_patch(code, parse_patch(out)))
+    except PatchError as e:
+        logger.info("[adjust] патч отвергнут: %s", e)
+        return None
+    if not is_valid(fixed):
+        logger.info("[adjust] патч даёт невалидный код")
+        return None
+    return fixed
+
+
+def _adjust_best_effort(code: str, attempts: list[tuple[str, str | None]], used):
+    """Валидных правок нет: правка с ошибками лучше, чем ничего; не Mermaid — исходный код."""
+    for fixed, fixed_used in attempts:
+        if looks_like_mermaid(fixed):
+            return fixed, ["syntax_errors"], fixed_used
+    # крайний случай — ничего не ломаем
+    return code, ["no_change"], used
+
+
+def adjust(code: str, t: str, instr: str, lang: str = "ru", model: str | None = None):
+    """
+    (code, warnings, used_model, mode). mode: "patch" — применён патч модели,
+    "full" — модель вернула весь код заново.
+    """
+    if _use_patch(code):
+        system, user = patch_prompts(t, instr, code)
+        out, used = query_openrouter(prompt=user, model_id=model, language=lang, system_prompt=system, temperature=0.1)
+        if fixed := _patched(code, out):
+            return fixed, [], used, "patch"
+
+    system, user = adjust_prompts(t, instr, code)
+    out, used = query_openrouter(prompt=user, model_id=model, language=lang, system_prompt=system, temperature=0.2)
+    fixed = clean_adjusted(out)
+    if is_valid(fixed):
+        return fixed, [], used, "full"
+
+    # fallback -> ротация
+    nm = model_pool.pick_next_model_after(used or model)
+    fixed2 = ""
+    if nm:
+        out2, used2 = query_openrouter(prompt=user, model_id=nm, language=lang, system_prompt=system, temperature=0.2)
+        fixed2 = clean_adjusted(out2)
+        if is_valid(fixed2):
+            return fixed2, ["fallback_used"], used2, "full"
+
+    return (*_adjust_best_effort(code, [(fixed, used), (fixed2, nm)], used or model), "full")
+
+
+async def aadjust(code: str, t: str, instr: str, lang: str = "ru", model: str | None = None):
+    """Async-версия adjust: тот же патч, fallback и ответ."""
+    if _use_patch(code):
+        system, user = patch_prompts(t, instr, code)
+        out, used = await aquery_openrouter(
+            prompt=user, model_id=model, language=lang, system_prompt=system, temperature=0.1
+        )
+        if fixed := _patched(code, out):
+            return fixed, [], used, "patch"
+
+    system, user = adjust_prompts(t, instr, code)
+    out, used = await aquery_openrouter(prompt=user, model_id=model, language=lang, system_prompt=system, temperature=0.2)
+    fixed = clean_adjusted(out)
+    if is_valid(fixed):
+        return fixed, [], used, "full"
+
+    nm = await sync_to_async(model_pool.pick_next_model_after)(used or model)
+    fixed2 = ""
+    if nm:
+        out2, used2 = await aquery_openrouter(
+            prompt=user, model_id=nm, language=lang, system_prompt=system, temperature=0.2
+        )
+        fixed2 = clean_adjusted(out2)
+        if is_valid(fixed2):
+            return fixed2, ["fallback_used"], used2, "full"
+
+    return (*_adjust_best_effort(code, [(fixed, used), (fixed2, nm)], used or model), "full")
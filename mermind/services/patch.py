@@ -0,0 +1,63 @@
+# mermind/services/patch.py
+import re
+from .normalize import extract_fenced
+
+# Построчный патч для /adjust/: модель видит код с номерами строк и вместо
+# всего кода возвращает только операции над ним:
+#   REP <n> <строка>   заменить строку n
+#   INS <n> <строка>   вставить после строки n (0 — в начало)
+#   DEL <n>            удалить строку n
+# Номера — всегда по исходному коду, поэтому порядок операций не важен.
+# Любая строка не по формату — патч отвергается целиком (и /adjust/ уходит
+# на полную перегенерацию).
+_OP = re.compile(r"^(REP|INS|DEL)\s+(\d+)(?: (.*))?$")
+
+
+class PatchError(ValueError):
+    pass
+
+
+def numbered(code: str) -> str:
+    return "\n".join(f"{n}| {line}" for n, line in enumerate(code.splitlines(), start=1))
+
+
+def parse_patch(out: str) -> list[tuple[str, int, str]]:
+    ops = []
+    for raw in extract_fenced(out).splitlines():
+        if not raw.strip():
+            continue
+        m = _OP.match(raw.strip("\r"))
+        if not m:
+            raise PatchError(f"не операция патча: {raw[:60]!r}")
+        op, number, text = m.group(1), int(m.group(2)), m.group(3) or ""
+        if op != "DEL" and not text.strip():
+            raise PatchError(f"{op} {number} без строки")
+        ops.append((op, number, text))
+    if not ops:
+        raise PatchError("пустой патч")
+    return ops
+
+
+def apply_patch(code: str, ops: list[tuple[str, int, str]]) -> str:
+    lines = code.splitlines()
+    replaced: dict[int, str | None] = {}  # None — строка удалена
+    inserted: dict[int, list[str]] = {}
+    for op, number, text in ops:
+        if op == "INS":
+            if not 0 <= number <= len(lines):
+                raise PatchError(f"INS {number}: нет такой строки")
+            inserted.setdefault(number, []).append(text)
+            continue
+        if not 1 <= number <= len(lines):
+            raise PatchError(f"{op} {number}: нет такой строки")
+        if number in replaced:
+            raise PatchError(f"строка {number} изменена дважды")
+        replaced[number] = text if op == "REP" else None
+
+    result = list(inserted.get(0, []))
+    for number, line in enumerate(lines, start=1):
+        new = replaced.get(number, line)
+        if new is not None:
+            result.append(new)
+        result.extend(inserted.get(number, []))
+    return "\n".join(result)
@@ -0,0 +1,85 @@
+# mermind/services/revisions.py
+from difflib import SequenceMatcher
+from decouple import config
+from ..models import DiagramRevision
+
+# Ревизии диаграмм хранятся цепочкой: полный снимок кода, за ним дельты —
+# каждая относительно предыдущей ревизии (по id). Снимок пишем каждые
+# SNAPSHOT_EVERY ревизий и когда дельта выходит не короче самого кода, так что
+# восстановление любой ревизии — не больше SNAPSHOT_EVERY-1 применений дельт.
+# Ревизии, записанные до дельт, миграция 0003 сжала по тем же правилам
+# (с SNAPSHOT_EVERY=10 на момент миграции).
+SNAPSHOT_EVERY = config("MERMIND_REVISION_SNAPSHOT_EVERY", default=10, cast=int)
+
+
+def diff_lines(old: str, new: str) -> list:
+    """
+    Дельта: [[i1, i2, [строки]], ...] — заменить строки old[i1:i2] на строки.
+    Строки — с переводами строк, чтобы восстановление было побайтным.
+    """
+    a, b = old.splitlines(keepends=True), new.splitlines(keepends=True)
+    return [
+        [i1, i2, b[j1:j2]]
+        for tag, i1, i2, j1, j2 in SequenceMatcher(None, a, b, autojunk=False).get_opcodes()
+        if tag != "equal"
+    ]
+
+
+def apply_delta(old: str, delta: list) -> str:
+    lines = old.splitlines(keepends=True)
+    # с конца, чтобы индексы начала не съезжали
+    for i1, i2, replacement in reversed(delta):
+        lines[i1:i2] = replacement
+    return "".join(lines)
+
+
+def _delta_size(delta: list) -> int:
+    return sum(len(line) for _i1, _i2, lines in delta for line in lines) + 8 * len(delta)
+
+
+def record(diagram, previous_code: str | None, note: str) -> None:
+    """Ревизия с текущим кодом диаграммы: снимок или дельта от previous_code."""
+    code = diagram.code
+    if previous_code is not None:
+        revisions = DiagramRevision.objects.filter(diagram=diagram)
+        last_snapshot = revisions.filter(is_snapshot=True).order_by("-id").values_list("id", flat=True).first()
+        since = (
+            revisions.filter(id__gt=last_snapshot).count()
+            if last_snapshot is not None else None
+        )
+        if since is not None and since + 1 < SNAPSHOT_EVERY:
+            delta = diff_lines(previous_code, code)
+            if _delta_size(delta) < len(code):
+                DiagramRevision.objects.create(diagram=diagram, code="", delta=delta, is_snapshot=False, note=note)
+                return
+    DiagramRevision.objects.create(diagram=diagram, code=code, is_snapshot=True, note=note)
+
+
+def page(diagram, limit: int, offset: int) -> tuple[list, bool]:
+    """
+    (ревизии новые сверху с восстановленным .code, есть ли ещё). Читаем только
+    цепочку от ближайшего снимка до самой новой ревизии страницы.
+    """
+    revisions = DiagramRevision.objects.filter(diagram=diagram)
+    ids = list(revisions.order_by("-id").values_list("id", flat=True)[offset: offset + limit + 1])
+    has_more = len(ids) > limit
+    ids = ids[:limit]
+    if not ids:
+        return [], has_more
+
+    oldest, newest = ids[-1], ids[0]
+    base = (
+        revisions.filter(is_snapshot=True, id__lte=oldest).order_by("-id").values_list("id", flat=True).first()
+    )
+    chain = revisions.filter(id__lte=newest).order_by("id")
+    if base is not None:
+        chain = chain.filter(id__gte=base)
+
+    wanted, result, code = set(ids), [], ""
+    for revision in chain:
+        code = revision.code if revision.is_snapshot else apply_delta(code, revision.delta or [])
+        if revision.id in wanted:
+            revision.code = code
+            result.append(revision)
+    result.reverse()
+    return result, has_more
@@ -0,0 +1,299 @@
+# mermind/services/validator.py
+import re
+from dataclasses import dataclass
+from .normalize import strip_frontmatter, type_from_code
+
+# Локальная проверка Mermaid-кода построчно — без рендера и без браузера.
+# Это не полный парсер mermaid.js: ловим то, на чём рендер падает чаще всего
+# (незакрытые блоки и скобки, строки, которые не разбираются грамматикой типа,
+# Markdown-остатки), чтобы решать про fallback на другую модель и показывать
+# пользователю, какая строка сломана.
+ERROR, WARNING = "error", "warning"
+
+
+@dataclass(frozen=True)
+class Problem:
+    line: int  # 1-based; 0 — про весь код
+    message: str
+    level: str = ERROR
+
+    def as_dict(self) -> dict:
+        return {"line": self.line, "level": self.level, "message": self.message}
+
+
+ID = r"[\wЀ-ӿ.$-]+"  # идентификаторы бывают и кириллицей
+_PAIRS = {"(": ")", "[": "]", "{": "}"}
+_CLOSERS = {v: k for k, v in _PAIRS.items()}
+
+
+def _strip_strings(line: str) -> str:
+    """Содержимое "строк" не проверяем на скобки."""
+    return re.sub(r'"[^"]*"', '""', line)
+
+
+def _bracket_problem(line: str) -> str | None:
+    if line.count('"') % 2:
+        return "незакрытая кавычка"
+    stack = []
+    for ch in _strip_strings(line):
+        if ch in _PAIRS:
+            stack.append(ch)
+        elif ch in _CLOSERS:
+            if not stack or stack[-1] != _CLOSERS[ch]:
+                return f"лишняя скобка '{ch}'"
+            stack.pop()
+    return f"незакрытая скобка '{stack[-1]}'" if stack else None
+
+
+def _matches(patterns: list[re.Pattern], line: str) -> bool:
+    return any(p.match(line) for p in patterns)
+
+
+def _compile(*patterns: str) -> list[re.Pattern]:
+    return [re.compile(p, re.IGNORECASE) for p in patterns]
+
+
+# общие для многих типов строки
+COMMON = _compile(r"^title\b", r"^accTitle\s*:", r"^accDescr\b", r"^%%")
+
+FLOW_ARROW = (
+    r"(-{2,}>|-{3,}|-\.+->|-\.+-|={2,}>|={3,}|--\s*[^-]+?\s*-->|-\.\s*[^.]+?\s*\.->|<-{2,}>|--[ox]|-{2,}[ox]"
+    r"|~{3,})"  # ~~~ — невидимая связь
+)
+FLOWCHART = _compile(
+    rf"^.*{FLOW_ARROW}.*$",
+    rf"^{ID}\s*(\[|\(|\{{|>|\[\[|\[\(|\(\(|\{{\{{).*$",  # объявление узла с формой
+    rf"^{ID}@\{{.*\}}$",  # A@{ shape: rect, label: "…" }
+    rf"^{ID}(:::{ID})?$",  # A:::класс
+    r"^(classDef|class|style|linkStyle|click|direction)\b",
+)
+FLOW_DIRECTIONS = {"TD", "TB", "BT", "RL", "LR"}
+
+SEQ_ARROW = r"(<<-{1,2}>>|-{1,2}>>|-{1,2}>|-{1,2}x|-{1,2}\))"
+SEQUENCE = _compile(
+    rf"^{ID}\s*{SEQ_ARROW}\s*[+-]?\s*{ID}\s*:.*$",
+    rf"^(participant|actor)\s+.+$",
+    r"^(note\s+(left of|right of|over)\s+.+:.*)$",
+    r"^(activate|deactivate|destroy|create)\s+.+$",
+    r"^(autonumber)\b.*$",
+    r"^(loop|alt|else|opt|par|and|rect|critical|option|break|box)\b.*$",
+    r"^end$",
+)
+SEQ_BLOCKS = re.compile(r"^(loop|alt|opt|par|rect|critical|break|box)\b", re.IGNORECASE)
+
+STATE = _compile(
+    rf"^(\[\*\]|{ID})\s*-->\s*(\[\*\]|{ID})\s*(:.*)?$",
+    rf"^state\s+.+$",
+    rf"^{ID}\s*:.*$",
+    r"^note\s+(left of|right of)\s+.+$",
+    r"^(direction|classDef|class)\b.*$",
+    r"^(\}|--)$",
+    rf"^{ID}$",
+)
+
+ER_REL = r"(\|\||\|o|o\||\}o|o\{|\}\||\|\{)(--|\.\.)(\|\||\|o|o\||\}o|o\{|\}\||\|\{)"
+ER_REL_RE = re.compile(ER_REL)
+ER = _compile(
+    rf'^({ID}|"[^"]+")\s*{ER_REL}\s*({ID}|"[^"]+")\s*:\s*.+$',
+    rf"^{ID}\s*(\[[^\]]*\])?\s*\{{$",
+    r"^\}$",
+    rf"^{ID}\s+{ID}(\s+(PK|FK|UK)(\s*,\s*(PK|FK|UK))*)?(\s+\"[^\"]*\")?$",  # атрибут внутри сущности
+)
+
+# [тип связи][линия][тип связи]: Animal <|-- Dog, A <|--|> B, A *--o B
+CLASS_REL = r"(<\||\*|o|<)?(--|\.\.)(\|>|\*|o|>)?"
+CLASS_ID = rf"{ID}(~[^~]+~)?"  # дженерик: List~int~
+CLASS = _compile(
+    rf'^{CLASS_ID}\s*("[^"]*")?\s*{CLASS_REL}\s*("[^"]*")?\s*{CLASS_ID}\s*(:.*)?$',
+    rf"^class\s+{ID}.*$",
+    rf"^<<[^<>]+>>\s*{ID}?$",  # аннотация: <<interface>> Animal
+    rf"^{CLASS_ID}\s*:.*$",
+    r"^(note|classDef|cssClass|direction|namespace)\b.*$",
+)
+
+JOURNEY = _compile(r"^section\s+.+$", r"^[^:]+:\s*\d+\s*(:.*)?$")
+GANTT = _compile(
+    r"^(dateFormat|axisFormat|tickInterval|excludes|includes|todayMarker|weekday)\b.*$",
+    r"^section\s+.+$",
+    r"^[^:]+:.+$",
+)
+TIMELINE = _compile(r"^section\s+.+$", r"^[^:]*:.*$", r"^\S.*$")
+PIE = _compile(r'^showData$', r'^"[^"]+"\s*:\s*[0-9]+(\.[0-9]+)?$')
+GIT_REF = r"[\w./-]+"  # feature/login
+GIT = _compile(
+    r"^commit\b.*$",
+    rf"^branch\s+{GIT_REF}.*$",
+    rf"^(checkout|switch)\s+{GIT_REF}$",
+    rf"^merge\s+{GIT_REF}.*$",
+    r"^cherry-pick\s+.+$",
+)
+QUADRANT = _compile(
+    r"^(x-axis|y-axis)\s+.+$",
+    r"^quadrant-[1-4]\s+.+$",
+    r"^[^:]+:\s*\[\s*(0(\.\d+)?|1(\.0+)?)\s*,\s*(0(\.\d+)?|1(\.0+)?)\s*\].*$",
+    r"^(classDef)\b.*$",
+)
+
+GRAMMARS = {
+    "flowchart": FLOWCHART, "sequence": SEQUENCE, "state": STATE, "er": ER, "class": CLASS,
+    "journey": JOURNEY, "gantt": GANTT, "timeline": TIMELINE, "pie": PIE, "gitGraph": GIT,
+    "quadrant": QUADRANT,
+}
+# типы, где скобки — часть синтаксиса строки и должны быть парными
+BRACKETED = {"flowchart", "state", "er", "class", "sequence"}
+# после «:» — свободный текст (сообщение, подпись связи): скобки и кавычки там не считаем
+LABELLED = {"state", "er", "class", "sequence"}
+# асимметричный узел flowchart: A>Флаг] — «>» открывает «]»
+_ASYMMETRIC_NODE = re.compile(r"(\w)>([^\]>]*\])")
+_SEQ_ARROW_RE = re.compile(SEQ_ARROW)
+# многострочная заметка stateDiagram: note right of X … end note
+_STATE_NOTE_START = re.compile(r"^note\s+(left of|right of)\s+[^:]+$", re.IGNORECASE)
+
+
+def _bracket_text(diagram_type: str, line: str) -> str:
+    """Часть строки, в которой скобки должны быть парными."""
+    if diagram_type == "er":
+        line = ER_REL_RE.sub("--", line)  # кардинальности связи — не скобки
+    if diagram_type == "sequence":
+        line = _SEQ_ARROW_RE.sub("->", line, count=1)  # A-)B: «)» — асинхронная стрелка
+    if diagram_type in LABELLED:
+        line = _strip_strings(line).split(":", 1)[0]
+    if diagram_type == "flowchart":
+        line = _ASYMMETRIC_NODE.sub(r"\1[\2", line)
+    # «{» в конце строки — начало блока, его парность — в _check_blocks
+    return line[:-1] if line.endswith("{") else line
+
+
+def _body(code: str):
+    """(номер, строка без отступов) для значимых строк после заголовка."""
+    lines = (code or "").splitlines()
+    header_seen = False
+    for number, raw in enumerate(lines, start=1):
+        line = raw.strip()
+        if not line or line.startswith("%%"):
+            continue
+        if not header_seen:
+            header_seen = True
+            continue
+        yield number, line.rstrip(";").rstrip() or line  # «;» — разделитель операторов
+
+
+def _header(code: str) -> tuple[int, str]:
+    for number, raw in enumerate((code or "").splitlines(), start=1):
+        if raw.strip() and not raw.strip().startswith("%%"):
+            return number, raw.strip()
+    return 0, ""
+
+
+def _check_blocks(diagram_type: str, lines: list[tuple[int, str]]) -> list[Problem]:
+    """Парность subgraph/loop/…/end и { }."""
+    problems = []
+    opened: list[tuple[int, str]] = []
+    for number, line in lines:
+        low = line.lower()
+        if diagram_type == "flowchart" and low.startswith("subgraph"):
+            opened.append((number, "subgraph"))
+        elif diagram_type == "sequence" and SEQ_BLOCKS.match(line):
+            opened.append((number, low.split()[0]))
+        elif diagram_type in ("state", "er", "class") and line.endswith("{"):
+            opened.append((number, "{"))
+        elif (diagram_type in ("flowchart", "sequence") and low == "end") or (
+            diagram_type in ("state", "er", "class") and line == "}"
+        ):
+            if not opened:
+                problems.append(Problem(number, f"'{line}' без открытого блока"))
+            else:
+                opened.pop()
+    problems += [Problem(number, f"блок '{kind}' не закрыт") for number, kind in opened]
+    return problems
+
+
+def _check_git(lines: list[tuple[int, str]]) -> list[Problem]:
+    problems, branches = [], {"main", "master"}
+    for number, line in lines:
+        parts = line.split()
+        if parts[0] == "branch" and len(parts) > 1:
+            branches.add(parts[1])
+        elif parts[0] in ("checkout", "switch", "merge") and len(parts) > 1 and parts[1] not in branches:
+            problems.append(Problem(number, f"ветка '{parts[1]}' не объявлена"))
+    return problems
+
+
+def validate(code: str) -> list[Problem]:
+    """Проблемы кода: ошибки (рендер, скорее всего, упадёт) и предупреждения."""
+    if not (code or "").strip():
+        return [Problem(0, "пустой код")]
+    if "```" in code:
+        return [Problem(0, "остатки Markdown (```) в коде")]
+    code = strip_frontmatter(code)
+
+    header_line, header = _header(code)
+    diagram_type = type_from_code(code)
+    if diagram_type is None:
+        return [Problem(header_line, f"неизвестный заголовок диаграммы: {header[:40]!r}")]
+
+    problems: list[Problem] = []
+    if diagram_type == "flowchart":
+        parts = header.rstrip(";").split()
+        if len(parts) > 1 and parts[1].upper() not in FLOW_DIRECTIONS:
+            problems.append(Problem(header_line, f"неизвестное направление '{parts[1]}'"))
+
+    lines = list(_body(code))
+    if not lines and diagram_type not in ("mindmap", "gitGraph"):
+        problems.append(Problem(header_line, "диаграмма без содержимого", WARNING))
+
+    grammar = GRAMMARS.get(diagram_type)
+    in_entity = in_note = False
+    for number, line in lines:
+        if in_note:  # текст заметки — свободный
+            in_note = line.lower() != "end note"
+            continue
+        if diagram_type == "state" and _STATE_NOTE_START.match(line):
+            in_note = True
+            continue
+        if line.startswith("#"):
+            problems.append(Problem(number, "комментарий через '#': в Mermaid — '%%'", WARNING))
+            continue
+        if diagram_type in ("er", "class"):
+            # внутри { } — атрибуты/члены, у них своя (свободная) форма
+            if line.endswith("{"):
+                in_entity = True
+            elif line == "}":
+                in_entity = False
+                continue
+            elif in_entity:
+                continue
+        if diagram_type in BRACKETED and line != "}" and (issue := _bracket_problem(_bracket_text(diagram_type, line))):
+            problems.append(Problem(number, issue))
+            continue
+        if grammar is None or _matches(COMMON, line) or in_entity:
+            continue
+        if diagram_type == "flowchart" and (line.lower() == "end" or line.lower().startswith("subgraph")):
+            continue
+        if diagram_type == "pie" and line.lower().startswith('"') and not _matches(grammar, line):
+            problems.append(Problem(number, "значение pie должно быть числом: \"Метка\" : 42"))
+            continue
+        if not _matches(grammar, line):
+            problems.append(Problem(number, f"строка не разбирается как {diagram_type}"))
+
+    if in_note:
+        problems.append(Problem(lines[-1][0], "заметка не закрыта: нет 'end note'"))
+    if diagram_type in ("flowchart", "sequence", "state", "er", "class"):
+        problems += _check_blocks(diagram_type, lines)
+    if diagram_type == "gitGraph":
+        problems += _check_git(lines)
+    return sorted(problems, key=lambda p: p.line)
+
+
+def errors(code: str) -> list[Problem]:
+    return [p for p in validate(code) if p.level == ERROR]
+
+
+def is_valid(code: str) -> bool:
+    """Нет ошибок (предупреждения допустимы)."""
+    return not errors(code)
+
+
+def issues(code: str) -> list[dict]:
+    """Проблемы в виде для ответа API."""
+    return [p.as_dict() for p in validate(code)]
@@ -2,6 +2,7 @@
 import json
 import pytest
 from django.contrib.auth import get_user_model
+from django.core.cache import caches
 from rest_framework.test import APIClient
 
 from mermind.services.normalize import (
@@ -12,6 +13,16 @@ from mermind.services.normalize import (
 
 User = get_user_model()
 
+
+@pytest.fixture(autouse=True)
+def _clear_cache():
+    # квоты и здоровье моделей живут в кэше — тесты не должны делить счётчики
+    for c in caches.all():
+        c.clear()
+    yield
+    for c in caches.all():
+        c.clear()
+
 # UNIT-тесты sanitize/normalize
 
 def test_sanitize_moves_preface_comments_and_hash_to_percent():
@@ -151,3 +162,243 @@ def test_adjust_with_fallback_rotation(monkeypatch):
     data = resp.json()
     assert looks_like_mermaid(data["code"])
     assert data.get("used_model")
+
+
+# Локальный классификатор и один запрос к LLM на генерацию
+
+@pytest.mark.parametrize("text, expected", [
+    ("Диаграмма последовательности: фронт шлёт запрос на бэкенд, тот вызывает API YooKassa", "sequence"),
+    ("Состояния подписки и переходы между ними: active, past_due, canceled", "state"),
+    ("Roadmap проекта на квартал, диаграмма Ганта по спринтам", "gantt"),
+    ("ER-модель: таблицы User, Payment, связь один ко многим", "er"),
+    ("Распределение бюджета в процентах: 40% маркетинг, 60% разработка", "pie"),
+    ("git: ветка feature, два коммита, merge в main", "gitGraph"),
+])
+def test_local_classifier_is_confident_on_clear_requests(text, expected):
+    from mermind.services.classifier import classify_local, is_confident
+
+    t, confidence = classify_local(text)
+    assert t == expected
+    assert is_confident(confidence)
+
+
+@pytest.mark.parametrize("text", ["Нарисуй схему нашего API", "Покажи статус заказа", "Наш процесс найма"])
+def test_local_classifier_is_not_confident_on_a_single_weak_signal(text):
+    from mermind.services.classifier import classify_local, is_confident
+
+    assert not is_confident(classify_local(text)[1])
+
+
+@pytest.mark.django_db
+def test_generate_uses_single_round_trip(monkeypatch):
+    from mermind.services import openrouter_mermaid as om
+
+    calls = []
+
+    def _fake_query(**kw):
+        calls.append(kw)
+        return "```mermaid\nstateDiagram-v2\n[*] --> Active\n```", "m1"
+
+    monkeypatch.setattr(om, "query_openrouter", _fake_query)
+    monkeypatch.setattr(om, "classify", lambda *a, **kw: pytest.fail("LLM-классификатор не нужен"))
+
+    # уверенно — обычный промпт генерации под локально найденный тип
+    t, code, warnings, _used = om.generate("Состояния заказа и переходы между статусами", "", "ru")
+    assert (t, warnings) == ("state", [])
+    assert len(calls) == 1 and "Mermaid state" in calls[0]["system_prompt"]
+
+    # неуверенно — один комбинированный запрос, тип берём из заголовка ответа
+    for text in ("Что-нибудь про котиков", "Нарисуй схему нашего API"):
+        calls.clear()
+        t, code, warnings, _used = om.generate(text, "", "ru")
+        assert len(calls) == 1 and "Выбери лучший тип" in calls[0]["system_prompt"]
+        assert t == "state" and code.startswith("stateDiagram-v2")
+
+
+# Локальный валидатор Mermaid
+
+@pytest.mark.parametrize("code", [
+    "flowchart TD\n  A[Старт] --> B{Оплата?}\n  B -->|нет| C\n  subgraph S\n    C --> D\n  end",
+    "sequenceDiagram\n  participant U\n  U->>S: запрос\n  alt ok\n    S-->>U: 200\n  end",
+    "erDiagram\n  USER ||--o{ ORDER : places\n  USER {\n    string id PK\n  }",
+    "classDiagram\n  class Animal {\n    +eat() void\n  }\n  Animal <|-- Dog",
+    "stateDiagram-v2\n  [*] --> Idle\n  Idle --> Busy : start",
+    'pie title Бюджет\n  "Маркетинг" : 40\n  "Разработка" : 60',
+    "gitGraph\n  commit\n  branch dev\n  checkout dev\n  commit",
+    # регрессии: ложные ошибки на валидном Mermaid
+    "graph TD;\n  A-->B;",
+    "flowchart LR\n  A>Флаг] --> B",
+    "sequenceDiagram\n  A->>B: 1) запрос\n  B-->>A: ответ :)",
+    'sequenceDiagram\n  A->>B: он сказал "привет',
+    "sequenceDiagram\n  A<<->>B: синхронизация\n  A<<-->>B: ещё раз",
+    "classDiagram\n  <<interface>> Animal\n  class Dog {\n    <<service>>\n  }\n  Animal <|-- Dog : реализует (частично",
+    "gitGraph\n  commit\n  branch feature/login\n  checkout feature/login\n  commit\n  checkout main\n  merge feature/login",
+    "sequenceDiagram\n  Alice-)John: hi\n  John--)Alice: (ok)",
+    "flowchart LR\n  A ~~~ B",
+    "flowchart LR\n  A:::hot\n  B@{ shape: rect, label: \"Шаг\" }\n  A --> B",
+    "stateDiagram-v2\n  [*] --> X\n  note right of X\n    многострочная заметка (с «скобкой»\n    ещё строка\n  end note",
+    "classDiagram\n  class Box~T~\n  Box~T~ <|-- Crate~int~ : наследует\n  A <|--|> B\n  C *--o D\n  Box~T~ : +List~T~ items",
+    "---\ntitle: Оплата\nconfig:\n  theme: dark\n---\nflowchart TD\n  A --> B",
+])
+def test_validator_accepts_valid_diagrams(code):
+    from mermind.services.validator import errors
+
+    assert errors(code) == []
+
+
+@pytest.mark.parametrize("code, line", [
+    ("flowchart TD\n  A[Старт --> B", 2),
+    ("sequenceDiagram\n  U->>S запрос без двоеточия", 2),
+    ("sequenceDiagram\n  U->>S: a\n  loop каждую минуту\n  S->>U: b", 3),
+    ('pie\n  "A" : 10\n  "B" : много', 3),
+    ("gitGraph\n  commit\n  checkout dev", 3),
+    ("quadrantChart\n  A: [0.3, 1.6]", 2),
+    ("graphics TD\n  A --> B", 1),
+    ("stateDiagram-v2\n  [*] --> X\n  note right of X\n    текст без конца", 4),
+    ("---\ntitle: без закрытия\nflowchart TD\n  A --> B", 1),
+    ("sequenceDiagram\n  A-)B: ok\n  A(-)B: x", 3),
+])
+def test_validator_reports_error_line(code, line):
+    from mermind.services.validator import errors
+
+    assert [p.line for p in errors(code)] == [line]
+
+
+@pytest.mark.django_db
+def test_generate_falls_back_on_syntax_errors(monkeypatch):
+    from mermind.services import openrouter_mermaid as om
+
+    answers = iter([
+        ("flowchart TD\n  A[Старт --> B", "m1"),
+        ("flowchart TD\n  A[Старт] --> B", "m2"),
+    ])
+    monkeypatch.setattr(om, "query_openrouter", lambda **kw: next(answers))
+    monkeypatch.setattr("mermind.services.model_pool.pick_next_model_after", lambda current: "m2")
+
+    t, code, warnings, used = om.generate("блок-схема оплаты", "flowchart", "ru")
+    assert (code, warnings, used) == ("flowchart TD\n  A[Старт] --> B", ["fallback_used"], "m2")
+
+    # обе модели ошиблись — отдаём код с ошибками, а не шаблон
+    answers = iter([("flowchart TD\n  A[Старт --> B", "m1"), ("flowchart TD\n  A{x --> B", "m2")])
+    t, code, warnings, used = om.generate("блок-схема оплаты", "flowchart", "ru")
+    assert (warnings, used) == (["syntax_errors"], "m1")
+
+
+# Кэш генерации
+
+@pytest.mark.django_db
+def test_generate_is_cached_by_normalized_text(monkeypatch):
+    from mermind.models import Diagram
+
+    calls = []
+
+    def _fake_query(**kw):
+        calls.append(kw)
+        return "sequenceDiagram\n  U->>S: запрос", "m1"
+
+    monkeypatch.setattr("mermind.services.openrouter_mermaid.query_openrouter", _fake_query)
+
+    client = APIClient()
+    user = User.objects.create_user(email="c@test.io", password="x")
+    client.force_authenticate(user)
+
+    first = client.post("/api/mermaid/generate/", {"text": "Клиент  шлёт запрос", "type": "sequence"}, format="json")
+    again = client.post("/api/mermaid/generate/", {"text": "клиент шлёт запрос ", "type": "sequence"}, format="json")
+    assert first.status_code == again.status_code == 200
+    assert len(calls) == 1
+    assert (first.json()["cached"], again.json()["cached"]) == (False, True)
+    assert again.json()["code"] == first.json()["code"]
+
+    # сохранённая диаграмма с тем же source_text — только для её владельца
+    diagram = Diagram.objects.create(
+        user=user, source_text="Состояния заказа", type="state", code="stateDiagram-v2\n  [*] --> A", model_used="m0",
+    )
+    resp = client.post("/api/mermaid/generate/", {"text": "Состояния заказа"}, format="json")
+    assert (resp.json()["diagram_id"], resp.json()["code"], len(calls)) == (diagram.pk, diagram.code, 1)
+
+    other = APIClient()
+    other.force_authenticate(User.objects.create_user(email="c2@test.io", password="x", username="other"))
+    resp = other.post("/api/mermaid/generate/", {"text": "Состояния заказа"}, format="json")
+    assert resp.json()["cached"] is False and len(calls) == 2
+
+    # fresh / no_cache — мимо кэша к модели, новый вариант заменяет кэшированный
+    monkeypatch.setattr(
+        "mermind.services.openrouter_mermaid.query_openrouter",
+        lambda **kw: calls.append(kw) or ("sequenceDiagram\n  U->>S: другой запрос", "m1"),
+    )
+    body = {"text": "клиент шлёт запрос", "type": "sequence"}
+    for flag in ({"fresh": True}, {"no_cache": "1"}):
+        resp = client.post("/api/mermaid/generate/", {**body, **flag}, format="json")
+        assert resp.json()["cached"] is False
+    assert len(calls) == 4
+    resp = client.post("/api/mermaid/generate/", body, format="json")
+    assert resp.json()["cached"] is True and "другой запрос" in resp.json()["code"]
+
+
+# Построчный патч в /adjust/
+
+def test_apply_patch_uses_original_line_numbers():
+    from mermind.services.patch import PatchError, apply_patch, parse_patch
+
+    code = "flowchart TD\n  A --> B\n  B --> C\n  C --> D"
+    ops = parse_patch("```\nDEL 2\nINS 3   C --> E\nREP 4   C --> F\nINS 0 %% начало\n```")
+    assert apply_patch(code, ops) == "%% начало\nflowchart TD\n  B --> C\n  C --> E\n  C --> F"
+
+    for bad in ("вот ваш патч", "DEL 9", "REP 2 A\nDEL 2"):
+        with pytest.raises(PatchError):
+            apply_patch(code, parse_patch(bad))
+
+
+@pytest.mark.django_db
+def test_adjust_large_diagram_with_patch_and_full_fallback(monkeypatch):
+    from mermind.services import openrouter_mermaid as om
+
+    monkeypatch.setattr(om, "ADJUST_PATCH_MIN_LINES", 3)
+    code = "flowchart TD\n" + "\n".join(f"  N{i} --> N{i + 1}" for i in range(5))
+    prompts = []
+    answers = iter(["REP 2   N0 --> X", "DEL 1", f"```mermaid\n{code}\n  N5 --> Y\n```"])
+
+    def _fake_query(**kw):
+        prompts.append(kw["system_prompt"])
+        return next(answers), "m1"
+
+    monkeypatch.setattr(om, "query_openrouter", _fake_query)
+
+    fixed, warnings, used, mode = om.adjust(code, "flowchart", "переименуй N1")
+    assert (mode, warnings) == ("patch", [])
+    assert fixed.splitlines()[1] == "  N0 --> X" and len(fixed.splitlines()) == 6
+    assert "REP <n>" in prompts[0]
+
+    # патч ломает диаграмму (удалён заголовок) — полный режим
+    fixed, warnings, used, mode = om.adjust(code, "flowchart", "добавь Y")
+    assert (mode, warnings) == ("full", [])
+    assert fixed.endswith("N5 --> Y") and len(prompts) == 3
+
+
+# Ревизии: снимки + дельты
+
+@pytest.mark.django_db
+def test_revisions_are_deltas_and_reconstruct_on_demand(monkeypatch):
+    from mermind.models import Diagram, DiagramRevision
+    from mermind.services import revisions
+
+    monkeypatch.setattr(revisions, "SNAPSHOT_EVERY", 4)
+    client = APIClient()
+    user = User.objects.create_user(email="r@test.io", password="x")
+    client.force_authenticate(user)
+
+    base = "flowchart TD\n" + "\n".join(f"  N{i} --> N{i + 1}" for i in range(20))
+    versions = [base.replace("N3 -->", f"V{v} -->") for v in range(9)]
+    diagram = Diagram.objects.create(user=user, source_text="s", type="flowchart", code=versions[0])
+    for code in versions[1:]:
+        assert client.post("/api/mermaid/save/", {"id": diagram.pk, "code": code}, format="json").status_code == 200
+
+    assert list(DiagramRevision.objects.order_by("id").values_list("is_snapshot", flat=True)) == [
+        True, False, False, False, True, False, False, False, True,
+    ]
+    assert "revisions" not in client.get(f"/api/mermaid/{diagram.pk}/").json()
+
+    page = client.get(f"/api/mermaid/{diagram.pk}/revisions/?limit=5").json()
+    rest = client.get(page["next"]).json()
+    assert rest["next"] is None
+    assert [r["code"] for r in page["results"] + rest["results"]] == versions[::-1]
@@ -1,6 +1,6 @@
 # mermind/urls.py
 from django.urls import path
-from . import views
+from . import views, async_views
 
 urlpatterns = [
     path("generate/", views.generate_mermaid, name="mermind_generate"),
@@ -8,4 +8,8 @@ urlpatterns = [
     path("save/", views.save_diagram, name="mermind_save"),
     path("list/", views.list_diagrams),
     path("<int:pk>/", views.diagram_detail, name="mermind_detail"),  # GET/PATCH/DELETE
+    path("<int:pk>/revisions/", views.diagram_revisions, name="mermind_revisions"),
+    # ASGI: не держат воркер на время генерации
+    path("async/generate/", async_views.generate_mermaid, name="mermind_generate_async"),
+    path("async/adjust/", async_views.adjust_mermaid, name="mermind_adjust_async"),
 ]
@@ -4,18 +4,52 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
+from rest_framework.utils.urls import replace_query_param
 from django.db.models import Q
-from .services.openrouter_mermaid import generate
+from .services.openrouter_mermaid import adjust, generate
+from .services import generation_cache, revisions
 from .models import Diagram
 # from .presets import PRESETS
-from chat_app.model_providers.openrouter.query import query_openrouter
-from .services.normalize import extract_fenced, looks_like_mermaid, normalize_brand_names, sanitize_mermaid
-from .services.model_pool import pick_next_model_after
-from .serializers import DiagramSerializer, DiagramPatchSerializer
+from .services.normalize import type_from_code
+from .services.validator import issues
+from .serializers import DiagramRevisionSerializer, DiagramSerializer, DiagramPatchSerializer
+from auth_app import quota
 
 import logging
 logger = logging.getLogger("mermind")
 
+PROVIDER_UNAVAILABLE = "OpenRouter сейчас недоступен. Попробуйте позже."
+# модель не помогла: отдали шаблон или исходный код без правки — квоту возвращаем
+REFUND_WARNINGS = {"template_fallback", "no_change"}
+REVISIONS_PAGE_SIZE = 20
+REVISIONS_MAX_PAGE_SIZE = 100
+
+
+def has_mermaid_header(code: str) -> bool:
+    # заголовок из известных типов, а не просто префикс («graphics …» раньше проходил)
+    return type_from_code(code) is not None
+
+
+def wants_fresh(data) -> bool:
+    """fresh / no_cache: сгенерировать заново мимо кэша (результат в кэш всё равно кладём)."""
+    value = data.get("fresh", data.get("no_cache"))
+    if isinstance(value, str):
+        return value.lower() in ("1", "true", "yes")
+    return bool(value)
+
+
+def generated(t: str, code: str, warnings: list[str], used_model, cached: bool = False, diagram_id=None) -> dict:
+    """Ответ /generate/; diagram_id — если отдали сохранённую диаграмму пользователя."""
+    data = {"type": t, "code": code, "warnings": warnings, "issues": issues(code), "used_model": used_model,
+            "cached": cached}
+    if diagram_id is not None:
+        data["diagram_id"] = diagram_id
+    return data
+
+
+def adjusted(t: str, code: str, used, warnings: list[str], mode: str) -> dict:
+    return {"type": t, "code": code, "used_model": used, "warnings": warnings, "issues": issues(code), "mode": mode}
+
 
 @api_view(["POST"])
 @permission_classes([IsAuthenticated])
@@ -26,40 +60,25 @@ def generate_mermaid(request):
     model_id = request.data.get("model_id") or request.data.get("model")
     if not text:
         return Response({"error": "empty text"}, status=400)
+    # повтор того же описания — из кэша, без OpenRouter и без списания квоты;
+    # fresh — пользователь просит другой вариант: идём к модели и обновляем кэш
+    fresh = wants_fresh(request.data)
+    if not fresh and (hit := generation_cache.lookup(request.user, text, prefer_type, lang, model_id)):
+        return Response(generated(*hit[0], cached=True, diagram_id=hit[1]), status=200)
+    quota.consume(request.user, "diagram")
     try:
         t, code, warnings, used_model = generate(text, prefer_type, lang, model_id)
-        # если code не начинается с "graph"/"flowchart"/"sequence"/и т.п., тоже считаем ошибкой провайдера
-        if (
-            not code.strip()
-            .lower()
-            .startswith(
-                (
-                    "flowchart",
-                    "graph",
-                    "sequence",
-                    "state",
-                    "er",
-                    "class",
-                    "journey",
-                    "gantt",
-                    "timeline",
-                    "pie",
-                    "mindmap",
-                    "gitgraph",
-                    "quadrant",
-                )
-            )
-        ):
-            return Response(
-                {"error": "OpenRouter сейчас недоступен. Попробуйте позже."}, status=503
-            )
-        return Response(
-            {"type": t, "code": code, "warnings": warnings, "used_model": used_model},
-            status=200)
+        # если у кода нет заголовка известного типа, тоже считаем ошибкой провайдера
+        if not has_mermaid_header(code):
+            quota.refund(request.user, "diagram")
+            return Response({"error": PROVIDER_UNAVAILABLE}, status=503)
+        if REFUND_WARNINGS.intersection(warnings):
+            quota.refund(request.user, "diagram")
+        generation_cache.store(text, prefer_type, lang, model_id, t, code, warnings, used_model)
+        return Response(generated(t, code, warnings, used_model), status=200)
     except RuntimeError:
-        return Response(
-            {"error": "OpenRouter сейчас недоступен. Попробуйте позже."}, status=503
-        )
+        quota.refund(request.user, "diagram")
+        return Response({"error": PROVIDER_UNAVAILABLE}, status=503)
 
 @api_view(["POST"])
 @permission_classes([IsAuthenticated])
@@ -152,6 +171,22 @@ def diagram_detail(request, pk: int):
         obj.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def diagram_revisions(request, pk: int):
+    """История кода диаграммы, новые сверху: ?limit=&offset=."""
+    obj = get_object_or_404(Diagram, pk=pk, user=request.user)
+    try:
+        limit = max(1, min(int(request.query_params.get("limit", REVISIONS_PAGE_SIZE)), REVISIONS_MAX_PAGE_SIZE))
+        offset = max(0, int(request.query_params.get("offset", 0)))
+    except ValueError:
+        return Response({"error": "limit and offset must be integers"}, status=status.HTTP_400_BAD_REQUEST)
+
+    items, has_more = revisions.page(obj, limit, offset)
+    url = request.build_absolute_uri()
+    next_url = replace_query_param(url, "offset", offset + limit) if has_more else None
+    return Response({"results": DiagramRevisionSerializer(items, many=True).data, "next": next_url})
+
 # @api_view(["GET"])
 # @permission_classes([IsAuthenticated])
 # def get_presets(request):
@@ -163,7 +198,9 @@ def adjust_mermaid(request):
     """
     Итерируем код по инструкции:
     вход: { code, type, instruction, model_id? }
-    выход: { type, code, used_model, warnings }
+    выход: { type, code, used_model, warnings, issues, mode }
+    issues — построчные проблемы кода от validator: [{line, level, message}]
+    mode — "patch" (большой код: модель прислала построчный патч) или "full"
     """
     code = (request.data.get("code") or "").strip()
     t = request.data.get("type") or "flowchart"
@@ -173,32 +210,9 @@ def adjust_mermaid(request):
 
     if not code or not instr:
         return Response({"error": "empty code or instruction"}, status=400)
+    quota.consume(request.user, "diagram")
 
-    system = f"""
-        Ты модифицируешь Mermaid {t} код.
-        Верни ТОЛЬКО код Mermaid в тройных кавычках (fenced), без пояснений.
-        Не добавляй Markdown, описания или текст вне кода.
-        Комментарии внутри кода — только через '%%', строки с '#' не используй.
-        """.strip()
-    user = f"Инструкция:\n{instr}\n\nТекущий код:\n```mermaid\n{code}\n```"
-    out, used = query_openrouter(prompt=user, model_id=model, language=lang, system_prompt=system, temperature=0.2)
-
-    fixed = extract_fenced(out)
-    fixed = sanitize_mermaid(out)
-    fixed = normalize_brand_names(fixed)
-    if looks_like_mermaid(fixed):
-        return Response({"type": t, "code": fixed, "used_model": used, "warnings": []})
-
-    # fallback -> ротация
-    nm = pick_next_model_after(used or model)
-    if nm:
-        out2, used2 = query_openrouter(prompt=user, model_id=nm, language=lang, system_prompt=system, temperature=0.2)
-        fixed2 = extract_fenced(out2)
-        fixed2 = sanitize_mermaid(out2)
-        fixed2 = normalize_brand_names(fixed2)
-        if looks_like_mermaid(fixed2):
-            return Response({"type": t, "code": fixed2, "used_model": used2, "warnings": ["fallback_used"]})
-
-    # крайний случай — ничего не ломаем
-    return Response({"type": t, "code": code, "used_model": used or model, "warnings": ["no_change"]})
-
+    fixed, warnings, used, mode = adjust(code, t, instr, lang, model)
+    if REFUND_WARNINGS.intersection(warnings):
+        quota.refund(request.user, "diagram")
+    return Response(adjusted(t, fixed, used, warnings, mode))
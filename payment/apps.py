@@ -8,3 +8,4 @@ class PaymentConfig(AppConfig):
 
     def ready(self):
         import payment.admin
+        import payment.signals  # сброс кэша прав при изменении подписок/платежей
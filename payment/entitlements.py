@@ -0,0 +1,76 @@
+# payment/entitlements.py
+import logging
+from decouple import config
+from django.core.cache import cache
+from django.utils import timezone
+from .models import Subscription
+
+logger = logging.getLogger(__name__)
+
+# Тариф пользователя (guest/free/premium), активные планы и лимиты — одним
+# значением в общем кэше. me_flags и квоты дёргают это на каждый запрос,
+# поэтому в БД ходим только на промахе. Сбрасывают запись сигналы
+# Subscription/KassaPayment (signals.py) и вебхуки (hooks.py); а чтобы
+# подписка «сама» закончилась, TTL не длиннее, чем до ближайшего next_charge_at.
+ENTITLEMENTS_PREFIX = "entitlements:v1:"
+ENTITLEMENTS_TTL = config("ENTITLEMENTS_TTL", default=600, cast=int)
+
+KINDS = ("text", "code", "image", "diagram")
+# FREE = {"text": 100, "code": 100, "image": 1, "diagram": 100}
+LIMITS = {
+    "guest": {kind: 0 for kind in KINDS},
+    "free": {"text": 1, "code": 1, "image": 1, "diagram": 1},
+    "premium": {"text": 3, "code": 3, "image": 1, "diagram": 3},
+}
+
+GUEST = {"tier": "guest", "is_premium": False, "plans": {}, "limits": LIMITS["guest"]}
+
+
+def _key(user_id) -> str:
+    return f"{ENTITLEMENTS_PREFIX}{user_id}"
+
+
+def _load(user_id) -> tuple[dict, int]:
+    """(права, TTL) из БД: активные планы с будущим next_charge_at."""
+    now = timezone.now()
+    active = Subscription.objects.filter(
+        user_id=user_id, status="active", next_charge_at__gt=now
+    ).values_list("plan", "next_charge_at")
+    plans = {plan: next_charge_at for plan, next_charge_at in active}
+    tier = "premium" if plans else "free"
+    ttl = ENTITLEMENTS_TTL
+    if plans:
+        until_expiry = (min(plans.values()) - now).total_seconds()
+        ttl = max(1, min(ttl, int(until_expiry)))
+    entitlements = {
+        "tier": tier,
+        "is_premium": tier == "premium",
+        "plans": {plan: at.isoformat() for plan, at in plans.items()},
+    }
+    return entitlements, ttl
+
+
+def resolve(user) -> dict:
+    """Права пользователя: tier, is_premium, plans {plan: next_charge_at}, limits."""
+    if not getattr(user, "is_authenticated", False):
+        return GUEST
+    entitlements = cache.get(_key(user.pk))
+    if entitlements is None:
+        entitlements, ttl = _load(user.pk)
+        cache.set(_key(user.pk), entitlements, timeout=ttl)
+    # лимиты кэшируем по тарифу, а не копией: правка LIMITS действует сразу
+    return {**entitlements, "limits": LIMITS[entitlements["tier"]]}
+
+
+def invalidate(user_id) -> None:
+    if user_id:
+        cache.delete(_key(user_id))
+        logger.debug("entitlements invalidated user=%s", user_id)
+
+
+def is_premium(user) -> bool:
+    return resolve(user)["is_premium"]
+
+
+def limits(user) -> dict:
+    return LIMITS[resolve(user)["tier"]]
@@ -4,6 +4,7 @@ from datetime import datetime
 from django.utils.timezone import make_aware
 from .models import KassaPayment, Subscription
 from .utils import confirm_payment_in_kassa, update_payment_status
+from .entitlements import invalidate
 from decimal import Decimal, InvalidOperation
 from yookassa import Payment as KPayment
 
@@ -99,6 +100,9 @@ def webhook_succeeded(data):
             kp.information_payment = (kp.information_payment or '') + " [autopay=off]"
             kp.save(update_fields=['information_payment'])
 
+    # права пользователя могли измениться: сигналы ловят save(), но не update()
+    invalidate(kp.user_id)
+
     # 3) отвечаем ОК (важно вернуть 200, чтобы Касса не ретраила)
     return Response(status=200)
 
@@ -147,6 +151,7 @@ def webhook_canceled(data):
 
             # Сохраняем все изменения в базе
             kassa_payment.save()
+            invalidate(kassa_payment.user_id)
 
             # Логируем успешное обновление
             print(f"Платеж {kassa_payment.id} отменен. Статус обновлен на 'canceled'. Причина отмены: {cancellation_reason}")
@@ -187,6 +192,7 @@ def webhook_refund(data):
             
             # Сохраняем данные возврата в базу
             kassa_payment.save()
+            invalidate(kassa_payment.user_id)
             
             return Response(status=200)
         except KassaPayment.DoesNotExist:
@@ -0,0 +1,14 @@
+# payment/signals.py
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .entitlements import invalidate
+from .models import KassaPayment, Subscription
+
+
+@receiver(post_save, sender=Subscription)
+@receiver(post_delete, sender=Subscription)
+@receiver(post_save, sender=KassaPayment)
+@receiver(post_delete, sender=KassaPayment)
+def reset_entitlements(sender, instance, **kwargs):
+    """Подписка или платёж изменились — тариф пересчитаем при следующем обращении."""
+    invalidate(instance.user_id)
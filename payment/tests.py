@@ -2,9 +2,13 @@
 import json
 from types import SimpleNamespace
 from decimal import Decimal
+from datetime import timedelta
 import pytest
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.test import override_settings
+from django.utils import timezone
+from payment import entitlements
 from payment.models import KassaPayment, Subscription, PaymentEventLog
 
 User = get_user_model()
@@ -38,11 +42,19 @@ def webhook_payload(kassa_id, kp_id, sub_type, amount="300.00", event="payment.s
         },
     }
 
+@pytest.fixture(autouse=True)
+def _clear_cache():
+    cache.clear()
+    yield
+    cache.clear()
+
+
 @pytest.mark.django_db
 @override_settings(DJANGO_ENV="local")  # локально наш IP-чек пропускает вебхуки
 def test_payment_succeeded_creates_subscription(client, monkeypatch):
     user = User.objects.create_user(email="u@test.io", password="x")
     kp = make_kp(user, kassa_id="p1", sub_type="monthly")
+    assert entitlements.resolve(user)["tier"] == "free"  # закэшировали «бесплатный» тариф
 
     # 1) пропускаем IP-чек (в реальной вьюхе он импортируется из payment.views)
     monkeypatch.setattr("payment.views.is_valid_webhook_signature", lambda req: True)
@@ -75,6 +87,8 @@ def test_payment_succeeded_creates_subscription(client, monkeypatch):
     assert sub is not None
     assert sub.payment_method_id == "pm-1"
     assert sub.next_charge_at is not None
+    # после оплаты кэш прав сброшен — премиум виден сразу
+    assert entitlements.resolve(user)["tier"] == "premium"
 
     # Записан журнал события
     log = PaymentEventLog.objects.filter(event_id="p1", event_type="payment.succeeded", applied=True).first()
@@ -119,3 +133,22 @@ def test_webhook_rejected_by_ip_check(client):
     assert resp.status_code == 403
     # И в журнал его не пишем (лог пишется только после IP-чека)
     assert PaymentEventLog.objects.count() == 0
+
+
+@pytest.mark.django_db
+def test_entitlements_are_cached_until_subscription_changes(django_assert_num_queries):
+    user = User.objects.create_user(email="e@test.io", password="x")
+    sub = Subscription.objects.create(
+        user=user, plan="yearly", status="active", next_charge_at=timezone.now() + timedelta(seconds=90)
+    )
+    with django_assert_num_queries(1):
+        assert entitlements.resolve(user)["is_premium"]
+    with django_assert_num_queries(0):
+        assert entitlements.resolve(user)["limits"] == entitlements.LIMITS["premium"]
+    # запись живёт не дольше, чем до next_charge_at
+    assert 0 < entitlements._load(user.pk)[1] <= 90
+
+    sub.status = "canceled"
+    sub.save(update_fields=["status", "updated_at"])  # сигнал сбрасывает кэш
+    assert entitlements.resolve(user)["tier"] == "free"
+    assert entitlements.resolve(user)["plans"] == {}
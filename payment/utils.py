@@ -7,6 +7,7 @@ from django.conf import settings
 from yookassa import Payment
 import ipaddress
 from .models import KassaPayment, Coupon, Subscription
+from . import entitlements
 
 import logging
 logger = logging.getLogger(__name__)
@@ -324,15 +325,11 @@ def recent_inflight_payment_exists(user, subscription_type: str, window_seconds:
 def has_active_subscription(user, plan: str) -> bool:
     """
     Есть ли активная подписка (monthly/yearly) с будущим next_charge_at.
+    Смотрим в кэш прав (entitlements), а не в БД.
     """
     if plan not in ('monthly', 'yearly'):
         return False
-    return Subscription.objects.filter(
-        user=user,
-        plan=plan,
-        status='active',
-        next_charge_at__gt=timezone.now(),
-    ).exists()
+    return plan in entitlements.resolve(user)["plans"]
 
 
 def has_active_forever_purchase(user) -> bool:
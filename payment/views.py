@@ -23,6 +23,7 @@ from .utils import (
     has_active_forever_purchase,
     compute_final_amount,
 )
+from . import entitlements
 from .hooks import webhook_waiting_for_capture, webhook_succeeded, webhook_canceled, webhook_refund
 
 logger = logging.getLogger('payments')
@@ -49,17 +50,12 @@ def process_kassa(request):
     # 1) Блок «повторной покупки»
     if subscription_type in ('monthly', 'yearly'):
         # вернём ещё и дату следующего списания для UX
-        existing = Subscription.objects.filter(
-            user=request.user,
-            plan=subscription_type,
-            status='active',
-            next_charge_at__gt=timezone.now(),
-        ).first()
-        if existing:
+        next_charge_at = entitlements.resolve(request.user)["plans"].get(subscription_type)
+        if next_charge_at:
             return Response({
                 "error": "У вас уже есть активная подписка этого типа.",
-                "plan": existing.plan,
-                "next_charge_at": existing.next_charge_at.isoformat(),
+                "plan": subscription_type,
+                "next_charge_at": next_charge_at,
             }, status=status.HTTP_409_CONFLICT)
 
     if subscription_type == 'forever':